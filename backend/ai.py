@@ -1,41 +1,34 @@
 from transformers import  AutoProcessor, AutoModelForImageTextToText, AutoModelForSeq2SeqLM, AutoTokenizer, BitsAndBytesConfig
+from transformers.generation.streamers import BaseStreamer
 import torch
-import requests
 from langchain_openai import ChatOpenAI
-import requests
+from translation import get_translator, TranslationError
 
 def translate_text(text: str, target_lang='pl'):
-    url = "https://translate.googleapis.com/translate_a/single"
-    
-    params = {
-        "client": "gtx",      # <--- To jest klucz! 'gtx' to klient publiczny
-        "sl": "auto",         # Source Language: auto-wykrywanie
-        "tl": target_lang,    # Target Language: na jaki język (np. 'pl')
-        "dt": "t",            # Data Type: 't' oznacza translation
-        "q": text             # Tekst do przetłumaczenia
-    }
+    return translate_texts([text], target_lang)[0]
 
+
+def translate_texts(texts, target_lang='pl'):
+    """
+    Tłumaczy opisy backendem z translation.py (domyślnie lokalny NLLB, z pamięcią tłumaczeń).
+    Przy błędzie zwraca teksty bez tłumaczenia - auto-uzupełnianie nie powinno przez to przepadać.
+    """
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status() 
-        
-        data = response.json()
-        
-        translated_text = "".join([sentence[0] for sentence in data[0] if sentence[0]])
-        
-        return translated_text
-
-    except Exception as e:
-        print(f"Error with translation: {e}")
-        return text
+        return get_translator().translate_batch(texts, target_lang)
+    except TranslationError as e:
+        print(f"❌ Błąd tłumaczenia: {e}")
+        return list(texts)
 
 def get_vlm(vlm_path: str, device: str = "cuda", cache_path: str = "D:/Hackathon/notebook"):
     processor = AutoProcessor.from_pretrained(vlm_path, cache_dir=cache_path)
+    # Generowanie wsadowe wymaga dopełniania z lewej strony
+    processor.tokenizer.padding_side = "left"
 
     vlm_model = AutoModelForImageTextToText.from_pretrained(
         vlm_path,
-        dtype=torch.bfloat16,
+        dtype=torch.bfloat16 if device.startswith("cuda") else torch.float32,
     ).to(device)
+    vlm_model.eval()
     return processor, vlm_model
 
 def get_pllum(api: str):
@@ -54,65 +47,212 @@ def get_pllum(api: str):
     )
     return llm
 
+class BatchTextStreamer(BaseStreamer):
+    """
+    Streamer dla generowania wsadowego: co `every` kroków dekoduje dotychczasowy tekst
+    każdej odpowiedzi i przekazuje go do on_text(indeks w partii, tekst).
+    """
+
+    def __init__(self, tokenizer, on_text, every: int = 8):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self.every = every
+        self.tokens = None
+        self.prompt_seen = False
+        self.steps = 0
+
+    def put(self, value):
+        # Pierwsze wywołanie dostaje tokeny promptu - pomijamy je
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        if self.tokens is None:
+            self.tokens = [[] for _ in range(value.shape[0])]
+        for i, token in enumerate(value.reshape(len(self.tokens), -1).tolist()):
+            self.tokens[i].extend(token)
+        self.steps += 1
+        if self.steps % self.every == 0:
+            self._emit()
+
+    def end(self):
+        self._emit()
+
+    def _emit(self):
+        for i, tokens in enumerate(self.tokens or []):
+            self.on_text(i, self.tokenizer.decode(tokens, skip_special_tokens=True))
+
+
 def inference_vlm(processor, vlm, images, prompt: str, max_length: int):
-    messages = [
-        {
-            "role": "user",
-            "content": [
-                *[{"type": "image", "image": img} for img in images],
-                {"type": "text", "text": prompt},
-            ],
-        }
+    return inference_vlm_batch(processor, vlm, [images], prompt, max_length)[0]
+
+
+def inference_vlm_batch(processor, vlm, images_batch, prompt: str, max_length: int, on_text=None):
+    """
+    Uruchamia jedno generowanie dla wielu zgłoszeń naraz.
+    images_batch to lista list obrazów (jedna lista na zgłoszenie), wynik - lista odpowiedzi.
+    on_text(indeks, tekst) - opcjonalnie otrzymuje częściowe odpowiedzi w trakcie generowania.
+    """
+    conversations = [
+        [
+            {
+                "role": "user",
+                "content": [
+                    *[{"type": "image", "image": img} for img in images],
+                    {"type": "text", "text": prompt},
+                ],
+            }
+        ]
+        for images in images_batch
     ]
 
     inputs = processor.apply_chat_template(
-        messages,
+        conversations,
         add_generation_prompt=True,
         tokenize=True,
         return_dict=True,
         return_tensors="pt",
+        padding=True,
     ).to(vlm.device)
 
-    generated_ids = vlm.generate(
-        **inputs,
-        do_sample=False,
-        max_new_tokens=max_length,
-    )
+    with torch.inference_mode():
+        generated_ids = vlm.generate(
+            **inputs,
+            do_sample=False,
+            max_new_tokens=max_length,
+            streamer=BatchTextStreamer(processor.tokenizer, on_text) if on_text else None,
+        )
 
+    # Przy dopełnianiu z lewej wszystkie prompty kończą się na tej samej pozycji
     prompt_len = inputs["input_ids"].shape[-1]
     gen_only = generated_ids[:, prompt_len:]
 
-    output = processor.batch_decode(
+    outputs = processor.batch_decode(
         gen_only,
         skip_special_tokens=True,
-    )[0].strip()
-    return output
+    )
+    return [output.strip() for output in outputs]
 
 def inference_pllum(pllum, prompt: str):
     response = pllum.invoke(prompt)
     return response
 
-def process_images(processor, vlm, images):
-    DESC_PROMPT = "Can you describe with details how the lost item shown on this image looks like? Focus on the item, do not describe the background."
-    DESC_MAX_RESPONSE_LENTGH = 512
-
-    CL_PROMPT = '''
-    Classify this lost item into one of the categories below. Reply only with the number:
-
-    0 – Documents/Wallets
-    1 – Electronics
-    2 – Clothes/Accessories
-    3 – Keys
-    4 – Jewelry/Watches
-    5 – Cash
-    6 – Other
-    '''
-    CL_MAX_RESPONSE_LENTGH = 32
-    
-    classes = ["dokumenty_i_portfele", "elektronika", "odziez_i_akcesoria", "klucze", "bizuteria_i_zegarki", "pieniadze", "inne"]
-    eng_desc = inference_vlm(processor, vlm, images, DESC_PROMPT, DESC_MAX_RESPONSE_LENTGH)
+
+DESC_PROMPT = "Can you describe with details how the lost item shown on this image looks like? Focus on the item, do not describe the background."
+DESC_MAX_RESPONSE_LENTGH = 512
+
+CL_PROMPT = '''
+Classify this lost item into one of the categories below. Reply only with the number:
+
+0 – Documents/Wallets
+1 – Electronics
+2 – Clothes/Accessories
+3 – Keys
+4 – Jewelry/Watches
+5 – Cash
+6 – Other
+'''
+CL_MAX_RESPONSE_LENTGH = 32
+
+# Tryb jednoprzebiegowy: kategoria i opis w jednej generacji (obrazy kodowane raz)
+# Po zmianie promptów podbij PROMPT_VERSION w cache/cache.py
+COMBINED_PROMPT = '''
+Look at the lost item shown on the image(s). Focus on the item, do not describe the background.
+Answer in exactly this format:
+CATEGORY: <number>
+DESCRIPTION: <detailed description of how the item looks>
+
+Categories:
+0 – Documents/Wallets
+1 – Electronics
+2 – Clothes/Accessories
+3 – Keys
+4 – Jewelry/Watches
+5 – Cash
+6 – Other
+'''
+COMBINED_MAX_RESPONSE_LENTGH = DESC_MAX_RESPONSE_LENTGH + CL_MAX_RESPONSE_LENTGH
+
+CLASSES = ["dokumenty_i_portfele", "elektronika", "odziez_i_akcesoria", "klucze", "bizuteria_i_zegarki", "pieniadze", "inne"]
+
+
+def parse_class_index(answer: str) -> str:
+    digits = [ch for ch in answer if ch.isdigit()]
+    if digits and int(digits[0]) < len(CLASSES):
+        return CLASSES[int(digits[0])]
+    return "inne"
+
+
+def parse_combined_answer(answer: str):
+    """
+    Rozbija odpowiedź w formacie COMBINED_PROMPT na (kategoria lub None, opis po angielsku).
+    """
+    kategoria = None
+    description_lines = []
+    in_description = False
+    for line in answer.splitlines():
+        stripped = line.strip()
+        upper = stripped.upper()
+        if upper.startswith('CATEGORY') and kategoria is None and not in_description:
+            digits = [ch for ch in stripped if ch.isdigit()]
+            if digits and int(digits[0]) < len(CLASSES):
+                kategoria = CLASSES[int(digits[0])]
+        elif upper.startswith('DESCRIPTION'):
+            in_description = True
+            description_lines.append(stripped.split(':', 1)[1].strip() if ':' in stripped else '')
+        elif in_description:
+            description_lines.append(stripped)
+    description = ' '.join(line for line in description_lines if line)
+    if not description:
+        # Model nie trzymał się formatu - bierzemy całą odpowiedź bez linii z kategorią
+        description = ' '.join(
+            line.strip() for line in answer.splitlines() if not line.strip().upper().startswith('CATEGORY')
+        ).strip()
+    return kategoria, description
+
+
+def process_images(processor, vlm, images, single_pass: bool = True):
+    return process_images_batch(processor, vlm, [images], single_pass=single_pass)[0]
+
+
+def process_images_batch(processor, vlm, images_batch, single_pass: bool = True, on_partial=None):
+    """
+    Opis i kategoria dla wielu zgłoszeń.
+    single_pass=True - jedna generacja z COMBINED_PROMPT (obrazy kodowane raz); klasyfikacja
+    osobnym promptem uruchamiana jest tylko dla odpowiedzi bez czytelnej kategorii.
+    single_pass=False - dwa osobne etapy (opis, potem klasyfikacja).
+    on_partial(indeks, opis) - częściowy opis (po angielsku, przed tłumaczeniem) w trakcie generowania.
+    """
+    if single_pass:
+        on_text = None
+        if on_partial:
+            def on_text(i, answer):
+                if 'DESCRIPTION' in answer.upper():
+                    on_partial(i, parse_combined_answer(answer)[1])
+        answers = inference_vlm_batch(
+            processor, vlm, images_batch, COMBINED_PROMPT, COMBINED_MAX_RESPONSE_LENTGH, on_text=on_text
+        )
+        parsed = [parse_combined_answer(answer) for answer in answers]
+        missing = [i for i, (kategoria, _) in enumerate(parsed) if kategoria is None]
+        if missing:
+            class_indexes = inference_vlm_batch(
+                processor, vlm, [images_batch[i] for i in missing], CL_PROMPT, CL_MAX_RESPONSE_LENTGH
+            )
+            for i, class_index in zip(missing, class_indexes):
+                parsed[i] = (parse_class_index(class_index), parsed[i][1])
+        translated = translate_texts([eng_desc for _, eng_desc in parsed])
+        return [
+            {"kategoria": kategoria, "opis": opis}
+            for (kategoria, _), opis in zip(parsed, translated)
+        ]
+
+    eng_descs = inference_vlm_batch(
+        processor, vlm, images_batch, DESC_PROMPT, DESC_MAX_RESPONSE_LENTGH, on_text=on_partial
+    )
     print('we have english description')
-    class_index = inference_vlm(processor, vlm, images, CL_PROMPT, CL_MAX_RESPONSE_LENTGH)
+    class_indexes = inference_vlm_batch(processor, vlm, images_batch, CL_PROMPT, CL_MAX_RESPONSE_LENTGH)
     print('agi achieved internally')
-    pl_desc = translate_text(eng_desc)
-    return {"kategoria": classes[int(class_index)], "opis": pl_desc}
+    translated = translate_texts(eng_descs)
+    return [
+        {"kategoria": parse_class_index(class_index), "opis": opis}
+        for opis, class_index in zip(translated, class_indexes)
+    ]
@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DATABASE_NAME = 'hackathon_data.db'
+
+# Każdy wątek (worker Flask/gunicorn) trzyma jedno otwarte połączenie na plik bazy,
+# więc PRAGMA, cache stron i skompilowane zapytania przeżywają pojedyncze żądanie.
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT_S = 5.0
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # czytelnicy nie blokują się na zapisie urzędu
+    "PRAGMA synchronous=NORMAL",      # w trybie WAL bezpieczne i dużo szybsze niż FULL
+    "PRAGMA cache_size=-16000",       # ~16 MB cache stron na połączenie
+    "PRAGMA mmap_size=268435456",     # 256 MB pamięci mapowanej
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+
+
+def _open_connection(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_S,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _thread_state(path):
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = {}
+    state = pool.get(path)
+    if state is None:
+        state = pool[path] = {'conn': _open_connection(path), 'depth': 0}
+    return state
+
+
+@contextmanager
+def get_connection(path=None):
+    """
+    Zwraca połączenie SQLite przypisane do bieżącego wątku.
+    Najbardziej zewnętrzny blok `with` zatwierdza transakcję (lub ją wycofuje
+    przy wyjątku), zagnieżdżone bloki dzielą tę samą transakcję i działają
+    jako SAVEPOINT - błąd w środku wycofuje tylko zmiany zagnieżdżonego bloku.
+    """
+    state = _thread_state(path or DATABASE_NAME)
+    conn = state['conn']
+    state['depth'] += 1
+    savepoint = f"sp_{state['depth']}" if state['depth'] > 1 else None
+    try:
+        if savepoint:
+            # SAVEPOINT poza transakcją sam by ją otworzył, a RELEASE by ją zatwierdził -
+            # zmiany zagnieżdżonego bloku nie zostałyby wycofane razem z zewnętrznym
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            conn.execute(f"SAVEPOINT {savepoint}")
+        yield conn
+        if savepoint:
+            conn.execute(f"RELEASE {savepoint}")
+        else:
+            conn.commit()
+    except BaseException:
+        if savepoint:
+            # SQLite mógł już wycofać całą transakcję (np. SQLITE_FULL) - wtedy nie ma
+            # punktu zapisu, a błąd ROLLBACK TO przykryłby pierwotny wyjątek
+            if conn.in_transaction:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+        else:
+            conn.rollback()
+        raise
+    finally:
+        state['depth'] -= 1
+
+
+def close_connections():
+    """Zamyka wszystkie połączenia bieżącego wątku (np. przy zamykaniu workera)."""
+    pool = getattr(_local, 'pool', None)
+    if not pool:
+        return
+    for state in pool.values():
+        state['conn'].close()
+    pool.clear()
@@ -1,57 +1,53 @@
 import sqlite3
-from api.office_account import hash_password
+from api.connection import DATABASE_NAME, get_connection
+from api.office_account import hash_password, verify_password, dummy_password_hash
+from api.search import build_fts_query, BM25_WEIGHTS
 import json
 import hashlib
+import time
+
 
-DATABASE_NAME = 'hackathon_data.db'
 def create_records_table():
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS records (
-                md5 TEXT,
-                date TEXT,
-                powiat TEXT,
-                data TEXT
-                );
-        ''')
-        conn.commit()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS records (
+                    md5 TEXT,
+                    date TEXT,
+                    powiat TEXT,
+                    data TEXT
+                    );
+            ''')
         print("SQLite table 'records' ready.")
         return True
     except sqlite3.Error as e:
         print(f"Bład sqlite rekordy", e)
         return False
-    finally:
-        if conn:
-            conn.close()
 
 
 def insert_ds(checksum, data, date_str, powiat):
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-
-        # Przygotowanie krotki z danymi w kolejności odpowiadającej kolumnom
-        data_to_insert = (
-            checksum,
-            date_str,
-            powiat,
-            data
-        )
-
-        # Jawne wymienienie kolumn to dobra praktyka (chroni przed zmianą kolejności w bazie)
-        sql_query = """
-            INSERT INTO records (
-                md5, date, powiat, data
-            ) VALUES (?, ?, ?, ?)
-        """
-
-
-        cursor.execute(sql_query, data_to_insert)
-        conn.commit()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            # Przygotowanie krotki z danymi w kolejności odpowiadającej kolumnom
+            data_to_insert = (
+                checksum,
+                date_str,
+                powiat,
+                data
+            )
+
+            # Jawne wymienienie kolumn to dobra praktyka (chroni przed zmianą kolejności w bazie)
+            # OR REPLACE: ponowne wygenerowanie migawki z tego samego dnia nadpisuje poprzednią
+            sql_query = """
+                INSERT OR REPLACE INTO records (
+                    md5, date, powiat, data
+                ) VALUES (?, ?, ?, ?)
+            """
+
+            cursor.execute(sql_query, data_to_insert)
         print('dodano ds')
         return True
     except sqlite3.IntegrityError as e:
@@ -60,41 +56,60 @@ def insert_ds(checksum, data, date_str, powiat):
     except sqlite3.Error as e:
         print(f"❌ Błąd SQLite podczas dodawania zguby: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 def get_all_datasets(powiat):
     """
     Pobiera wszystkie rekordy z tabeli lost_items.
     Zwraca listę słowników, gdzie klucze to nazwy kolumn.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM records WHERE powiat = ?", (powiat,))
-        rows = cursor.fetchall()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM records WHERE powiat = ?", (powiat,))
+            rows = cursor.fetchall()
         items_list = [dict(row) for row in rows]
         return items_list
     except sqlite3.Error as e:
         print(f"Błąd SQLite podczas pobierania rekordów: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
+
+
+def iter_datasets_meta(powiat, window_days=None, batch_size=500):
+    """
+    Generator migawek powiatu (md5, date, created_at) bez kolumny data, posortowanych po dacie.
+    window_days - tylko migawki z ostatnich N dni, licząc od najnowszej migawki powiatu.
+    """
+    sql_query = "SELECT md5, date, created_at FROM records WHERE powiat = ?"
+    params = [powiat]
+    if window_days:
+        sql_query += " AND date > date((SELECT MAX(date) FROM records WHERE powiat = ?), ?)"
+        params += [powiat, f'-{int(window_days)} days']
+    sql_query += " ORDER BY date"
+    with get_connection() as conn:
+        cursor = conn.execute(sql_query, params)
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield dict(row)
+
+
+def get_manifest_version(powiat):
+    """Wersja listy migawek powiatu (zmienia się przy każdym zapisie do records); 0 - brak migawek."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute("SELECT version FROM manifest_versions WHERE powiat = ?", (powiat,)).fetchone()
+        return row['version'] if row else 0
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas pobierania wersji manifestu: {e}")
+        return None
 
 
 def get_ds(powiat, data_str):
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        sql_query = "SELECT * FROM records WHERE powiat = ? AND date = ?"
-        cursor.execute(sql_query, (powiat, data_str))
-        row = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            sql_query = "SELECT * FROM records WHERE powiat = ? AND date = ?"
+            cursor.execute(sql_query, (powiat, data_str))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         else:
@@ -103,61 +118,274 @@ def get_ds(powiat, data_str):
     except sqlite3.Error as e:
         print(f"❌ SQLite Error while fetching item {powiat},{data_str}: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
-def create_office_accounts_table():
-    conn = None
+def get_ds_info(powiat, data_str):
+    """
+    Pobiera metadane migawki (rowid, md5, date, powiat, kind, created_at) bez wczytywania kolumny data.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            sql_query = "SELECT rowid, md5, date, powiat, kind, created_at FROM records WHERE powiat = ? AND date = ?"
+            cursor.execute(sql_query, (powiat, data_str))
+            row = cursor.fetchone()
+        if row:
+            return dict(row)
+        else:
+            return None
+
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching item {powiat},{data_str}: {e}")
+        return None
+
+
+def iter_ds_data(rowid, chunk_size=64 * 1024):
+    """
+    Generator zwracający treść migawki CSV kawałkami (bajty UTF-8),
+    czytaną przyrostowo przez blob I/O - cały plik nigdy nie trafia do pamięci.
+    """
+    with get_connection() as conn:
+        with conn.blobopen('records', 'data', rowid, readonly=True) as blob:
+            while chunk := blob.read(chunk_size):
+                yield chunk
+
+
+def get_snapshot_before(powiat, data_str):
+    """
+    Zwraca metadane ostatniej migawki powiatu sprzed dnia data_str
+    (rowid, md5, chain_md5, date, kind, last_change) lub None.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT rowid, md5, chain_md5, date, kind, last_change FROM records
+                WHERE powiat = ? AND date < ?
+                ORDER BY date DESC LIMIT 1
+            """, (powiat, data_str))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching snapshot {powiat},{data_str}: {e}")
+        return None
+
+
+def get_latest_snapshot(powiat):
+    """
+    Zwraca metadane najnowszej migawki powiatu (date, md5, kind, last_change) lub None.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT date, md5, kind, last_change FROM records
+                WHERE powiat = ?
+                ORDER BY date DESC LIMIT 1
+            """, (powiat,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching snapshot {powiat}: {e}")
+        return None
+
+
+def count_deltas_since_checkpoint(powiat, data_str):
+    """
+    Liczy migawki przyrostowe zapisane po ostatnim pełnym punkcie kontrolnym sprzed data_str.
+    """
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*) FROM records
+                WHERE powiat = ? AND date < ? AND kind = 'delta' AND date > COALESCE(
+                    (SELECT MAX(date) FROM records WHERE powiat = ? AND date < ? AND kind = 'full'), '')
+            """, (powiat, data_str, powiat, data_str))
+            return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while counting snapshots {powiat}: {e}")
+        return 0
+
+
+def get_checkpoint(powiat, data_str):
+    """
+    Zwraca ostatni pełny punkt kontrolny powiatu z dnia data_str lub wcześniejszy (wraz z kolumną data).
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT rowid, md5, date, data FROM records
+                WHERE powiat = ? AND date <= ? AND kind = 'full'
+                ORDER BY date DESC LIMIT 1
+            """, (powiat, data_str))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching checkpoint {powiat},{data_str}: {e}")
+        return None
+
+
+def iter_snapshot_deltas(powiat, after_date, upto_date):
+    """
+    Generator zwracający (id_ewidencyjny, row) z delt zapisanych w dniach (after_date, upto_date],
+    w kolejności dat. row == None oznacza usunięcie rekordu z wykazu.
+    """
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS office_accounts (
-                user_id TEXT PRIMARY KEY,
-                login TEXT UNIQUE NOT NULL,
-                hashed_password TEXT NOT NULL,
-                office_name TEXT,
-                contact_email TEXT,
-                contact_phone TEXT,
-                address TEXT,
-                powiat TEXT,
-                id_prefix TEXT
-            );
-        """)
-        conn.commit()
+            SELECT id_ewidencyjny, row FROM record_deltas
+            WHERE powiat = ? AND date > ? AND date <= ?
+            ORDER BY date
+        """, (powiat, after_date, upto_date))
+        while rows := cursor.fetchmany(500):
+            for row in rows:
+                yield row['id_ewidencyjny'], row['row']
+
+
+def get_last_change(powiat):
+    """Zwraca numer ostatniej zmiany w powiecie z licznika powiat_changes (0 gdy brak zmian)."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT last_change FROM powiat_changes WHERE powiat = ?", (powiat,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching changes {powiat}: {e}")
+        return None
+
+
+def get_changed_items(powiat, after_seq, upto_seq):
+    """
+    Zwraca listę (id_ewidencyjny, rekord lub None) dla rzeczy zmienionych w powiecie
+    między wpisami dziennika (after_seq, upto_seq], posortowaną po id.
+    None oznacza, że rzecz zniknęła z wykazu powiatu.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT c.id_ewidencyjny AS changed_id, l.*
+                FROM (
+                    SELECT DISTINCT id_ewidencyjny FROM lost_items_changes
+                    WHERE powiat = ? AND seq > ? AND seq <= ?
+                ) c
+                LEFT JOIN lost_items l ON l.id_ewidencyjny = c.id_ewidencyjny AND l.powiat = ?
+                ORDER BY c.id_ewidencyjny
+            """, (powiat, after_seq, upto_seq, powiat))
+            rows = cursor.fetchall()
+        return [(row['changed_id'], dict(row) if row['id_ewidencyjny'] else None) for row in rows]
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching changes {powiat}: {e}")
+        return None
+
+
+def insert_snapshot(powiat, date_str, checksum, kind, last_change, data=None, deltas=(), prune_upto=None, chain_md5=None):
+    """
+    Zapisuje migawkę: pełną (kind='full', CSV w data) lub przyrostową (kind='delta',
+    zmienione wiersze w deltas jako pary (id_ewidencyjny, wiersz CSV lub None)).
+    checksum to md5 treści pełnego CSV, chain_md5 - skrót łańcucha delt (dla pełnej równy checksum).
+    Wpisy dziennika zmian do prune_upto włącznie są już ujęte w migawkach i zostają usunięte.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM record_deltas WHERE powiat = ? AND date = ?", (powiat, date_str))
+            cursor.execute("""
+                INSERT OR REPLACE INTO records (
+                    md5, date, powiat, data, kind, last_change, chain_md5, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (checksum, date_str, powiat, data, kind, last_change, chain_md5 or checksum, time.time()))
+            cursor.executemany(
+                "INSERT INTO record_deltas (powiat, date, id_ewidencyjny, row) VALUES (?, ?, ?, ?)",
+                [(powiat, date_str, item_id, row) for item_id, row in deltas]
+            )
+            if prune_upto:
+                cursor.execute(
+                    "DELETE FROM lost_items_changes WHERE powiat = ? AND seq <= ?", (powiat, prune_upto)
+                )
+        print(f'dodano migawkę {kind} {powiat} {date_str}')
+        return True
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas zapisu migawki: {e}")
+        return False
+
+
+def get_all_powiats():
+    """Zwraca posortowaną listę powiatów, dla których istnieje konto urzędu."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT DISTINCT powiat FROM office_accounts WHERE powiat IS NOT NULL ORDER BY powiat"
+            )
+            return [row['powiat'] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"❌ SQLite Error while fetching powiats: {e}")
+        return []
+
+
+def create_office_accounts_table():
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS office_accounts (
+                    user_id TEXT PRIMARY KEY,
+                    login TEXT UNIQUE NOT NULL,
+                    hashed_password TEXT NOT NULL,
+                    office_name TEXT,
+                    contact_email TEXT,
+                    contact_phone TEXT,
+                    address TEXT,
+                    powiat TEXT,
+                    id_prefix TEXT
+                );
+            """)
         print("SQLite table 'office_accounts' ready.")
         return True
     except sqlite3.Error as e:
         print(f"Błąd SQLite podczas tworzenia tabeli: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
+
+
+# Funkcje login -> None wołane po zapisie konta urzędu (np. AccountCache.invalidate)
+ACCOUNT_CHANGE_LISTENERS = []
+
+
+def notify_account_changed(login):
+    for listener in list(ACCOUNT_CHANGE_LISTENERS):
+        listener(login)
+
+
+def normalize_login(login):
+    """Login w postaci kanonicznej (bez białych znaków na brzegach, małe litery) - tak jest zapisany w bazie."""
+    return login.strip().lower()
 
 
 def save_office_account_to_sqlite(account_object):
-    conn = None
+    login = normalize_login(account_object.login)
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-
-        data_to_insert = (
-            account_object.user_id,
-            account_object.login,
-            account_object.hashed_password,
-            account_object.office_name,
-            account_object.contact_email,
-            account_object.contact_phone,
-            account_object.address,
-            account_object.powiat,
-            account_object.id_prefix,
-        )
-
-        sql_query = "INSERT INTO office_accounts VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)"
-        cursor.execute(sql_query, data_to_insert)
-        conn.commit()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            data_to_insert = (
+                account_object.user_id,
+                login,
+                account_object.hashed_password,
+                account_object.office_name,
+                account_object.contact_email,
+                account_object.contact_phone,
+                account_object.address,
+                account_object.powiat,
+                account_object.id_prefix,
+            )
+
+            sql_query = "INSERT INTO office_accounts VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            cursor.execute(sql_query, data_to_insert)
+        notify_account_changed(login)
         print('no error')
         return True
     except sqlite3.IntegrityError as e:
@@ -166,104 +394,153 @@ def save_office_account_to_sqlite(account_object):
     except sqlite3.Error as e:
         print('error ', e)
         return False
-    finally:
-        if conn:
-            conn.close()
 
 
-def authenticate_user(login, password):
-    conn = None
+def get_office_account(login):
+    """Zwraca konto urzędu (dict) o podanym loginie, None gdy nie istnieje lub w przypadku błędu."""
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT * FROM office_accounts WHERE login = ?", (normalize_login(login),)
+            ).fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        print("Błąd SQLite podczas pobierania konta", e)
+        return None
 
-        cursor.execute("SELECT * FROM office_accounts WHERE login = ?", (login,))
-        account_row = cursor.fetchone()
-        if account_row is False:
-            print('account_row is false')
-            return None
-        provided_hash = hash_password(password)
-        stored_hash = account_row['hashed_password']
-        if provided_hash == stored_hash:
-            return dict(account_row)
-        else:
-            return None
+
+def update_office_account_password(user_id, hashed_password):
+    try:
+        with get_connection() as conn:
+            conn.execute(
+                "UPDATE office_accounts SET hashed_password = ? WHERE user_id = ?", (hashed_password, user_id)
+            )
+            row = conn.execute("SELECT login FROM office_accounts WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            notify_account_changed(row['login'])
+        return True
     except sqlite3.Error as e:
-        print("Błąd SQLite podczas autoryzacji", e)
-    finally:
-        if conn:
-            conn.close()
+        print("Błąd SQLite podczas zmiany hasła", e)
+        return False
+
+
+def authenticate_user(login, password, account=None, lookup=True):
+    """
+    Sprawdza login i hasło. account - konto już pobrane (np. z cache); przy lookup=False
+    brak account oznacza, że konto nie istnieje, inaczej jest czytane z bazy.
+    Stare hashe (SHA-256 bez soli, inny koszt scrypt) są przy poprawnym logowaniu przeliczane
+    i zapisywane - zwrócone konto ma wtedy nowy hashed_password. Zwraca dict konta albo None.
+    """
+    if account is None and lookup:
+        account = get_office_account(login)
+    if account is None:
+        # Ten sam koszt KDF co dla istniejącego konta - czas odpowiedzi nie zdradza loginów
+        verify_password(password, dummy_password_hash())
+        return None
+    ok, needs_rehash = verify_password(password, account['hashed_password'])
+    if not ok:
+        return None
+    if needs_rehash:
+        new_hash = hash_password(password)
+        if update_office_account_password(account['user_id'], new_hash):
+            account = dict(account, hashed_password=new_hash)
+    return account
 
 
 def create_lost_items_table():
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-        # SQLITE TWORZENIE TABELI
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS lost_items (
-                id_ewidencyjny TEXT PRIMARY KEY NOT NULL,
-                powiat TEXT NOT NULL,
-                data_znalezienia TEXT NOT NULL,
-                data_przekazania TEXT,
-                data_publikacji TEXT NOT NULL,
-                kategoria TEXT NOT NULL,
-                opis TEXT NOT NULL,
-                miejsce_znalezienia TEXT,
-                adres_odbioru TEXT NOT NULL,
-                email_kontaktowy TEXT NOT NULL,
-                telefon_kontaktowy TEXT NOT NULL,
-                status TEXT NOT NULL
-            );
-        """)
-        conn.commit()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # SQLITE TWORZENIE TABELI
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS lost_items (
+                    id_ewidencyjny TEXT PRIMARY KEY NOT NULL,
+                    powiat TEXT NOT NULL,
+                    data_znalezienia TEXT NOT NULL,
+                    data_przekazania TEXT,
+                    data_publikacji TEXT NOT NULL,
+                    kategoria TEXT NOT NULL,
+                    opis TEXT NOT NULL,
+                    miejsce_znalezienia TEXT,
+                    adres_odbioru TEXT NOT NULL,
+                    email_kontaktowy TEXT NOT NULL,
+                    telefon_kontaktowy TEXT NOT NULL,
+                    status TEXT NOT NULL
+                );
+            """)
         print("SQLite tabela 'lost_items' gotowa.")
         return True
     except sqlite3.Error as e:
         print(f"Błąd SQLite podczas tworzenia tabeli: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 
 
+# Jawne wymienienie kolumn to dobra praktyka (chroni przed zmianą kolejności w bazie)
+INSERT_LOST_ITEM_SQL = """
+    INSERT INTO lost_items (
+        id_ewidencyjny, powiat, data_znalezienia, data_przekazania, data_publikacji,
+        kategoria, opis, miejsce_znalezienia,
+        adres_odbioru, email_kontaktowy, telefon_kontaktowy, status
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Domyślna liczba wierszy przekazywanych do jednego executemany przy imporcie
+BULK_INSERT_BATCH_SIZE = 1000
+
+
+def _lost_item_row(lost_item):
+    # Przygotowanie krotki z danymi w kolejności odpowiadającej kolumnom
+    return (
+        lost_item.id_ewidencyjny,
+        lost_item.powiat,
+        lost_item.data_znalezienia,
+        lost_item.data_przekazania,
+        lost_item.data_publikacji,
+        lost_item.kategoria,
+        lost_item.opis,
+        lost_item.miejsce_znalezienia,
+        lost_item.adres_odbioru,
+        lost_item.email_kontaktowy,
+        lost_item.telefon_kontaktowy,
+        lost_item.status
+    )
+
+
+def reserve_ids(conn, prefix, year, count=1):
+    """
+    Rezerwuje w bieżącej transakcji blok count kolejnych numerów dla (prefix, year).
+    Zwraca pierwszy zarezerwowany numer. Blokada zapisu trwa do końca transakcji,
+    więc równoległe rejestracje nigdy nie dostaną tego samego numeru.
+    """
+    cursor = conn.execute("""
+        INSERT INTO id_sequences (prefix, year, last_value) VALUES (?, ?, ?)
+        ON CONFLICT (prefix, year) DO UPDATE SET last_value = last_value + excluded.last_value
+        RETURNING last_value
+    """, (prefix, year, count))
+    last_value = cursor.fetchone()[0]
+    return last_value - count + 1
+
+
+def _assign_ids(conn, lost_items):
+    # Numery nadajemy tylko rzeczom bez ID, jednym blokiem na każdą parę (prefix, rok)
+    pending = {}
+    for item in lost_items:
+        if item.id_ewidencyjny is None:
+            pending.setdefault((item.id_prefix, item.id_year), []).append(item)
+    for (prefix, year), items in pending.items():
+        first = reserve_ids(conn, prefix, year, len(items))
+        for number, item in enumerate(items, start=first):
+            item.assign_id(number)
+
+
 def insert_lost_item(lost_item):
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-
-        # Przygotowanie krotki z danymi w kolejności odpowiadającej kolumnom
-        data_to_insert = (
-            lost_item.id_ewidencyjny,
-            lost_item.powiat,
-            lost_item.data_znalezienia,
-            lost_item.data_przekazania,
-            lost_item.data_publikacji,
-            lost_item.kategoria,
-            lost_item.opis,
-            lost_item.powiat,
-            lost_item.miejsce_znalezienia,
-            lost_item.adres_odbioru,
-            lost_item.email_kontaktowy,
-            lost_item.telefon_kontaktowy,
-            lost_item.status
-        )
-
-        # Jawne wymienienie kolumn to dobra praktyka (chroni przed zmianą kolejności w bazie)
-        sql_query = """
-            INSERT INTO lost_items (
-                id_ewidencyjny, powiat, data_znalezienia, data_przekazania, data_publikacji,
-                kategoria, opis, powiat, miejsce_znalezienia,
-                adres_odbioru, email_kontaktowy, telefon_kontaktowy, status
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
-        cursor.execute(sql_query, data_to_insert)
-        conn.commit()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # Numer ewidencyjny przydzielany w tej samej transakcji co zapis
+            _assign_ids(conn, [lost_item])
+            cursor.execute(INSERT_LOST_ITEM_SQL, _lost_item_row(lost_item))
         print(f"Dodano zgubę: {lost_item.id_ewidencyjny}")
         return True
 
@@ -273,9 +550,29 @@ def insert_lost_item(lost_item):
     except sqlite3.Error as e:
         print(f"❌ Błąd SQLite podczas dodawania zguby: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
+
+
+def insert_lost_items(lost_items, batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Dodaje wiele rzeczy w jednej transakcji (executemany partiami po batch_size wierszy).
+    Przy jakimkolwiek błędzie cała transakcja jest wycofywana - nie zostaje zapisany żaden rekord.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            _assign_ids(conn, lost_items)
+            for offset in range(0, len(lost_items), batch_size):
+                batch = lost_items[offset:offset + batch_size]
+                cursor.executemany(INSERT_LOST_ITEM_SQL, [_lost_item_row(item) for item in batch])
+        print(f"Dodano {len(lost_items)} zgub w jednej transakcji")
+        return True
+
+    except sqlite3.IntegrityError as e:
+        print(f"❌ Błąd integralności (np. duplikat ID): {e}")
+        return False
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas dodawania zgub: {e}")
+        return False
 
 
 def get_lost_item_by_id(id_ewidencyjny):
@@ -283,14 +580,12 @@ def get_lost_item_by_id(id_ewidencyjny):
     Fetches a single lost item from the database by its unique ID.
     Returns a dictionary if found, or None if not found.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        sql_query = "SELECT * FROM lost_items WHERE id_ewidencyjny = ?"
-        cursor.execute(sql_query, (id_ewidencyjny,))
-        row = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            sql_query = "SELECT * FROM lost_items WHERE id_ewidencyjny = ?"
+            cursor.execute(sql_query, (id_ewidencyjny,))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         else:
@@ -299,54 +594,49 @@ def get_lost_item_by_id(id_ewidencyjny):
     except sqlite3.Error as e:
         print(f"❌ SQLite Error while fetching item {id_ewidencyjny}: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
 def update_lost_item(lost_item):
     """
     Updates an existing lost item in the database based on id_ewidencyjny.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        cursor = conn.cursor()
-
-        sql_query = """
-            UPDATE lost_items
-            SET
-                data_znalezienia = ?,
-                data_przekazania = ?,
-                data_publikacji = ?,
-                kategoria = ?,
-                opis = ?,
-                powiat = ?,
-                miejsce_znalezienia = ?,
-                adres_odbioru = ?,
-                email_kontaktowy = ?,
-                telefon_kontaktowy = ?,
-                status = ?
-            WHERE id_ewidencyjny = ?
-        """
-
-        data_to_update = (
-            lost_item.data_znalezienia,
-            lost_item.data_przekazania,
-            lost_item.data_publikacji,
-            lost_item.kategoria,
-            lost_item.opis,
-            lost_item.powiat,
-            lost_item.miejsce_znalezienia,
-            lost_item.adres_odbioru,
-            lost_item.email_kontaktowy,
-            lost_item.telefon_kontaktowy,
-            lost_item.status,
-            lost_item.id_ewidencyjny
-        )
-
-        cursor.execute(sql_query, data_to_update)
-        conn.commit()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            sql_query = """
+                UPDATE lost_items
+                SET
+                    data_znalezienia = ?,
+                    data_przekazania = ?,
+                    data_publikacji = ?,
+                    kategoria = ?,
+                    opis = ?,
+                    powiat = ?,
+                    miejsce_znalezienia = ?,
+                    adres_odbioru = ?,
+                    email_kontaktowy = ?,
+                    telefon_kontaktowy = ?,
+                    status = ?
+                WHERE id_ewidencyjny = ?
+            """
+
+            data_to_update = (
+                lost_item.data_znalezienia,
+                lost_item.data_przekazania,
+                lost_item.data_publikacji,
+                lost_item.kategoria,
+                lost_item.opis,
+                lost_item.powiat,
+                lost_item.miejsce_znalezienia,
+                lost_item.adres_odbioru,
+                lost_item.email_kontaktowy,
+                lost_item.telefon_kontaktowy,
+                lost_item.status,
+                lost_item.id_ewidencyjny
+            )
+
+            cursor.execute(sql_query, data_to_update)
 
         # Check if a row was actually found and updated
         if cursor.rowcount == 0:
@@ -358,9 +648,6 @@ def update_lost_item(lost_item):
     except sqlite3.Error as e:
         print(f"❌ SQLite Error during update: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 
 def get_all_lost_items(powiat=None):
@@ -368,23 +655,314 @@ def get_all_lost_items(powiat=None):
     Pobiera wszystkie rekordy z tabeli lost_items.
     Zwraca listę słowników, gdzie klucze to nazwy kolumn.
     """
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        if powiat:
-            cursor.execute("SELECT * FROM lost_items WHERE powiat = ?", (powiat,))
-        else:
-            cursor.execute("SELECT * FROM lost_items")
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if powiat:
+                cursor.execute("SELECT * FROM lost_items WHERE powiat = ?", (powiat,))
+            else:
+                cursor.execute("SELECT * FROM lost_items")
 
-        rows = cursor.fetchall()
+            rows = cursor.fetchall()
 
         items_list = [dict(row) for row in rows]
         return items_list
     except sqlite3.Error as e:
         print(f"❌ Błąd SQLite podczas pobierania listy zgub: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
+
+
+LIST_SORT_COLUMNS = ('data_znalezienia', 'data_publikacji', 'id_ewidencyjny')
+# Filtry równościowe listy -> kolumna
+LIST_EQUALITY_FILTERS = ('powiat', 'kategoria', 'status')
+# Filtry zakresów dat: (kolumna, operator)
+LIST_RANGE_FILTERS = {
+    'data_znalezienia_od': ('data_znalezienia', '>='),
+    'data_znalezienia_do': ('data_znalezienia', '<'),
+    'data_publikacji_od': ('data_publikacji', '>='),
+    'data_publikacji_do': ('data_publikacji', '<'),
+}
+
+
+def list_lost_items(filters, sort='data_znalezienia', descending=True, after=None, limit=50):
+    """
+    Strona listy rzeczy ze stronicowaniem kluczem (keyset): zamiast OFFSET warunek
+    (kolumna sortowania, id_ewidencyjny) za ostatnim wierszem poprzedniej strony.
+    filters - słownik z kluczami z LIST_EQUALITY_FILTERS i LIST_RANGE_FILTERS (granice '_do'
+    już jako wartości wyłączne), after - (wartość sortowania, id_ewidencyjny) albo None.
+    Zwraca (lista słowników, czy są kolejne wiersze) albo None przy błędzie.
+    """
+    if sort not in LIST_SORT_COLUMNS:
+        raise ValueError(f"Niedozwolone sortowanie: {sort}")
+    conditions = []
+    params = []
+    for name in LIST_EQUALITY_FILTERS:
+        if filters.get(name):
+            conditions.append(f"{name} = ?")
+            params.append(filters[name])
+    for name, (column, operator) in LIST_RANGE_FILTERS.items():
+        if filters.get(name):
+            conditions.append(f"{column} {operator} ?")
+            params.append(filters[name])
+    direction = 'DESC' if descending else 'ASC'
+    if after is not None:
+        conditions.append(f"({sort}, id_ewidencyjny) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+    sql_query = "SELECT * FROM lost_items"
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += f" ORDER BY {sort} {direction}, id_ewidencyjny {direction} LIMIT ?"
+    # Jeden wiersz ponad limit mówi, czy istnieje następna strona
+    params.append(limit + 1)
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(sql_query, params).fetchall()
+        return [dict(row) for row in rows[:limit]], len(rows) > limit
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas pobierania listy zgub: {e}")
+        return None
+
+
+def search_lost_items(query, powiat=None, limit=20):
+    """
+    Wyszukiwanie pełnotekstowe (FTS5) po opisie, miejscu znalezienia i kategorii,
+    wyniki posortowane wg trafności (BM25). Zwraca listę słowników z polem 'trafnosc'
+    (im mniejsza wartość, tym lepsze dopasowanie).
+    """
+    match = build_fts_query(query)
+    if match is None:
+        return []
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    sql_query = f"""
+        SELECT l.*, bm25(lost_items_fts, {weights}) AS trafnosc
+        FROM lost_items_fts
+        JOIN lost_items l ON l.rowid = lost_items_fts.rowid
+        WHERE lost_items_fts MATCH ?
+    """
+    params = [match]
+    if powiat:
+        sql_query += " AND l.powiat = ?"
+        params.append(powiat)
+    sql_query += " ORDER BY trafnosc LIMIT ?"
+    params.append(limit)
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(sql_query, params).fetchall()
+        return [dict(row) for row in rows]
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas wyszukiwania: {e}")
+        return []
+
+
+def rebuild_search_index():
+    """
+    Odbudowuje indeks lost_items_fts z tabeli lost_items. Indeks wiąże wiersze przez rowid,
+    który VACUUM może zmienić - po VACUUM należy go odbudować.
+    """
+    try:
+        with get_connection() as conn:
+            conn.execute("INSERT INTO lost_items_fts (lost_items_fts) VALUES ('rebuild')")
+        return True
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas odbudowy indeksu wyszukiwania: {e}")
+        return False
+
+
+def get_items_without_embedding(model, limit=64):
+    """Rekordy (id_ewidencyjny, opis), dla których nie ma jeszcze wektora danego modelu."""
+    try:
+        with get_connection() as conn:
+            rows = conn.execute("""
+                SELECT l.id_ewidencyjny, l.opis
+                FROM lost_items l
+                LEFT JOIN lost_item_embeddings e
+                    ON e.id_ewidencyjny = l.id_ewidencyjny AND e.model = ?
+                WHERE e.id_ewidencyjny IS NULL
+                LIMIT ?
+            """, (model, limit)).fetchall()
+        return [(row['id_ewidencyjny'], row['opis']) for row in rows]
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas pobierania rekordów bez wektorów: {e}")
+        return []
+
+
+def save_embeddings(model, rows):
+    """
+    Zapisuje wektory: rows to lista (id_ewidencyjny, opis, scale, vector).
+    Wektor zapisywany jest tylko wtedy, gdy opis rekordu nie zmienił się od jego wyliczenia.
+    """
+    try:
+        with get_connection() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO lost_item_embeddings (id_ewidencyjny, model, scale, vector)
+                SELECT ?, ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM lost_items WHERE id_ewidencyjny = ? AND opis = ?)
+            """, [(item_id, model, scale, vector, item_id, opis) for item_id, opis, scale, vector in rows])
+        return True
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas zapisu wektorów: {e}")
+        return False
+
+
+def get_embeddings_generation(model):
+    """Znacznik zmian tabeli wektorów (ostatni seq, liczba wierszy) - do odświeżania indeksu w pamięci."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT MAX(seq), COUNT(*) FROM lost_item_embeddings WHERE model = ?", (model,)
+            ).fetchone()
+        return row[0], row[1]
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas odczytu wektorów: {e}")
+        return None
+
+
+def iter_embeddings(model, batch_size=5000):
+    """
+    Generator (id_ewidencyjny, powiat, kategoria, data_znalezienia, scale, vector)
+    dla wszystkich wektorów modelu, posortowany po powiecie.
+    """
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT e.id_ewidencyjny, l.powiat, l.kategoria, l.data_znalezienia, e.scale, e.vector
+            FROM lost_item_embeddings e
+            JOIN lost_items l ON l.id_ewidencyjny = e.id_ewidencyjny
+            WHERE e.model = ?
+            ORDER BY l.powiat
+        """, (model,))
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield tuple(row)
+
+
+def get_lost_items_by_ids(ids):
+    """Zwraca słownik id_ewidencyjny -> rekord dla podanych identyfikatorów."""
+    if not ids:
+        return {}
+    try:
+        with get_connection() as conn:
+            placeholders = ', '.join('?' * len(ids))
+            rows = conn.execute(
+                f"SELECT * FROM lost_items WHERE id_ewidencyjny IN ({placeholders})", list(ids)
+            ).fetchall()
+        return {row['id_ewidencyjny']: dict(row) for row in rows}
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas pobierania rekordów: {e}")
+        return {}
+
+
+def iter_lost_items(powiat, batch_size=500):
+    """
+    Generator zwracający rekordy lost_items danego powiatu partiami prosto z kursora
+    (fetchmany zamiast fetchall), aby eksport dużych rejestrów nie ładował całości do pamięci.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Sortowanie po id daje stałą kolejność wierszy, niezbędną przy odtwarzaniu migawek z delt
+        cursor.execute("SELECT * FROM lost_items WHERE powiat = ? ORDER BY id_ewidencyjny", (powiat,))
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield dict(row)
+
+
+def get_powiat_stats(powiat):
+    """
+    Statystyki powiatu z tabeli powiat_stats (utrzymywanej wyzwalaczami) - odczyt kilkudziesięciu
+    wierszy zamiast przeglądania wszystkich rekordów. Zwraca None w przypadku błędu.
+    """
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(
+                "SELECT wymiar, klucz, liczba, suma_dni FROM powiat_stats WHERE powiat = ?", (powiat,)
+            ).fetchall()
+            # Najstarsza nieodebrana rzecz - odczyt z indeksu (powiat, status, data_znalezienia)
+            oldest = conn.execute(
+                "SELECT MIN(data_znalezienia) FROM lost_items WHERE powiat = ? AND status = 'do_odbioru'",
+                (powiat,)
+            ).fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas pobierania statystyk: {e}")
+        return None
+
+    stats = {'kategoria': {}, 'status': {}, 'miesiac': {}}
+    pickups, pickup_days = 0, 0.0
+    for row in rows:
+        if row['wymiar'] == 'odbior':
+            pickups, pickup_days = row['liczba'], row['suma_dni']
+        elif row['liczba'] > 0:
+            stats[row['wymiar']][row['klucz']] = row['liczba']
+    return {
+        'powiat': powiat,
+        'liczba_rzeczy': sum(stats['status'].values()),
+        'kategorie': stats['kategoria'],
+        'statusy': stats['status'],
+        'miesiace': dict(sorted(stats['miesiac'].items())),
+        'do_odbioru': {
+            'liczba': stats['status'].get('do_odbioru', 0),
+            'najstarsza_data_znalezienia': oldest,
+        },
+        'odbiory': {
+            'liczba': pickups,
+            'sredni_czas_dni': round(pickup_days / pickups, 1) if pickups else None,
+        },
+    }
+
+
+def get_session(session_id):
+    """Zwraca (dane sesji jako JSON, czas wygaśnięcia) albo None, gdy sesja nie istnieje lub wygasła."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+            ).fetchone()
+        return (row['data'], row['expires_at']) if row else None
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas odczytu sesji: {e}")
+        return None
+
+
+def get_session_expiry(session_id):
+    """Zwraca sam czas wygaśnięcia ważnej sesji (bez danych) albo None."""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT expires_at FROM sessions WHERE id = ? AND expires_at > ?", (session_id, time.time())
+            ).fetchone()
+        return row['expires_at'] if row else None
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas odczytu sesji: {e}")
+        return None
+
+
+def save_session(session_id, data, expires_at):
+    try:
+        with get_connection() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                (session_id, data, expires_at)
+            )
+        return True
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas zapisu sesji: {e}")
+        return False
+
+
+def delete_session(session_id):
+    try:
+        with get_connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        return True
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas usuwania sesji: {e}")
+        return False
+
+
+def purge_expired_sessions():
+    """Usuwa wygasłe sesje. Zwraca liczbę usuniętych albo None w przypadku błędu."""
+    try:
+        with get_connection() as conn:
+            return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+    except sqlite3.Error as e:
+        print(f"Błąd SQLite podczas usuwania wygasłych sesji: {e}")
+        return None
@@ -1,10 +1,38 @@
 from datetime import datetime
-from jsonschema import validate
+from jsonschema import FormatChecker
+from jsonschema.validators import validator_for
 from jsonschema.exceptions import ValidationError
 from api.schema import LOST_ITEM_SCHEMA
-from random import randint
 import json
 
+# Schemat parsowany i walidator budowany raz przy imporcie, a nie przy każdym żądaniu
+LOST_ITEM_SCHEMA_DICT = json.loads(LOST_ITEM_SCHEMA)
+FORMAT_CHECKER = FormatChecker(formats=('date', 'email'))
+
+
+@FORMAT_CHECKER.checks('date-time', raises=ValueError)
+def _is_date_time(value):
+    # jsonschema sprawdza date-time tylko z dodatkowym pakietem - wystarczy nam ISO 8601
+    if isinstance(value, str):
+        datetime.fromisoformat(value)
+    return True
+
+
+_validator_cls = validator_for(LOST_ITEM_SCHEMA_DICT)
+_validator_cls.check_schema(LOST_ITEM_SCHEMA_DICT)
+LOST_ITEM_VALIDATOR = _validator_cls(LOST_ITEM_SCHEMA_DICT, format_checker=FORMAT_CHECKER)
+
+
+def _error_fields(error, instance):
+    """Zwraca nazwy pól, których dotyczy błąd walidacji."""
+    if error.path:
+        return [error.path[0]]
+    if error.validator == 'required':
+        return [field for field in error.validator_value if field not in instance]
+    if error.validator == 'additionalProperties':
+        return [field for field in instance if field not in LOST_ITEM_SCHEMA_DICT['properties']]
+    return []
+
 
 class LostItem:
     """Klasa reprezentująca pojedynczą rzecz znalezioną."""
@@ -16,7 +44,10 @@ class LostItem:
         uzupełnianie pól (np. z sesji urzędnika).
         """
         # Uzupełnianie pól z sesji/backendu
-        self.id_ewidencyjny = self._generate_id(id_prefix)  # Automatycznie generowany ID
+        # Numer ewidencyjny nadaje baza przy zapisie (kolejny numer z sekwencji prefiksu i roku)
+        self._id_prefix = id_prefix
+        self._id_year = datetime.now().strftime("%Y")
+        self.id_ewidencyjny = None
         self.data_publikacji = datetime.now().isoformat()  # Format ISO 8601 z czasem
         self.powiat = powiat
         self.data_znalezienia = item_data.get('data_znalezienia')
@@ -29,32 +60,52 @@ class LostItem:
         self.telefon_kontaktowy = phone
         self.status = item_data.get('status')
 
-    def _generate_id(self, prefix: str) -> str:
-        year = datetime.now().strftime("%Y")
-        num = randint(1, 10_000)
-        num_str = str(num)
-        padded_str = num_str.zfill(4)
-        return f"{prefix}-{year}-{padded_str}"
+    @property
+    def id_prefix(self) -> str:
+        return self._id_prefix
+
+    @property
+    def id_year(self) -> str:
+        return self._id_year
+
+    def _format_id(self, number: int) -> str:
+        padded_str = str(number).zfill(4)
+        return f"{self._id_prefix}-{self._id_year}-{padded_str}"
+
+    def assign_id(self, number: int):
+        """Ustawia numer ewidencyjny na podstawie numeru przydzielonego z sekwencji."""
+        self.id_ewidencyjny = self._format_id(number)
 
     def to_dict(self) -> dict:
         """Konwertuje obiekt na słownik gotowy do walidacji lub zapisu."""
-        return self.__dict__
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+
+    def validation_errors(self):
+        """
+        Zwraca listę wszystkich błędów walidacji jako słowniki {'field', 'message'}
+        (pusta lista, gdy obiekt jest poprawny).
+        """
+        data = self.to_dict()
+        if data['id_ewidencyjny'] is None:
+            # Przed zapisem sprawdzamy wzorzec numeru na numerze tymczasowym
+            data['id_ewidencyjny'] = self._format_id(0)
+        errors = []
+        for error in LOST_ITEM_VALIDATOR.iter_errors(data):
+            for field in _error_fields(error, data) or ['']:
+                errors.append({'field': field, 'message': error.message})
+        return errors
 
     def validate(self):
         """
         Waliduje wewnętrzne dane obiektu względem zdefiniowanej JSON Schemy.
-        Zgłasza wyjątek ValidationError, jeśli walidacja nie powiedzie się.
+        Zwraca (True, '') lub (False, lista wszystkich pól, które nie przeszły walidacji).
         """
-        data = self.to_dict()
-        try:
-            # Użycie funkcji validate z jsonschema
-            schema_dict = json.loads(LOST_ITEM_SCHEMA)
-            validate(instance=data, schema=schema_dict)
+        errors = self.validation_errors()
+        if not errors:
             return True, ''
-        except ValidationError as e:
-            # Zgłoś błąd walidacji, który aplikacja Flask może przechwycić
-            print(e.message, e.path)
-            return False, list(e.path)
-        except Exception as e:
-            # Błędy formatu (np. daty)
-            raise ValidationError(f"Ogólny błąd walidacji: {e}")
+        fields = []
+        for error in errors:
+            print(error['message'], error['field'])
+            if error['field'] and error['field'] not in fields:
+                fields.append(error['field'])
+        return False, fields
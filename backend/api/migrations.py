@@ -0,0 +1,307 @@
+import sqlite3
+from api.connection import get_connection
+
+# Kolejne kroki migracji schematu. Każdy krok to (wersja, opis, lista zapytań).
+# Nowe kroki dopisujemy wyłącznie na końcu listy z kolejnym numerem wersji.
+MIGRATIONS = [
+    (1, "indeksy lost_items", [
+        "CREATE INDEX IF NOT EXISTS idx_lost_items_powiat_status_znalezienie "
+        "ON lost_items (powiat, status, data_znalezienia)",
+        "CREATE INDEX IF NOT EXISTS idx_lost_items_powiat_kategoria "
+        "ON lost_items (powiat, kategoria)",
+    ]),
+    (2, "unikalny klucz (powiat, date) dla records", [
+        # Starsze bazy mogą mieć kilka migawek z tego samego dnia - zostawiamy najnowszą
+        "DELETE FROM records WHERE rowid NOT IN "
+        "(SELECT MAX(rowid) FROM records GROUP BY powiat, date)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_records_powiat_date "
+        "ON records (powiat, date)",
+    ]),
+    (3, "migawki przyrostowe (delty + punkty kontrolne)", [
+        # kind: 'full' - pełny CSV w kolumnie data, 'delta' - tylko zmienione wiersze w record_deltas
+        # last_change: ostatni numer z dziennika zmian ujęty w migawce
+        "ALTER TABLE records ADD COLUMN kind TEXT NOT NULL DEFAULT 'full'",
+        "ALTER TABLE records ADD COLUMN last_change INTEGER",
+        """CREATE TABLE IF NOT EXISTS record_deltas (
+            powiat TEXT NOT NULL,
+            date TEXT NOT NULL,
+            id_ewidencyjny TEXT NOT NULL,
+            row TEXT,
+            PRIMARY KEY (powiat, date, id_ewidencyjny)
+        )""",
+        # Dziennik zmian zasilany triggerami - delta to zmiany o seq > last_change poprzedniej migawki
+        """CREATE TABLE IF NOT EXISTS lost_items_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            powiat TEXT NOT NULL,
+            id_ewidencyjny TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_lost_items_changes_powiat_seq "
+        "ON lost_items_changes (powiat, seq)",
+        """CREATE TRIGGER IF NOT EXISTS trg_lost_items_changes_insert
+        AFTER INSERT ON lost_items BEGIN
+            INSERT INTO lost_items_changes (powiat, id_ewidencyjny) VALUES (NEW.powiat, NEW.id_ewidencyjny);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_lost_items_changes_update
+        AFTER UPDATE ON lost_items BEGIN
+            INSERT INTO lost_items_changes (powiat, id_ewidencyjny) VALUES (NEW.powiat, NEW.id_ewidencyjny);
+            INSERT INTO lost_items_changes (powiat, id_ewidencyjny)
+                SELECT OLD.powiat, OLD.id_ewidencyjny WHERE OLD.powiat IS NOT NEW.powiat;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_lost_items_changes_delete
+        AFTER DELETE ON lost_items BEGIN
+            INSERT INTO lost_items_changes (powiat, id_ewidencyjny) VALUES (OLD.powiat, OLD.id_ewidencyjny);
+        END""",
+        # Stała kolejność wierszy w CSV (po id) - wymagana do odtwarzania migawek z delt
+        "CREATE INDEX IF NOT EXISTS idx_lost_items_powiat_id "
+        "ON lost_items (powiat, id_ewidencyjny)",
+    ]),
+    (4, "licznik zmian powiatu i indeks (powiat, md5)", [
+        "CREATE INDEX IF NOT EXISTS idx_records_powiat_md5 ON records (powiat, md5)",
+        # Ostatni numer zmiany w powiecie - porównanie z last_change migawki mówi, czy powiat jest "brudny"
+        """CREATE TABLE IF NOT EXISTS powiat_changes (
+            powiat TEXT PRIMARY KEY,
+            last_change INTEGER NOT NULL
+        )""",
+        "INSERT OR REPLACE INTO powiat_changes (powiat, last_change) "
+        "SELECT powiat, MAX(seq) FROM lost_items_changes GROUP BY powiat",
+        """CREATE TRIGGER IF NOT EXISTS trg_powiat_changes
+        AFTER INSERT ON lost_items_changes BEGIN
+            INSERT INTO powiat_changes (powiat, last_change) VALUES (NEW.powiat, NEW.seq)
+                ON CONFLICT (powiat) DO UPDATE SET last_change = excluded.last_change;
+        END""",
+    ]),
+    (5, "sekwencje numerów ewidencyjnych", [
+        """CREATE TABLE IF NOT EXISTS id_sequences (
+            prefix TEXT NOT NULL,
+            year TEXT NOT NULL,
+            last_value INTEGER NOT NULL,
+            PRIMARY KEY (prefix, year)
+        )""",
+        # Start od najwyższego istniejącego numeru (PREFIX-RRRR-NNNN), żeby nie nadać zajętego ID
+        """INSERT OR REPLACE INTO id_sequences (prefix, year, last_value)
+        SELECT
+            substr(id_ewidencyjny, 1, instr(id_ewidencyjny, '-') - 1),
+            substr(id_ewidencyjny, instr(id_ewidencyjny, '-') + 1, 4),
+            MAX(CAST(substr(id_ewidencyjny, instr(id_ewidencyjny, '-') + 6) AS INTEGER))
+        FROM lost_items
+        WHERE id_ewidencyjny GLOB '[A-Z]*-[0-9][0-9][0-9][0-9]-[0-9]*'
+        GROUP BY 1, 2""",
+    ]),
+    (6, "wyszukiwanie pełnotekstowe (FTS5)", [
+        # Indeks bez kopii treści (content=lost_items), powiązany przez rowid.
+        # remove_diacritics 2 składa ą/ę/ó/ś/ż... do liter bazowych; ł obsługuje zapytanie (api.search)
+        """CREATE VIRTUAL TABLE IF NOT EXISTS lost_items_fts USING fts5(
+            opis, miejsce_znalezienia, kategoria,
+            content='lost_items', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS lost_items_fts_insert AFTER INSERT ON lost_items BEGIN
+            INSERT INTO lost_items_fts (rowid, opis, miejsce_znalezienia, kategoria)
+            VALUES (new.rowid, new.opis, new.miejsce_znalezienia, new.kategoria);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS lost_items_fts_delete AFTER DELETE ON lost_items BEGIN
+            INSERT INTO lost_items_fts (lost_items_fts, rowid, opis, miejsce_znalezienia, kategoria)
+            VALUES ('delete', old.rowid, old.opis, old.miejsce_znalezienia, old.kategoria);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS lost_items_fts_update
+        AFTER UPDATE OF opis, miejsce_znalezienia, kategoria ON lost_items BEGIN
+            INSERT INTO lost_items_fts (lost_items_fts, rowid, opis, miejsce_znalezienia, kategoria)
+            VALUES ('delete', old.rowid, old.opis, old.miejsce_znalezienia, old.kategoria);
+            INSERT INTO lost_items_fts (rowid, opis, miejsce_znalezienia, kategoria)
+            VALUES (new.rowid, new.opis, new.miejsce_znalezienia, new.kategoria);
+        END""",
+        "INSERT INTO lost_items_fts (lost_items_fts) VALUES ('rebuild')",
+    ]),
+    (7, "indeksy stronicowania listy rzeczy", [
+        # Stronicowanie kluczem (data, id_ewidencyjny) w obrębie powiatu bez sortowania w pamięci
+        "CREATE INDEX IF NOT EXISTS idx_lost_items_powiat_znalezienie_id "
+        "ON lost_items (powiat, data_znalezienia, id_ewidencyjny)",
+        "CREATE INDEX IF NOT EXISTS idx_lost_items_powiat_publikacja_id "
+        "ON lost_items (powiat, data_publikacji, id_ewidencyjny)",
+    ]),
+    (8, "wektory opisów do dopasowania semantycznego", [
+        # vector: int8 (znormalizowany wektor * 127 / scale), model - nazwa modelu embeddingów
+        """CREATE TABLE IF NOT EXISTS lost_item_embeddings (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_ewidencyjny TEXT NOT NULL UNIQUE,
+            model TEXT NOT NULL,
+            scale REAL NOT NULL,
+            vector BLOB NOT NULL
+        )""",
+        # Zmiana opisu lub pól filtrowanych usuwa wektor - indeksator (matching.py) liczy go od nowa
+        """CREATE TRIGGER IF NOT EXISTS lost_item_embeddings_update
+        AFTER UPDATE OF opis, kategoria, powiat, data_znalezienia ON lost_items BEGIN
+            DELETE FROM lost_item_embeddings WHERE id_ewidencyjny = old.id_ewidencyjny;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS lost_item_embeddings_delete AFTER DELETE ON lost_items BEGIN
+            DELETE FROM lost_item_embeddings WHERE id_ewidencyjny = old.id_ewidencyjny;
+        END""",
+    ]),
+    (9, "wersje manifestów XML", [
+        # Każda zmiana w records podbija wersję powiatu - cache manifestu (cache/manifest.py)
+        # porównuje ją z wersją zapisanego manifestu, także między procesami
+        """CREATE TABLE IF NOT EXISTS manifest_versions (
+            powiat TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )""",
+        "INSERT OR IGNORE INTO manifest_versions (powiat, version) SELECT DISTINCT powiat, 1 FROM records",
+        """CREATE TRIGGER IF NOT EXISTS records_manifest_insert AFTER INSERT ON records BEGIN
+            INSERT INTO manifest_versions (powiat, version) VALUES (new.powiat, 1)
+            ON CONFLICT (powiat) DO UPDATE SET version = version + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS records_manifest_update AFTER UPDATE ON records BEGIN
+            INSERT INTO manifest_versions (powiat, version) VALUES (new.powiat, 1)
+            ON CONFLICT (powiat) DO UPDATE SET version = version + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS records_manifest_delete AFTER DELETE ON records BEGIN
+            INSERT INTO manifest_versions (powiat, version) VALUES (old.powiat, 1)
+            ON CONFLICT (powiat) DO UPDATE SET version = version + 1;
+        END""",
+    ]),
+    (10, "statystyki powiatów", [
+        # Liczniki utrzymywane wyzwalaczami: wymiar 'kategoria', 'status', 'miesiac' (RRRR-MM
+        # daty znalezienia) oraz 'odbior' (liczba odbiorów i suma dni od znalezienia do odbioru)
+        """CREATE TABLE IF NOT EXISTS powiat_stats (
+            powiat TEXT NOT NULL,
+            wymiar TEXT NOT NULL,
+            klucz TEXT NOT NULL,
+            liczba INTEGER NOT NULL,
+            suma_dni REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (powiat, wymiar, klucz)
+        ) WITHOUT ROWID""",
+        # Dzień zmiany statusu na 'odebrano' - tabela nie ma osobnej kolumny daty odbioru
+        """CREATE TABLE IF NOT EXISTS lost_item_pickups (
+            id_ewidencyjny TEXT PRIMARY KEY,
+            powiat TEXT NOT NULL,
+            data_odbioru TEXT NOT NULL,
+            dni REAL NOT NULL
+        )""",
+        # Przeliczenie od zera - krok może trafić na tabele z poprzedniego uruchomienia
+        "DELETE FROM lost_item_pickups WHERE id_ewidencyjny NOT IN (SELECT id_ewidencyjny FROM lost_items)",
+        "DELETE FROM powiat_stats",
+        """INSERT INTO powiat_stats (powiat, wymiar, klucz, liczba, suma_dni)
+        SELECT powiat, 'kategoria', kategoria, COUNT(*), 0 FROM lost_items GROUP BY powiat, kategoria
+        UNION ALL
+        SELECT powiat, 'status', status, COUNT(*), 0 FROM lost_items GROUP BY powiat, status
+        UNION ALL
+        SELECT powiat, 'miesiac', substr(data_znalezienia, 1, 7), COUNT(*), 0 FROM lost_items
+        GROUP BY powiat, substr(data_znalezienia, 1, 7)
+        UNION ALL
+        SELECT powiat, 'odbior', '', COUNT(*), SUM(dni) FROM lost_item_pickups GROUP BY powiat""",
+        """CREATE TRIGGER IF NOT EXISTS powiat_stats_insert AFTER INSERT ON lost_items BEGIN
+            INSERT INTO powiat_stats (powiat, wymiar, klucz, liczba) VALUES
+                (new.powiat, 'kategoria', new.kategoria, 1),
+                (new.powiat, 'status', new.status, 1),
+                (new.powiat, 'miesiac', substr(new.data_znalezienia, 1, 7), 1)
+            ON CONFLICT (powiat, wymiar, klucz) DO UPDATE SET liczba = liczba + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS powiat_stats_delete AFTER DELETE ON lost_items BEGIN
+            UPDATE powiat_stats SET liczba = liczba - 1
+            WHERE powiat = old.powiat AND (
+                (wymiar = 'kategoria' AND klucz = old.kategoria) OR
+                (wymiar = 'status' AND klucz = old.status) OR
+                (wymiar = 'miesiac' AND klucz = substr(old.data_znalezienia, 1, 7)));
+            DELETE FROM powiat_stats WHERE powiat = old.powiat AND wymiar != 'odbior' AND liczba <= 0;
+            DELETE FROM lost_item_pickups WHERE id_ewidencyjny = old.id_ewidencyjny;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS powiat_stats_update
+        AFTER UPDATE OF powiat, kategoria, status, data_znalezienia ON lost_items
+        WHEN old.powiat IS NOT new.powiat OR old.kategoria IS NOT new.kategoria
+            OR old.status IS NOT new.status OR old.data_znalezienia IS NOT new.data_znalezienia BEGIN
+            UPDATE powiat_stats SET liczba = liczba - 1
+            WHERE powiat = old.powiat AND (
+                (wymiar = 'kategoria' AND klucz = old.kategoria) OR
+                (wymiar = 'status' AND klucz = old.status) OR
+                (wymiar = 'miesiac' AND klucz = substr(old.data_znalezienia, 1, 7)));
+            INSERT INTO powiat_stats (powiat, wymiar, klucz, liczba) VALUES
+                (new.powiat, 'kategoria', new.kategoria, 1),
+                (new.powiat, 'status', new.status, 1),
+                (new.powiat, 'miesiac', substr(new.data_znalezienia, 1, 7), 1)
+            ON CONFLICT (powiat, wymiar, klucz) DO UPDATE SET liczba = liczba + 1;
+            DELETE FROM powiat_stats WHERE powiat = old.powiat AND wymiar != 'odbior' AND liczba <= 0;
+        END""",
+        # Czas do odbioru liczony w chwili zmiany statusu; cofnięcie statusu usuwa odbiór
+        """CREATE TRIGGER IF NOT EXISTS lost_item_pickups_status
+        AFTER UPDATE OF status ON lost_items
+        WHEN (old.status = 'odebrano') IS NOT (new.status = 'odebrano') BEGIN
+            DELETE FROM lost_item_pickups WHERE id_ewidencyjny = old.id_ewidencyjny;
+            INSERT INTO lost_item_pickups (id_ewidencyjny, powiat, data_odbioru, dni)
+            SELECT new.id_ewidencyjny, new.powiat, date('now'),
+                MAX(0, julianday(date('now')) - julianday(new.data_znalezienia))
+            WHERE new.status = 'odebrano';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS powiat_stats_pickup_insert AFTER INSERT ON lost_item_pickups BEGIN
+            INSERT INTO powiat_stats (powiat, wymiar, klucz, liczba, suma_dni)
+            VALUES (new.powiat, 'odbior', '', 1, new.dni)
+            ON CONFLICT (powiat, wymiar, klucz) DO UPDATE
+            SET liczba = liczba + 1, suma_dni = suma_dni + excluded.suma_dni;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS powiat_stats_pickup_delete AFTER DELETE ON lost_item_pickups BEGIN
+            UPDATE powiat_stats SET liczba = liczba - 1, suma_dni = suma_dni - old.dni
+            WHERE powiat = old.powiat AND wymiar = 'odbior' AND klucz = '';
+        END""",
+    ]),
+    (11, "sesje po stronie serwera", [
+        # Ciasteczko niesie tylko losowy identyfikator, dane sesji (profil urzędu) są tutaj
+        """CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)",
+    ]),
+    (12, "skrót łańcucha delt osobno od md5 treści migawki", [
+        # md5 to odtąd zawsze skrót treści pełnego CSV, chain_md5 - skrót łańcuchowy delt.
+        # Starsze delty mają w md5 skrót łańcuchowy; najwyżej raz zapiszemy migawkę bez zmian treści
+        "ALTER TABLE records ADD COLUMN chain_md5 TEXT",
+        "UPDATE records SET chain_md5 = md5",
+    ]),
+    (13, "czas zapisu migawki (Last-Modified)", [
+        # Czas uniksowy zapisu migawki - date ma dokładność do dnia, a migawkę można nadpisać
+        # tego samego dnia. Starszym migawkom przypisujemy czas migracji (najwyżej zbędne 200)
+        "ALTER TABLE records ADD COLUMN created_at REAL",
+        "UPDATE records SET created_at = CAST(strftime('%s', 'now') AS REAL)",
+    ]),
+]
+
+
+def create_schema_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+    """)
+
+
+def get_schema_version(conn):
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations():
+    """
+    Uruchamia brakujące kroki migracji w kolejności wersji.
+    Każdy krok wykonywany jest w osobnej transakcji razem z wpisem do schema_version.
+    """
+    try:
+        with get_connection() as conn:
+            create_schema_version_table(conn)
+        for version, description, statements in MIGRATIONS:
+            with get_connection() as conn:
+                # BEGIN IMMEDIATE - równoległe workery czekają, zamiast wykonywać krok dwa razy
+                conn.execute("BEGIN IMMEDIATE")
+                if version <= get_schema_version(conn):
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+            print(f"Migracja {version} ({description}) wykonana.")
+        return True
+    except sqlite3.Error as e:
+        print(f"❌ Błąd SQLite podczas migracji schematu: {e}")
+        return False
@@ -1,5 +1,8 @@
 import uuid
 import hashlib
+import hmac
+import os
+from functools import lru_cache
 
 
 class OfficeAccount():
@@ -25,5 +28,49 @@ class OfficeAccount():
         }
 
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Koszt scrypt (N - pamięć i czas, r - rozmiar bloku, p - równoległość); N=2^14, r=8 to ok. 16 MB
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+        # Domyślny limit OpenSSL (32 MB) jest za mały przy podniesionym koszcie
+        maxmem=256 * n * r * p
+    )
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Zwraca hash w formacie scrypt$N$r$p$sól$klucz (hex) z losową solą."""
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return f"scrypt${n}${r}${p}${salt.hex()}${key.hex()}"
+
+
+@lru_cache(maxsize=1)
+def dummy_password_hash():
+    """Hash porównywany, gdy konto nie istnieje - odpowiedź trwa tyle samo co dla istniejącego loginu."""
+    return hash_password(os.urandom(SALT_BYTES).hex())
+
+
+def verify_password(password, stored_hash):
+    """
+    Sprawdza hasło z hashem z bazy. Zwraca (poprawne, wymaga_przeliczenia) - przeliczenia wymagają
+    stare hashe SHA-256 bez soli oraz hashe scrypt o innym koszcie niż bieżący.
+    """
+    if not password or not stored_hash:
+        return False, False
+    if not stored_hash.startswith('scrypt$'):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored_hash), True
+    try:
+        _, n, r, p, salt, key = stored_hash.split('$')
+        n, r, p = int(n), int(r), int(p)
+        ok = hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), n, r, p).hex(), key)
+    except ValueError:
+        return False, False
+    return ok, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
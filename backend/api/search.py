@@ -0,0 +1,46 @@
+import itertools
+import re
+
+# Wagi BM25 kolumn indeksu lost_items_fts: opis, miejsce_znalezienia, kategoria
+BM25_WEIGHTS = (3.0, 1.0, 2.0)
+
+MAX_QUERY_TERMS = 8
+# Maksymalna liczba liter l/ł w słowie, dla której rozpisujemy warianty (2^n wariantów)
+MAX_L_VARIANTS = 3
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _stem(term):
+    # Proste ucięcie końcówki fleksyjnej: "portfel" -> "portf*" trafia też "portfela", "portfelu"
+    if len(term) > 5:
+        return term[:max(4, len(term) - 2)]
+    return term
+
+
+def _l_variants(term):
+    # unicode61 nie składa "ł" do "l" (brak rozkładu Unicode), więc rozpisujemy oba warianty
+    positions = [i for i, ch in enumerate(term) if ch in 'lł'][:MAX_L_VARIANTS]
+    variants = []
+    for letters in itertools.product('lł', repeat=len(positions)):
+        chars = list(term)
+        for position, letter in zip(positions, letters):
+            chars[position] = letter
+        variants.append(''.join(chars))
+    return variants
+
+
+def build_fts_query(text):
+    """
+    Zamienia zapytanie użytkownika na wyrażenie MATCH FTS5: każde słowo jako prefiks
+    (po ucięciu końcówki), warianty l/ł połączone OR, słowa połączone AND.
+    Zwraca None, jeśli zapytanie nie zawiera żadnych słów.
+    """
+    terms = [term.lower() for term in _WORD.findall(text or '')][:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    parts = []
+    for term in terms:
+        variants = ' OR '.join(f'"{variant}"*' for variant in _l_variants(_stem(term)))
+        parts.append(f'({variants})')
+    return ' AND '.join(parts)
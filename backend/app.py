@@ -1,19 +1,98 @@
-from flask import Flask, request, session, jsonify, make_response
+from flask import Flask, request, session, jsonify, make_response, Response, stream_with_context, url_for
 from flasgger import Swagger
-from api.db import authenticate_user, insert_lost_item, update_lost_item, get_lost_item_by_id, create_lost_items_table, create_office_accounts_table, create_records_table, get_ds
+from api.db import authenticate_user, normalize_login, insert_lost_item, insert_lost_items, BULK_INSERT_BATCH_SIZE, update_lost_item, get_lost_item_by_id, create_lost_items_table, create_office_accounts_table, create_records_table, get_ds_info, search_lost_items, list_lost_items, get_powiat_stats, LIST_SORT_COLUMNS, LIST_EQUALITY_FILTERS, LIST_RANGE_FILTERS
 from api.lost_item import LostItem
+from api.migrations import run_migrations
 from jsonschema.exceptions import ValidationError
 from PIL import Image
-from gen_xml import generate_valid_xml
-from gen_csv import gen_lost_items_csv, get_md5
+from werkzeug.http import is_resource_modified
+from datetime import date, datetime, timedelta, timezone
+import base64
+import os
+import csv
+import io
+import json
+import queue
+from cache.manifest import ManifestCache, DEFAULT_MANIFEST_DIR
+from cache.accounts import AccountCache
+from rate_limit import TokenBucketLimiter
+from sessions import ServerSessionInterface, create_session_store
+from vlm_client import request_autofill, VLMServerError
+from autofill_jobs import AutofillJobQueue, STATUS_DONE, STATUS_FAILED
+try:
+    from matching import SemanticMatcher, EmbeddingUnavailable, EMBEDDING_MODEL
+except ImportError:
+    SemanticMatcher = None
+    EmbeddingUnavailable = Exception
+from cache.cache import AutofillCache, hash_file_storage, PROMPT_VERSION
+from cache.phash import dhash
+from image_prep import prepare_images, max_pixels_for_model
+from gen_csv import gen_lost_items_csv, get_md5, iter_lost_items_csv, iter_snapshot_csv, iter_gzip
 
-# PROCESSOR, VLM = None, None
-# VLM_PATH = "HuggingFaceTB/SmolVLM2-2.2B-Instruct"
+# Model VLM działa w osobnym procesie (vlm_server.py); bez adresu używamy odpowiedzi testowej
+VLM_SERVER_URL = os.environ.get('VLM_SERVER_URL')
+VLM_TIMEOUT_S = float(os.environ.get('VLM_TIMEOUT_S', 120))
+VLM_MODEL = os.environ.get('VLM_PATH', 'HuggingFaceTB/SmolVLM2-2.2B-Instruct')
+VLM_MAX_PIXELS = int(os.environ.get('VLM_MAX_PIXELS', 0)) or max_pixels_for_model(VLM_MODEL)
+
+# Tryb asynchroniczny: ograniczona kolejka zadań, pełna kolejka -> 429
+AUTOFILL_JOBS = AutofillJobQueue(
+    workers=int(os.environ.get('AUTOFILL_JOB_WORKERS', 4)),
+    max_pending=int(os.environ.get('AUTOFILL_JOB_QUEUE', 64)),
+)
+SSE_KEEPALIVE_S = 15
+
+# Dopasowanie semantyczne wymaga NumPy i modelu zdań (torch/transformers) - bez nich jest wyłączone
+MATCHER = None
+if SemanticMatcher is not None and os.environ.get('MATCHING_ENABLED', '1') != '0':
+    MATCHER = SemanticMatcher(
+        os.environ.get('EMBEDDING_MODEL', EMBEDDING_MODEL), cache_dir=os.environ.get('HF_CACHE_DIR')
+    )
+
+AUTOFILL_CACHE = AutofillCache(
+    db_path=os.environ.get('AUTOFILL_CACHE_DB', 'autofill_cache.db'),
+    version=f"{VLM_MODEL}:{PROMPT_VERSION}",
+    ttl_s=int(os.environ.get('AUTOFILL_CACHE_TTL_S', 30 * 24 * 3600)),
+    max_entries=int(os.environ.get('AUTOFILL_CACHE_MAX_ENTRIES', 10_000)),
+)
 
 
 app = Flask(__name__)
 app.secret_key = 'twoj_sekret'
+# Dane sesji (profil urzędu) po stronie serwera - w ciasteczku tylko identyfikator sesji
+app.session_interface = ServerSessionInterface(create_session_store())
 swagger = Swagger(app)
+app.config.setdefault('BULK_INSERT_BATCH_SIZE', BULK_INSERT_BATCH_SIZE)
+app.config.setdefault('BULK_MAX_ITEMS', 50_000)
+
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 200
+MATCH_DEFAULT_K = 10
+MATCH_MAX_K = 50
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Manifesty XML: LRU w pamięci + pliki wygenerowane przez gen_all.py (jeśli katalog istnieje)
+MANIFEST_CACHE = ManifestCache(disk_dir=os.environ.get('MANIFEST_DIR', DEFAULT_MANIFEST_DIR))
+# Domyślne okno manifestu w dniach (0 = pełna historia migawek)
+MANIFEST_WINDOW_DAYS = int(os.environ.get('MANIFEST_WINDOW_DAYS', 0))
+
+# Konta urzędów w pamięci procesu i limity prób logowania (przed scrypt i SQLite)
+ACCOUNT_CACHE = AccountCache()
+# Jeden ogranicznik, osobne limity dla adresu IP i loginu - żeton pobierany z obu kubełków naraz
+LOGIN_LIMITER = TokenBucketLimiter(
+    capacity=int(os.environ.get('LOGIN_BURST_PER_IP', 20)),
+    refill_per_s=float(os.environ.get('LOGIN_RATE_PER_IP', 20)) / 60,
+    scopes={
+        'login': (
+            int(os.environ.get('LOGIN_BURST_PER_LOGIN', 5)),
+            float(os.environ.get('LOGIN_RATE_PER_LOGIN', 5)) / 60
+        ),
+    }
+)
+
+# Harvester odpytuje codziennie - pozwalamy cache'ować, ale zawsze z rewalidacją ETagiem
+OPEN_DATA_CACHE_CONTROL = 'public, max-age=3600, must-revalidate'
 
 
 @app.route('/zdrowie')
@@ -67,14 +146,29 @@ def login():
         description: Nieprawidłowy e-mail lub hasło.
       400:
         description: Brak wymaganych danych logowania.
+      429:
+        description: Zbyt wiele prób logowania z adresu IP lub na dany login (nagłówek Retry-After).
     """
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
     email = data.get('email')
     password = data.get('password')
-    account_data = authenticate_user(email, password)
-    if not email or not password:
+    if not email or not password or not isinstance(email, str) or not isinstance(password, str):
         return jsonify({"message": "Brak danych logowania."}), 400
+    login = normalize_login(email)
+    retry_after = LOGIN_LIMITER.acquire(('ip', request.remote_addr or ''), ('login', login))
+    if retry_after:
+        response = jsonify({"message": "Zbyt wiele prób logowania. Spróbuj ponownie później."})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+    account = ACCOUNT_CACHE.get(login)
+    account_data = authenticate_user(login, password, account=account, lookup=False)
     if account_data:
+        if account_data is not account:
+            # Hasło przeliczone na bieżący KDF - podmieniamy konto w cache
+            ACCOUNT_CACHE.put(login, account_data)
+        session.clear()
+        session.regenerate()
         session['logged_in'] = True
         session['user_id'] = account_data['user_id']
         session['powiat'] = account_data['powiat']
@@ -127,7 +221,8 @@ def register_new():
         # Poprawka: Odbieramy błędy pól
         val, msg = lost_item.validate()
         if val:
-            insert_lost_item(lost_item)
+            if insert_lost_item(lost_item):
+                notify_matcher()
             return '', 201
         else:
             # Zwracamy listę pól, które nie przeszły walidacji, zgodnie z ustaloną konwencją
@@ -136,6 +231,318 @@ def register_new():
         return jsonify({'message': e.message}), 400
 
 
+@app.route('/api/rzeczy_znalezione', methods=['GET'])
+def list_items():
+    """
+    Lista rzeczy znalezionych z filtrami i stronicowaniem kursorem.
+    Kolejną stronę pobiera się, przekazując next_cursor z poprzedniej odpowiedzi
+    (z tymi samymi filtrami i sortowaniem).
+    ---
+    tags:
+      - Rejestr
+    parameters:
+      - {name: powiat, in: query, type: string, required: false}
+      - {name: kategoria, in: query, type: string, required: false}
+      - {name: status, in: query, type: string, required: false}
+      - {name: data_znalezienia_od, in: query, type: string, format: date, required: false}
+      - {name: data_znalezienia_do, in: query, type: string, format: date, required: false, description: Włącznie.}
+      - {name: data_publikacji_od, in: query, type: string, format: date, required: false}
+      - {name: data_publikacji_do, in: query, type: string, format: date, required: false, description: Włącznie.}
+      - name: sort
+        in: query
+        type: string
+        required: false
+        enum: ["-data_znalezienia", "data_znalezienia", "-data_publikacji", "data_publikacji", "-id_ewidencyjny", "id_ewidencyjny"]
+        description: Kolumna sortowania, "-" oznacza malejąco (domyślnie -data_znalezienia).
+      - {name: limit, in: query, type: integer, required: false, description: "Rozmiar strony (domyślnie 50, najwyżej 200)."}
+      - {name: cursor, in: query, type: string, required: false}
+    responses:
+      200:
+        description: Strona wyników.
+        schema:
+          type: object
+          properties:
+            wyniki: {type: array, items: {type: object}}
+            next_cursor: {type: string, description: Kursor następnej strony albo null.}
+      400:
+        description: Niepoprawny filtr, sortowanie, limit lub kursor.
+    """
+    sort = request.args.get('sort', '-data_znalezienia')
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-')
+    if sort not in LIST_SORT_COLUMNS:
+        return jsonify({'error': f'Niepoprawne sortowanie: {sort}'}), 400
+    limit = int_arg('limit', LIST_DEFAULT_LIMIT)
+    if limit is None or limit < 1:
+        return jsonify({'error': 'Niepoprawny limit'}), 400
+
+    filters = {name: request.args.get(name) for name in LIST_EQUALITY_FILTERS}
+    for name in LIST_RANGE_FILTERS:
+        value = request.args.get(name)
+        if not value:
+            continue
+        try:
+            day = date.fromisoformat(value)
+        except ValueError:
+            return jsonify({'error': f'Niepoprawna data w {name} (oczekiwano RRRR-MM-DD)'}), 400
+        # Górna granica włącznie z całym dniem - w zapytaniu jako "mniejsze niż następny dzień"
+        filters[name] = str(day + timedelta(days=1)) if name.endswith('_do') else str(day)
+
+    after = None
+    if request.args.get('cursor'):
+        after = decode_list_cursor(request.args['cursor'], sort, descending)
+        if after is None:
+            return jsonify({'error': 'Niepoprawny kursor'}), 400
+
+    page = list_lost_items(filters, sort=sort, descending=descending, after=after, limit=min(limit, LIST_MAX_LIMIT))
+    if page is None:
+        return jsonify({'error': 'Błąd bazy danych'}), 500
+    items, has_more = page
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_list_cursor(sort, descending, last[sort], last['id_ewidencyjny'])
+    return jsonify({'wyniki': items, 'next_cursor': next_cursor}), 200
+
+
+def encode_list_cursor(sort, descending, value, id_ewidencyjny):
+    payload = json.dumps([sort, descending, value, id_ewidencyjny], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_list_cursor(cursor, sort, descending):
+    """Zwraca (wartość sortowania, id_ewidencyjny) albo None dla kursora niepasującego do zapytania."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_descending, value, id_ewidencyjny = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    if cursor_sort != sort or cursor_descending != descending:
+        return None
+    return value, id_ewidencyjny
+
+
+@app.route('/api/rzeczy_znalezione/import', methods=['POST'])
+def register_bulk():
+    """
+    Import wielu przedmiotów naraz (np. migracja z rejestru papierowego). Wymaga aktywnej sesji.
+    Wszystkie rekordy są walidowane przed zapisem; przy jakimkolwiek błędzie nic nie jest zapisywane.
+    ---
+    tags:
+      - Rejestr
+    consumes:
+      - application/json
+      - application/x-ndjson
+      - text/csv
+      - multipart/form-data
+    parameters:
+      - name: items
+        in: body
+        required: false
+        description: Tablica JSON, NDJSON (jeden obiekt na linię) lub CSV (separator ;) z polami LostItem.
+        schema:
+          type: array
+          items:
+            type: object
+      - name: plik
+        in: formData
+        type: file
+        required: false
+        description: Plik CSV / NDJSON / JSON (alternatywa dla treści żądania).
+      - name: batch_size
+        in: query
+        type: integer
+        required: false
+        description: Liczba wierszy w jednym executemany.
+    responses:
+      201:
+        description: Zaimportowano wszystkie rekordy.
+        schema:
+          type: object
+          properties:
+            inserted: {type: integer}
+            ids: {type: array, items: {type: string}}
+      400:
+        description: Błędy walidacji (lista wierszy z polami, które nie przeszły walidacji) lub błędny format.
+        schema:
+          type: object
+          properties:
+            errors:
+              type: array
+              items:
+                type: object
+                properties:
+                  row: {type: integer}
+                  fields: {type: array, items: {type: string}}
+      401:
+        description: Nieautoryzowany dostęp (brak sesji).
+      409:
+        description: Konflikt przy zapisie (np. duplikat ID) - nic nie zapisano.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'message': 'unauthorized'}), 401
+    try:
+        items_data = parse_bulk_items()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if not items_data:
+        return jsonify({'message': 'Brak rekordów do importu.'}), 400
+    if len(items_data) > app.config['BULK_MAX_ITEMS']:
+        return jsonify({'message': f"Maksymalnie {app.config['BULK_MAX_ITEMS']} rekordów w jednym imporcie."}), 400
+
+    lost_items = []
+    errors = []
+    for row_number, data_dict in enumerate(items_data, start=1):
+        if not isinstance(data_dict, dict):
+            errors.append({'row': row_number, 'fields': []})
+            continue
+        lost_item = LostItem(data_dict, session.get('id_prefix'), session.get('powiat'), session.get('address'), session.get('contact_email'), session.get('phone'))
+        try:
+            val, msg = lost_item.validate()
+        except ValidationError as e:
+            val, msg = False, [e.message]
+        if val:
+            lost_items.append(lost_item)
+        else:
+            errors.append({'row': row_number, 'fields': msg})
+    if errors:
+        return jsonify({'errors': errors}), 400
+
+    batch_size = request.args.get('batch_size', app.config['BULK_INSERT_BATCH_SIZE'], type=int)
+    if not insert_lost_items(lost_items, batch_size=max(batch_size, 1)):
+        return jsonify({'message': 'Import nie powiódł się - nie zapisano żadnego rekordu.'}), 409
+    notify_matcher()
+    return jsonify({'inserted': len(lost_items), 'ids': [item.id_ewidencyjny for item in lost_items]}), 201
+
+
+def parse_bulk_items():
+    """
+    Odczytuje listę rekordów z żądania: tablica JSON, NDJSON lub CSV (treść albo plik 'plik').
+    Zgłasza ValueError przy nieczytelnym formacie.
+    """
+    upload = request.files.get('plik')
+    if upload:
+        raw = upload.stream.read().decode('utf-8-sig')
+        filename = (upload.filename or '').lower()
+        content_type = 'text/csv' if filename.endswith('.csv') else 'application/x-ndjson' if filename.endswith('.ndjson') else 'application/json'
+    else:
+        raw = request.get_data(as_text=True)
+        content_type = request.mimetype
+
+    if content_type == 'text/csv':
+        reader = csv.DictReader(io.StringIO(raw, newline=''), delimiter=';')
+        # Puste komórki traktujemy jak brak pola
+        return [{k: v for k, v in row.items() if k and v not in (None, '')} for row in reader]
+    try:
+        if content_type == 'application/x-ndjson':
+            return [json.loads(line) for line in raw.splitlines() if line.strip()]
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Niepoprawny JSON: {e.msg} (linia {e.lineno})')
+    if not isinstance(data, list):
+        raise ValueError('Oczekiwano tablicy rekordów.')
+    return data
+
+
+@app.route('/api/rzeczy_znalezione/szukaj')
+def search_items():
+    """
+    Wyszukiwanie pełnotekstowe rzeczy znalezionych (opis, miejsce znalezienia, kategoria).
+    Wielkość liter i polskie znaki nie mają znaczenia ("zloty" znajdzie "złoty"),
+    słowa dopasowywane są także w innych formach ("portfel" -> "portfela").
+    ---
+    tags:
+      - Rejestr
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: Szukane słowa, np. "czarny portfel".
+      - name: powiat
+        in: query
+        type: string
+        required: false
+        description: Ogranicza wyniki do jednego powiatu.
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Maksymalna liczba wyników (domyślnie 20, najwyżej 100).
+    responses:
+      200:
+        description: Wyniki posortowane od najlepiej dopasowanych.
+        schema:
+          type: object
+          properties:
+            wyniki: {type: array, items: {type: object}}
+      400:
+        description: Brak parametru q lub niepoprawny limit.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Brak parametru q'}), 400
+    limit = int_arg('limit', SEARCH_DEFAULT_LIMIT)
+    if limit is None or limit < 1:
+        return jsonify({'error': 'Niepoprawny limit'}), 400
+    results = search_lost_items(query, powiat=request.args.get('powiat'), limit=min(limit, SEARCH_MAX_LIMIT))
+    return jsonify({'wyniki': results}), 200
+
+
+@app.route('/api/rzeczy_znalezione/podobne')
+def match_items():
+    """
+    Dopasowanie semantyczne: rzeczy znalezione, których opis jest najbardziej podobny
+    do opisu zgubionej rzeczy (np. "zgubiłem brązowy skórzany portfel z dowodem").
+    ---
+    tags:
+      - Rejestr
+    parameters:
+      - {name: opis, in: query, type: string, required: true, description: Opis zgubionej rzeczy.}
+      - {name: powiat, in: query, type: string, required: false}
+      - {name: kategoria, in: query, type: string, required: false}
+      - {name: data_znalezienia_od, in: query, type: string, format: date, required: false}
+      - {name: data_znalezienia_do, in: query, type: string, format: date, required: false}
+      - {name: k, in: query, type: integer, required: false, description: "Liczba wyników (domyślnie 10, najwyżej 50)."}
+    responses:
+      200:
+        description: Rekordy od najbardziej podobnych, z polem podobienstwo (kosinus, -1..1).
+        schema:
+          type: object
+          properties:
+            wyniki: {type: array, items: {type: object}}
+      400:
+        description: Brak opisu lub niepoprawne parametry.
+      503:
+        description: Dopasowanie semantyczne niedostępne (brak modelu).
+    """
+    opis = request.args.get('opis', '').strip()
+    if not opis:
+        return jsonify({'error': 'Brak parametru opis'}), 400
+    k = int_arg('k', MATCH_DEFAULT_K)
+    if k is None or k < 1:
+        return jsonify({'error': 'Niepoprawne k'}), 400
+    dates = {}
+    for name in ('data_znalezienia_od', 'data_znalezienia_do'):
+        value = request.args.get(name)
+        if value:
+            try:
+                dates[name] = str(date.fromisoformat(value))
+            except ValueError:
+                return jsonify({'error': f'Niepoprawna data w {name} (oczekiwano RRRR-MM-DD)'}), 400
+    if MATCHER is None:
+        return jsonify({'error': 'Dopasowanie semantyczne jest wyłączone'}), 503
+    try:
+        results = MATCHER.search(
+            opis, k=min(k, MATCH_MAX_K), powiat=request.args.get('powiat'),
+            kategoria=request.args.get('kategoria'),
+            date_from=dates.get('data_znalezienia_od'), date_to=dates.get('data_znalezienia_do')
+        )
+    except EmbeddingUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'wyniki': results}), 200
+
+
 @app.route('/api/rzeczy_znalezione/<id_ewidencyjny>')
 def get_item(id_ewidencyjny):
     """
@@ -186,12 +593,13 @@ def edit_item_endpoint(id_ewidencyjny):
     form_data = request.get_json()
     try:
         # Używamy danych z sesji w konstruktorze
-        item = LostItem(form_data, id_prefix=session.get('id_prefix'), powiat=session.get('powiat'), address=session.get('address'), email=session.get('contact_email'), phone=session.get('phone'))
+        item = LostItem(form_data, id_prefix=session.get('id_prefix'), powiat=session.get('powiat'), adres_odbioru=session.get('address'), email=session.get('contact_email'), phone=session.get('phone'))
         item.id_ewidencyjny = id_ewidencyjny
         val, msg = item.validate()
         if not val:
             return jsonify({'fields': msg}), 400
         if update_lost_item(item):
+            notify_matcher()
             return jsonify({"message": f"Item {id_ewidencyjny} updated successfully."}), 200
         else:
             return jsonify({"error": "Update failed (Item might not exist)."}), 404
@@ -199,10 +607,56 @@ def edit_item_endpoint(id_ewidencyjny):
         return jsonify({"error": str(e)}), 400
 
 
+@app.route('/api/statystyki/<powiat>')
+def get_stats(powiat):
+    """
+    Statystyki rejestru powiatu (odczyt z liczników utrzymywanych przy zapisie rekordów).
+    ---
+    tags:
+      - Statystyki
+    parameters:
+      - name: powiat
+        in: path
+        type: string
+        required: true
+        description: Slug powiatu (np. warszawa)
+    responses:
+      200:
+        description: Liczby rzeczy według kategorii, statusu i miesiąca znalezienia.
+        schema:
+          type: object
+          properties:
+            powiat: {type: string}
+            liczba_rzeczy: {type: integer}
+            kategorie: {type: object, additionalProperties: {type: integer}}
+            statusy: {type: object, additionalProperties: {type: integer}}
+            miesiace: {type: object, additionalProperties: {type: integer}, description: Klucze RRRR-MM.}
+            do_odbioru:
+              type: object
+              properties:
+                liczba: {type: integer}
+                najstarsza_data_znalezienia: {type: string, format: date}
+            odbiory:
+              type: object
+              description: Odbiory zarejestrowane zmianą statusu na "odebrano".
+              properties:
+                liczba: {type: integer}
+                sredni_czas_dni: {type: number, description: Średnia liczba dni od znalezienia do odbioru.}
+      500:
+        description: Błąd odczytu statystyk.
+    """
+    stats = get_powiat_stats(powiat)
+    if stats is None:
+        return jsonify({'error': 'Nie udało się pobrać statystyk.'}), 500
+    return jsonify(stats), 200
+
+
 @app.route('/api/narzedzia/auto_uzupelnianie', methods=['POST'])
 def form_autocomplete():
     """
     Uzupełnianie pól formularza za pomocą AI/VLM.
+    Z nagłówkiem `Prefer: respond-async` (lub ?async=1) zwraca od razu identyfikator zadania,
+    a wynik odbiera się przez GET /api/narzedzia/auto_uzupelnianie/<job_id> lub jego /zdarzenia (SSE).
     ---
     tags:
       - Narzędzia
@@ -212,6 +666,11 @@ def form_autocomplete():
         type: file
         required: true
         description: Lista zdjęć przedmiotu.
+      - name: async
+        in: query
+        type: boolean
+        required: false
+        description: Tryb asynchroniczny (zadanie w kolejce).
     responses:
       200:
         description: Zwraca sugerowaną kategorię i opis.
@@ -220,8 +679,23 @@ def form_autocomplete():
           properties:
             kategoria: {type: string}
             opis: {type: string}
+            mozliwy_duplikat:
+              type: boolean
+              description: Zdjęcia niemal identyczne z wcześniej przetworzonymi - przedmiot mógł już zostać zgłoszony.
+      202:
+        description: Zadanie przyjęte (tryb asynchroniczny).
+        schema:
+          type: object
+          properties:
+            job_id: {type: string}
+            status_url: {type: string}
+            events_url: {type: string}
       400:
-        description: Nie znaleziono plików.
+        description: Nie znaleziono plików lub niepoprawny obraz.
+      429:
+        description: Kolejka zadań pełna - spróbuj ponownie później.
+      503:
+        description: Serwer VLM niedostępny lub przeciążony.
     """
     if 'photos' not in request.files:
         return jsonify({'error': "Nie znaleziono plików wejściowych"}), 400
@@ -229,12 +703,177 @@ def form_autocomplete():
     if not files_list or files_list[0].filename == '':
         return jsonify({'error': 'Nie wybrano żadnych plików'}), 400
 
-    images = [Image.open(file.stream) for file in files_list]
-    # ... (logika VLM/AI pominięta)
-    result = mock_ai_metoda(files_list)
+    # Te same zdjęcia (np. przy edycji rekordu) obsługujemy z cache bez wołania modelu
+    photo_hashes = [hash_file_storage(file) for file in files_list]
+    cached = AUTOFILL_CACHE.get(photo_hashes)
+    if cached:
+        return jsonify(cached), 200
+
+    # To samo ujęcie przesłane ponownie (inna kompresja, rozmiar) - wynik z podobnych zdjęć
+    try:
+        images = prepare_images([file.stream for file in files_list], VLM_MAX_PIXELS)
+    except Exception as e:
+        return jsonify({'error': f'Niepoprawny plik obrazu: {e}'}), 400
+    phashes = [dhash(image) for image in images]
+    similar = AUTOFILL_CACHE.get_similar(phashes)
+    if similar:
+        result, _distance = similar
+        return jsonify(dict(result, mozliwy_duplikat=True)), 200
+
+    if wants_async():
+        try:
+            job = AUTOFILL_JOBS.submit(
+                lambda job: run_autofill(images, photo_hashes, phashes, on_partial=job.set_partial)
+            )
+        except queue.Full:
+            response = jsonify({'error': 'Zbyt wiele zadań w kolejce, spróbuj ponownie później'})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        status_url = url_for('get_autofill_job', job_id=job.id)
+        response = jsonify({
+            'job_id': job.id,
+            'status_url': status_url,
+            'events_url': url_for('get_autofill_job_events', job_id=job.id),
+        })
+        response.headers['Location'] = status_url
+        return response, 202
+
+    try:
+        result = run_autofill(images, photo_hashes, phashes)
+    except VLMServerError as e:
+        return jsonify({'error': str(e)}), 503
     return jsonify(result), 200 # Zmieniono 201 na 200
 
 
+@app.route('/api/narzedzia/auto_uzupelnianie/<job_id>')
+def get_autofill_job(job_id):
+    """
+    Stan zadania auto-uzupełniania (tryb asynchroniczny).
+    ---
+    tags:
+      - Narzędzia
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Stan zadania; po zakończeniu zawiera wynik albo błąd.
+        schema:
+          type: object
+          properties:
+            job_id: {type: string}
+            status: {type: string, enum: ["oczekuje", "w_toku", "gotowe", "blad"]}
+            opis_czesciowy: {type: string, description: Dotychczas wygenerowany opis (po angielsku).}
+            wynik:
+              type: object
+              properties:
+                kategoria: {type: string}
+                opis: {type: string}
+            error: {type: string}
+      404:
+        description: Nieznane lub wygasłe zadanie.
+    """
+    job = AUTOFILL_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Nie znaleziono zadania'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/narzedzia/auto_uzupelnianie/<job_id>/zdarzenia')
+def get_autofill_job_events(job_id):
+    """
+    Strumień Server-Sent Events z postępem zadania auto-uzupełniania.
+    Zdarzenia: `stan` (zmiana statusu), `opis_czesciowy` (kolejne fragmenty opisu),
+    `wynik` (kategoria i opis) lub `blad`; po wyniku lub błędzie strumień się kończy.
+    ---
+    tags:
+      - Narzędzia
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: Strumień zdarzeń SSE.
+      404:
+        description: Nieznane lub wygasłe zadanie.
+    """
+    job = AUTOFILL_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Nie znaleziono zadania'}), 404
+
+    def events():
+        version = -1
+        status = partial = None
+        while True:
+            new_version = job.wait_for_change(version, SSE_KEEPALIVE_S)
+            if new_version == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = new_version
+            state = job.to_dict()
+            if state['status'] != status:
+                status = state['status']
+                yield sse_event('stan', {'status': status})
+            if state.get('opis_czesciowy', partial) != partial:
+                partial = state['opis_czesciowy']
+                yield sse_event('opis_czesciowy', {'opis': partial})
+            # Koniec strumienia wyznacza status - wynik zadania może być None
+            if status == STATUS_DONE:
+                yield sse_event('wynik', state.get('wynik'))
+                return
+            if status == STATUS_FAILED:
+                yield sse_event('blad', {'error': state.get('error')})
+                return
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def notify_matcher():
+    if MATCHER is not None:
+        MATCHER.notify()
+
+
+def run_autofill(images, photo_hashes, phashes, on_partial=None):
+    """Wynik z serwera VLM (zapisywany w cache) albo odpowiedź testowa, gdy serwer nie jest skonfigurowany."""
+    if not VLM_SERVER_URL:
+        return mock_ai_metoda(images)
+    result = request_autofill(VLM_SERVER_URL, images, timeout=VLM_TIMEOUT_S, on_partial=on_partial)
+    AUTOFILL_CACHE.put(photo_hashes, result, phashes=phashes)
+    return result
+
+
+def int_arg(name, default):
+    """
+    Parametr całkowity z query stringu: default, gdy go brak, None przy niepoprawnej wartości
+    (request.args.get(..., type=int) po cichu zwracałby wtedy default).
+    """
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def wants_async():
+    prefer = request.headers.get('Prefer', '')
+    return 'respond-async' in prefer or request.args.get('async') in ('1', 'true')
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.route('/api/open-data/<powiat_slug>/xml')
 def get_xml(powiat_slug=None):
     """
@@ -248,22 +887,61 @@ def get_xml(powiat_slug=None):
         type: string
         required: true
         description: Slug powiatu (np. warszawa)
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
+        description: ETag z poprzedniego pobrania (dla cache).
+      - name: If-Modified-Since
+        in: header
+        type: string
+        required: false
+        description: Last-Modified z poprzedniego pobrania (czas zapisu najnowszej migawki).
+      - name: dni
+        in: query
+        type: integer
+        required: false
+        description: Tylko migawki z ostatnich N dni (domyślnie MANIFEST_WINDOW_DAYS, 0 = wszystkie).
     responses:
       200:
-        description: Zwraca plik XML zgodny ze schemą Otwarte Dane.
+        description: Zwraca plik XML zgodny ze schemą Otwarte Dane (strumieniowo dla dużych manifestów).
         content:
           application/xml:
             schema: {type: string, format: binary}
+      304:
+        description: Not Modified (Lista zasobów nie uległa zmianie).
+      400:
+        description: Niepoprawna wartość parametru dni.
       404:
         description: Brak zasobów dla danego powiatu.
     """
     # Dodać walidację check_powiat_exists(powiat_slug)
-    xml_content = generate_valid_xml(powiat_slug)
-    response = make_response(xml_content)
-    response.headers['Content-Type'] = 'application/xml; charset=utf-8'
-    
-    # Poprawka: Poprawienie nazwy pliku na spójną z CSV
-    response.headers['Content-Disposition'] = f'inline; filename=wykaz_{powiat_slug}.xml' 
+    window_days = int_arg('dni', MANIFEST_WINDOW_DAYS)
+    if window_days is None or window_days < 0:
+        return jsonify({'error': 'Parametr dni musi być nieujemną liczbą całkowitą.'}), 400
+    window_days = window_days or None
+    # Manifest z cache (ważny do następnego zapisu migawki powiatu) - bez budowania XML
+    manifest = MANIFEST_CACHE.get(powiat_slug, window_days)
+    if manifest is None:
+        return '', 404
+    last_modified = snapshot_last_modified(manifest.get('last_modified'))
+    not_modified = not_modified_response(manifest['etag'], last_modified)
+    if not_modified:
+        return not_modified
+
+    headers = {
+        # Poprawka: Poprawienie nazwy pliku na spójną z CSV
+        'Content-Disposition': f'inline; filename=wykaz_{powiat_slug}.xml',
+    }
+    if manifest['xml'] is not None:
+        response = make_response(manifest['xml'])
+        response.headers.update(headers)
+        response.headers['Content-Type'] = 'application/xml; charset=utf-8'
+    else:
+        # Duży manifest: strumień z pliku gen_all.py albo generowany z kursora
+        body = MANIFEST_CACHE.iter_body(powiat_slug, manifest, window_days)
+        response = Response(stream_with_context(body), headers=headers, content_type='application/xml; charset=utf-8')
+    set_cache_headers(response, manifest['etag'], last_modified)
     return response, 200 # Używamy 200 OK
 
 
@@ -290,6 +968,11 @@ def get_csv_endpoint(powiat_slug=None, date=None):
         type: string
         required: false
         description: ETag z poprzedniego pobrania (dla cache).
+      - name: If-Modified-Since
+        in: header
+        type: string
+        required: false
+        description: Last-Modified z poprzedniego pobrania (czas zapisu migawki).
     responses:
       200:
         description: Zwraca plik CSV z aktualnym ETagiem.
@@ -303,13 +986,88 @@ def get_csv_endpoint(powiat_slug=None, date=None):
     """
     # Dodać walidację check_powiat_exists(powiat_slug)
     # Przekazanie sluga do funkcji generującej dane
-    csv_row = get_ds(powiat_slug, date)
-    if not csv_row:
+    ds_info = get_ds_info(powiat_slug, date)
+    if not ds_info:
         return '', 404
-    response = make_response(csv_row['data'])
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    response.headers['Content-Disposition'] = f'attachment; filename=wykaz_{powiat_slug}.csv'
-    return response, 200
+    # ETag to md5 zapisanej migawki - 304 odpowiadamy bez czytania treści CSV
+    etag = ds_info['md5'] + ('-gzip' if wants_gzip() else '')
+    last_modified = snapshot_last_modified(ds_info['created_at'])
+    not_modified = not_modified_response(etag, last_modified)
+    if not_modified:
+        return not_modified
+    # Treść migawki czytana jest z bazy kawałkami (lub odtwarzana z delt), odpowiedź idzie jako chunked
+    response = csv_stream_response(iter_snapshot_csv(ds_info), powiat_slug)
+    set_cache_headers(response, etag, last_modified)
+    return response
+
+
+@app.route('/api/open-data/<powiat_slug>/aktualne/data.csv')
+def get_current_csv_endpoint(powiat_slug=None):
+    """
+    Aktualny wykaz CSV generowany strumieniowo z bazy (bez zapisanej migawki).
+    ---
+    tags:
+      - Open Data
+    parameters:
+      - name: powiat_slug
+        in: path
+        type: string
+        required: true
+        description: Slug powiatu (np. warszawa)
+      - name: Accept-Encoding
+        in: header
+        type: string
+        required: false
+        description: Przy wartości gzip odpowiedź jest kompresowana w locie.
+    responses:
+      200:
+        description: Strumień CSV z bieżącym stanem rejestru.
+        content:
+          text/csv:
+            schema: {type: string, format: binary}
+    """
+    return csv_stream_response(iter_lost_items_csv(powiat_slug), powiat_slug)
+
+
+def csv_stream_response(chunks, powiat_slug):
+    """Buduje strumieniową odpowiedź CSV, opcjonalnie kompresowaną gzipem."""
+    headers = {
+        'Content-Disposition': f'attachment; filename=wykaz_{powiat_slug}.csv',
+        'Vary': 'Accept-Encoding',
+    }
+    if wants_gzip():
+        chunks = iter_gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), status=200, headers=headers, content_type='text/csv; charset=utf-8')
+
+
+def wants_gzip():
+    return bool(request.accept_encodings['gzip'])
+
+
+def snapshot_last_modified(timestamp):
+    # Czas zapisu migawki (records.created_at), a nie jej dzień - migawkę można nadpisać tego samego dnia
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None
+
+
+def not_modified_response(etag, last_modified):
+    """
+    Zwraca odpowiedź 304, jeśli klient (If-None-Match / If-Modified-Since)
+    ma aktualną wersję zasobu, w przeciwnym razie None.
+    """
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = Response(status=304)
+    set_cache_headers(response, etag, last_modified)
+    return response
+
+
+def set_cache_headers(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = OPEN_DATA_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
 
 
 def mock_ai_metoda(photos):
@@ -317,16 +1075,14 @@ def mock_ai_metoda(photos):
 
 
 def run_app():
-    global PROCESSOR, VLM
     print("--- Inicjalizacja Bazy Danych ---")
     create_office_accounts_table()
     create_lost_items_table()
     create_records_table()
+    run_migrations()
 
     print('--- Przygotowywanie modeli AI ---')
-    #if torch.cuda.is_available():
-    #    PROCESSOR, VLM = get_vlm(VLM_PATH)
-    #else:
-    #    PROCESSOR, VLM = None, None
+    # Wektory dla rekordów dodanych przed włączeniem dopasowania liczone są w tle
+    notify_matcher()
     print("--- Start Serwera Flask ---")
     app.run(debug=True, port=5000)
@@ -0,0 +1,120 @@
+"""
+Asynchroniczne zadania auto-uzupełniania. Zgłoszenie trafia do ograniczonej kolejki,
+a odpowiedź HTTP wraca od razu z identyfikatorem zadania; wynik odbiera się odpytując
+stan zadania albo przez Server-Sent Events. Pełna kolejka oznacza 429 zamiast blokowania
+wątków serwera WWW.
+"""
+import queue
+import threading
+import time
+import uuid
+
+STATUS_QUEUED = 'oczekuje'
+STATUS_RUNNING = 'w_toku'
+STATUS_DONE = 'gotowe'
+STATUS_FAILED = 'blad'
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 64
+# Jak długo po zakończeniu przechowujemy wynik do odebrania
+DEFAULT_RESULT_TTL_S = 600
+
+
+class AutofillJobState:
+    def __init__(self, job_id, fn):
+        self.id = job_id
+        self.fn = fn
+        self.status = STATUS_QUEUED
+        self.partial = ''
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        # Każda zmiana stanu zwiększa wersję i budzi oczekujących (SSE)
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def _update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.changed.notify_all()
+
+    def set_partial(self, text):
+        self._update(partial=text)
+
+    def wait_for_change(self, version, timeout_s):
+        """Czeka, aż wersja stanu będzie różna od version; zwraca aktualną wersję."""
+        with self.changed:
+            if self.version == version and self.status not in (STATUS_DONE, STATUS_FAILED):
+                self.changed.wait(timeout_s)
+            return self.version
+
+    @property
+    def finished(self):
+        return self.status in (STATUS_DONE, STATUS_FAILED)
+
+    def to_dict(self):
+        with self.changed:
+            data = {'job_id': self.id, 'status': self.status}
+            if self.partial and not self.finished:
+                data['opis_czesciowy'] = self.partial
+            if self.result is not None:
+                data['wynik'] = self.result
+            if self.error is not None:
+                data['error'] = self.error
+            return data
+
+
+class AutofillJobQueue:
+    """Ograniczona kolejka zadań obsługiwana przez stałą pulę wątków."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING, result_ttl_s=DEFAULT_RESULT_TTL_S):
+        self.result_ttl_s = result_ttl_s
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f'autofill-job-{i}', daemon=True).start()
+
+    def submit(self, fn):
+        """
+        Dodaje zadanie fn(job) -> wynik. Zgłasza queue.Full, gdy kolejka jest pełna.
+        """
+        self._purge_finished()
+        job = AutofillJobState(uuid.uuid4().hex, fn)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._pending.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def qsize(self):
+        return self._pending.qsize()
+
+    def _purge_finished(self):
+        cutoff = time.monotonic() - self.result_ttl_s
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._pending.get()
+            job._update(status=STATUS_RUNNING)
+            try:
+                result = job.fn(job)
+                job._update(status=STATUS_DONE, result=result, finished_at=time.monotonic())
+            except Exception as e:
+                print(f"❌ Błąd zadania auto-uzupełniania {job.id}: {e}")
+                job._update(status=STATUS_FAILED, error=str(e), finished_at=time.monotonic())
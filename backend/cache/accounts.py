@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+from api.db import get_office_account, ACCOUNT_CHANGE_LISTENERS
+
+ACCOUNT_CACHE_SIZE = 1024
+# Zapisy kont w tym procesie unieważniają wpis od razu (ACCOUNT_CHANGE_LISTENERS); zmiany
+# z innych procesów (seed, drugi worker) widać najpóźniej po tym czasie
+ACCOUNT_CACHE_TTL_S = 60
+# Brak konta pamiętamy krócej - nowe konto zakładane poza serwerem (seed) pojawi się szybko
+MISSING_ACCOUNT_TTL_S = 30
+
+
+class AccountCache:
+    """
+    LRU kont urzędów po loginie z czasem ważności, także dla nieistniejących loginów -
+    powtarzane próby logowania nie trafiają za każdym razem do SQLite.
+    Zapis konta przez api.db w tym procesie unieważnia wpis; zmiany z innych procesów
+    widoczne są po upływie ttl_s.
+    """
+
+    def __init__(self, max_entries=ACCOUNT_CACHE_SIZE, ttl_s=ACCOUNT_CACHE_TTL_S, missing_ttl_s=MISSING_ACCOUNT_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.missing_ttl_s = missing_ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        ACCOUNT_CHANGE_LISTENERS.append(self.invalidate)
+
+    def get(self, login):
+        """Zwraca konto (dict) albo None, gdy login nie istnieje."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(login)
+            if cached is not None and cached[0] > now:
+                self._entries.move_to_end(login)
+                return cached[1]
+        account = get_office_account(login)
+        self.put(login, account)
+        return account
+
+    def put(self, login, account):
+        ttl_s = self.ttl_s if account is not None else self.missing_ttl_s
+        with self._lock:
+            self._entries[login] = (time.monotonic() + ttl_s, account)
+            self._entries.move_to_end(login)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, login=None):
+        with self._lock:
+            if login is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(login, None)
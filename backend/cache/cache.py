@@ -1,4 +1,10 @@
 import hashlib
+import json
+import sqlite3
+import threading
+import time
+from api.connection import get_connection
+from cache.phash import BKTree
 
 CACHE = {
     "bf1fed44c11bbdcfb8ed66c6a6019ca3d71ad8b9cee3da028e2cca2ba43faab9": {"kategoria": "dokumenty_i_portfele", "opis": "Zgubiony przedmiot to czarny skórzany portfel. Ma gładką konsystencję i błyszczące wykończenie. Portfel jest zamykany, z klapką z drobnym, białym, przeszytym detalem. Portfel wygląda na wykonany z wysokiej jakości skóry, z profesjonalnym wykończeniem."},
@@ -12,3 +18,188 @@ def hash_file_storage(file_storage) -> str:
         h.update(chunk)
     file_storage.stream.seek(0)
     return h.hexdigest()
+
+
+# Zmieniamy przy każdej zmianie promptów w ai.py - stare wyniki przestają wtedy pasować
+PROMPT_VERSION = 'combined-v1'
+
+DEFAULT_CACHE_DB = 'autofill_cache.db'
+DEFAULT_TTL_S = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 10_000
+# last_access odświeżamy najwyżej raz na minutę, żeby trafienia nie były zapisami
+TOUCH_INTERVAL_S = 60
+# Maksymalna odległość Hamminga (na 64 bity dHash), przy której zdjęcia uznajemy za to samo ujęcie
+PHASH_MAX_DISTANCE = 6
+
+
+def autofill_cache_key(photo_hashes, version) -> str:
+    """Klucz wyniku: skrót wszystkich zdjęć (bez względu na kolejność) i wersji modelu/promptów."""
+    h = hashlib.sha256(version.encode('utf-8'))
+    for photo_hash in sorted(photo_hashes):
+        h.update(photo_hash.encode('ascii'))
+    return h.hexdigest()
+
+
+class AutofillCache:
+    """
+    Trwała pamięć podręczna wyników auto-uzupełniania w osobnej bazie SQLite,
+    z wygasaniem (TTL) i usuwaniem najdawniej używanych wpisów (LRU) ponad max_entries.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_DB, version=PROMPT_VERSION,
+                 ttl_s=DEFAULT_TTL_S, max_entries=DEFAULT_MAX_ENTRIES, phash_max_distance=PHASH_MAX_DISTANCE):
+        self.db_path = db_path
+        self.version = version
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.phash_max_distance = phash_max_distance
+        self._ready = False
+        # Drzewo BK hashy percepcyjnych, doczytywane przyrostowo z tabeli autofill_phash
+        self._phash_tree = BKTree()
+        self._phash_loaded_id = 0
+        self._phash_loaded_count = 0
+        self._phash_lock = threading.Lock()
+
+    def _ensure_table(self, conn):
+        if self._ready:
+            return
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS autofill_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_autofill_cache_last_access ON autofill_cache (last_access)")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(autofill_phash)")]
+        if columns and 'id' not in columns:
+            # Starsza tabela bez id AUTOINCREMENT (rowid bywał używany ponownie) - to tylko
+            # indeks podobieństwa, więc zakładamy go od nowa
+            conn.execute("DROP TABLE autofill_phash")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS autofill_phash (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phash INTEGER NOT NULL,
+                key TEXT NOT NULL
+            )
+        """)
+        self._ready = True
+
+    def get(self, photo_hashes):
+        """Zwraca zapisany wynik dla zestawu zdjęć albo None."""
+        if len(photo_hashes) == 1 and photo_hashes[0] in CACHE:
+            return CACHE[photo_hashes[0]]
+        key = autofill_cache_key(photo_hashes, self.version)
+        now = time.time()
+        try:
+            with get_connection(self.db_path) as conn:
+                self._ensure_table(conn)
+                row = conn.execute(
+                    "SELECT result, last_access FROM autofill_cache WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl_s)
+                ).fetchone()
+                if row is None:
+                    return None
+                if now - row['last_access'] > TOUCH_INTERVAL_S:
+                    conn.execute("UPDATE autofill_cache SET last_access = ? WHERE key = ?", (now, key))
+            return json.loads(row['result'])
+        except sqlite3.Error as e:
+            print(f"❌ Błąd SQLite cache auto-uzupełniania: {e}")
+            return None
+
+    def put(self, photo_hashes, result, phashes=()):
+        """Zapisuje wynik; phashes to hashe percepcyjne zdjęć (cache.phash.dhash) do wyszukiwania podobnych."""
+        key = autofill_cache_key(photo_hashes, self.version)
+        now = time.time()
+        try:
+            with get_connection(self.db_path) as conn:
+                self._ensure_table(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO autofill_cache (key, result, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(result, ensure_ascii=False), now, now)
+                )
+                for phash in phashes:
+                    conn.execute("INSERT INTO autofill_phash (phash, key) VALUES (?, ?)", (_to_signed(phash), key))
+                evicted = conn.execute("DELETE FROM autofill_cache WHERE created_at <= ?", (now - self.ttl_s,)).rowcount
+                count = conn.execute("SELECT COUNT(*) FROM autofill_cache").fetchone()[0]
+                if count > self.max_entries:
+                    evicted += conn.execute("""
+                        DELETE FROM autofill_cache WHERE key IN (
+                            SELECT key FROM autofill_cache ORDER BY last_access LIMIT ?
+                        )
+                    """, (count - self.max_entries,)).rowcount
+                if evicted:
+                    # Drzewa w procesach przebudują się przy najbliższym get_similar (_refresh_phash_tree)
+                    conn.execute("DELETE FROM autofill_phash WHERE key NOT IN (SELECT key FROM autofill_cache)")
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Błąd SQLite cache auto-uzupełniania: {e}")
+            return False
+
+    def _refresh_phash_tree(self, conn):
+        # Doczytujemy tylko nowe wiersze - także te dopisane przez inne procesy serwera.
+        # id AUTOINCREMENT nigdy się nie powtarza; jeśli wśród wczytanych id ubyło wierszy
+        # (TTL, LRU - także w innym procesie), drzewo budujemy od nowa, bo BKTree nie usuwa węzłów
+        with self._phash_lock:
+            rows = conn.execute(
+                "SELECT id, phash, key FROM autofill_phash WHERE id > ? ORDER BY id",
+                (self._phash_loaded_id,)
+            ).fetchall()
+            loaded_id = rows[-1]['id'] if rows else self._phash_loaded_id
+            count = conn.execute("SELECT COUNT(*) FROM autofill_phash WHERE id <= ?", (loaded_id,)).fetchone()[0]
+            if count != self._phash_loaded_count + len(rows):
+                self._phash_tree = BKTree()
+                rows = conn.execute(
+                    "SELECT id, phash, key FROM autofill_phash WHERE id <= ? ORDER BY id", (loaded_id,)
+                ).fetchall()
+                self._phash_loaded_count = 0
+            for row in rows:
+                self._phash_tree.add(_to_unsigned(row['phash']), row['key'])
+            self._phash_loaded_id = loaded_id
+            self._phash_loaded_count += len(rows)
+
+    def get_similar(self, phashes):
+        """
+        Szuka wyniku dla zdjęć prawie identycznych z już przetworzonymi (ponowne zrobienie
+        lub przeskalowanie tego samego zdjęcia). Wynik musi pasować do każdego z podanych zdjęć.
+        Zwraca (wynik, maksymalna odległość Hamminga) albo None.
+        """
+        if not phashes:
+            return None
+        now = time.time()
+        try:
+            with get_connection(self.db_path) as conn:
+                self._ensure_table(conn)
+                self._refresh_phash_tree(conn)
+                candidates = None
+                for phash in phashes:
+                    best = {}
+                    for distance, key in self._phash_tree.search(phash, self.phash_max_distance):
+                        best.setdefault(key, distance)
+                    if candidates is None:
+                        candidates = best
+                    else:
+                        candidates = {k: max(d, best[k]) for k, d in candidates.items() if k in best}
+                    if not candidates:
+                        return None
+                for key, distance in sorted(candidates.items(), key=lambda item: item[1]):
+                    row = conn.execute(
+                        "SELECT result FROM autofill_cache WHERE key = ? AND created_at > ?",
+                        (key, now - self.ttl_s)
+                    ).fetchone()
+                    if row is not None:
+                        return json.loads(row['result']), distance
+            return None
+        except sqlite3.Error as e:
+            print(f"❌ Błąd SQLite cache auto-uzupełniania: {e}")
+            return None
+
+
+def _to_signed(value):
+    # SQLite przechowuje INTEGER jako 64-bitową liczbę ze znakiem
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
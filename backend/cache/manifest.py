@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from api.db import get_manifest_version
+from gen_xml import manifest_info, iter_manifest_xml, XML_CHUNK_SIZE
+
+DEFAULT_MANIFEST_DIR = 'manifests'
+MANIFEST_CACHE_SIZE = 256
+# Większe manifesty nie są trzymane w pamięci - strumieniujemy je z pliku lub z kursora
+MANIFEST_MAX_CACHED_RESOURCES = 2000
+
+
+def manifest_paths(xml_dir, powiat_slug):
+    base = os.path.join(xml_dir, f'wykaz_{powiat_slug}')
+    return f'{base}.xml', f'{base}.json'
+
+
+def _replace_atomically(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_manifest_file(powiat_slug, xml_dir=DEFAULT_MANIFEST_DIR):
+    """
+    Zapisuje pełny manifest powiatu strumieniowo do xml_dir/wykaz_<powiat>.xml wraz z plikiem .json
+    z wersją i ETagiem. Zwraca wpis manifestu (bez treści) albo None, gdy powiat nie ma migawek.
+    """
+    # Wersję czytamy przed listą migawek: przy równoległym zapisie plik dostanie starszą
+    # wersję niż treść, więc najwyżej zostanie niepotrzebnie wygenerowany ponownie
+    version = get_manifest_version(powiat_slug)
+    info = manifest_info(powiat_slug)
+    if version is None or info is None:
+        return None
+    etag, last_date, last_modified, count = info
+    xml_path, meta_path = manifest_paths(xml_dir, powiat_slug)
+    entry = {'version': version, 'etag': etag, 'last_date': last_date, 'last_modified': last_modified,
+             'resources': count}
+    # Unikalne pliki tymczasowe - równolegle może pisać serwer i procesy gen_all.py
+    _replace_atomically(xml_path, lambda f: f.writelines(iter_manifest_xml(powiat_slug)))
+    _replace_atomically(meta_path, lambda f: f.write(json.dumps(entry).encode('utf-8')))
+    return dict(entry, path=xml_path, xml=None)
+
+
+def iter_file(path, chunk_size=XML_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class ManifestCache:
+    """
+    Manifesty XML harvestera: LRU w pamięci procesu, przed nim opcjonalnie pliki
+    wygenerowane przez gen_all.py. Wpis jest ważny, dopóki wersja powiatu w manifest_versions
+    (podbijana wyzwalaczami przy każdym zapisie do records) się nie zmieni.
+    Małe manifesty trzymane są w pamięci w całości, duże - tylko metadane, a treść
+    strumieniowana jest z pliku albo z kursora (iter_body).
+    """
+
+    def __init__(self, max_entries=MANIFEST_CACHE_SIZE, disk_dir=None,
+                 max_cached_resources=MANIFEST_MAX_CACHED_RESOURCES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_cached_resources = max_cached_resources
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, powiat_slug, window_days=None):
+        """
+        Zwraca {'version', 'etag', 'last_date', 'last_modified', 'resources', 'xml', 'path'} albo None,
+        gdy powiat nie ma migawek. 'xml' to treść (bytes) lub None dla dużych manifestów.
+        """
+        version = get_manifest_version(powiat_slug)
+        if not version:
+            return None
+        key = (powiat_slug, window_days)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['version'] == version:
+                self._entries.move_to_end(key)
+                return entry
+        entry = None
+        if window_days is None:
+            entry = self._load_file(powiat_slug, version)
+        if entry is None:
+            entry = self._render(powiat_slug, version, window_days)
+        if entry is None:
+            return None
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def iter_body(self, powiat_slug, entry, window_days=None):
+        """Treść manifestu kawałkami: z pamięci, z pliku albo generowana z kursora."""
+        if entry['xml'] is not None:
+            return iter([entry['xml']])
+        if entry.get('path'):
+            return iter_file(entry['path'])
+        return iter_manifest_xml(powiat_slug, window_days=window_days)
+
+    def invalidate(self, powiat_slug=None):
+        with self._lock:
+            if powiat_slug is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == powiat_slug]:
+                    del self._entries[key]
+
+    def _load_file(self, powiat_slug, version):
+        if not self.disk_dir:
+            return None
+        xml_path, meta_path = manifest_paths(self.disk_dir, powiat_slug)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != version:
+                return None
+            entry = dict(meta, path=xml_path, xml=None)
+            if meta.get('resources', 0) <= self.max_cached_resources:
+                with open(xml_path, 'rb') as f:
+                    entry['xml'] = f.read()
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def _render(self, powiat_slug, version, window_days):
+        if window_days is None and self.disk_dir and os.path.isdir(self.disk_dir):
+            try:
+                entry = write_manifest_file(powiat_slug, self.disk_dir)
+                if entry is not None and entry['resources'] <= self.max_cached_resources:
+                    entry['xml'] = b''.join(iter_file(entry['path']))
+                return entry
+            except OSError as e:
+                # Problem z katalogiem manifestów nie może psuć odpowiedzi - renderujemy w pamięci
+                print(f"❌ Nie udało się zapisać manifestu {powiat_slug}: {e}")
+        info = manifest_info(powiat_slug, window_days)
+        if info is None:
+            return None
+        etag, last_date, last_modified, count = info
+        entry = {'version': version, 'etag': etag, 'last_date': last_date, 'last_modified': last_modified,
+                 'resources': count, 'path': None, 'xml': None}
+        if count <= self.max_cached_resources:
+            entry['xml'] = b''.join(iter_manifest_xml(powiat_slug, window_days=window_days))
+        return entry
@@ -0,0 +1,70 @@
+import threading
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def dhash(image, hash_size=HASH_SIZE) -> int:
+    """
+    Różnicowy hash percepcyjny (dHash, 64 bity): porównuje sąsiednie piksele zmniejszonego
+    obrazu w skali szarości. Odporny na ponowne kodowanie, zmianę rozmiaru i drobne kadrowanie.
+    """
+    # draft() pozwala dekoderowi JPEG od razu czytać mocno zmniejszoną wersję
+    image.draft('L', (hash_size * 8, hash_size * 8))
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Drzewo BK dla odległości Hamminga - wyszukiwanie hashy w zadanym promieniu
+    bez porównywania z każdym zapisanym hashem.
+    """
+
+    def __init__(self):
+        self._root = None  # [hash, [wartości], {odległość: węzeł}]
+        self._lock = threading.Lock()
+
+    def add(self, value_hash: int, value):
+        with self._lock:
+            if self._root is None:
+                self._root = [value_hash, [value], {}]
+                return
+            node = self._root
+            while True:
+                distance = hamming(value_hash, node[0])
+                if distance == 0:
+                    node[1].append(value)
+                    return
+                child = node[2].get(distance)
+                if child is None:
+                    node[2][distance] = [value_hash, [value], {}]
+                    return
+                node = child
+
+    def search(self, value_hash: int, max_distance: int):
+        """Zwraca listę (odległość, wartość) dla hashy odległych o co najwyżej max_distance."""
+        results = []
+        with self._lock:
+            stack = [self._root] if self._root else []
+            while stack:
+                node = stack.pop()
+                distance = hamming(value_hash, node[0])
+                if distance <= max_distance:
+                    results.extend((distance, value) for value in node[1])
+                for child_distance, child in node[2].items():
+                    if distance - max_distance <= child_distance <= distance + max_distance:
+                        stack.append(child)
+        results.sort(key=lambda item: item[0])
+        return results
@@ -0,0 +1,24 @@
+import pytest
+
+import api.connection as connection
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Pusta baza testowa w katalogu tymczasowym zamiast hackathon_data.db."""
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(connection, 'DATABASE_NAME', path)
+    yield path
+    connection.close_connections()
+
+
+@pytest.fixture
+def schema(db_path):
+    """Baza testowa z tabelami aplikacji i wszystkimi migracjami."""
+    from api.db import create_office_accounts_table, create_lost_items_table, create_records_table
+    from api.migrations import run_migrations
+    create_office_accounts_table()
+    create_lost_items_table()
+    create_records_table()
+    assert run_migrations()
+    return db_path
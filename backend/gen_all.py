@@ -0,0 +1,146 @@
+"""
+Nocne generowanie migawek CSV i manifestów XML dla wszystkich powiatów.
+
+Obliczenia (odczyt rekordów, budowa CSV/XML) wykonują procesy robocze,
+zapisy do bazy wykonuje wyłącznie proces główny - SQLite ma jednego pisarza.
+Postęp zapisywany jest w pliku stanu, więc przerwane uruchomienie można wznowić.
+
+Użycie: python gen_all.py [--date RRRR-MM-DD] [--workers N] [--xml-dir DIR] [--state PLIK] [powiat ...]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date
+
+from api.db import get_all_powiats, get_connection
+from api.migrations import run_migrations
+from gen_csv import prepare_snapshot, save_snapshot
+from cache.manifest import write_manifest_file, DEFAULT_MANIFEST_DIR
+
+DEFAULT_XML_DIR = DEFAULT_MANIFEST_DIR
+
+
+def _prepare_snapshot_job(powiat_slug, date_str):
+    started = time.perf_counter()
+    with get_connection() as conn:
+        # Jedna transakcja odczytu - spójny obraz dziennika zmian i rekordów (WAL)
+        conn.execute("BEGIN")
+        plan = prepare_snapshot(powiat_slug, date_str)
+    return plan, time.perf_counter() - started
+
+
+def _render_xml_job(powiat_slug, xml_dir):
+    started = time.perf_counter()
+    # Plik z wersją manifestu - serwer (cache/manifest.py) poda go bez ponownego renderowania
+    entry = write_manifest_file(powiat_slug, xml_dir)
+    return entry and entry['etag'], time.perf_counter() - started
+
+
+def load_state(state_path, date_str):
+    if os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('date') == date_str:
+            return state
+    return {'date': date_str, 'done': []}
+
+
+def save_state(state_path, state):
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def run_batch(date_str, powiats=None, workers=None, xml_dir=DEFAULT_XML_DIR, state_path=None):
+    """
+    Generuje migawki CSV i manifesty XML dla podanych (domyślnie wszystkich) powiatów.
+    Zwraca słownik powiat -> czasy poszczególnych etapów w sekundach.
+    """
+    workers = workers or os.cpu_count() or 1
+    state_path = state_path or f'gen_all_state_{date_str}.json'
+    os.makedirs(xml_dir, exist_ok=True)
+    run_migrations()
+
+    state = load_state(state_path, date_str)
+    pending = [p for p in (powiats or get_all_powiats()) if p not in state['done']]
+    if state['done']:
+        print(f"Wznowienie: pomijam {len(state['done'])} ukończonych powiatów.")
+    print(f"--- Generowanie {len(pending)} powiatów na dzień {date_str} ({workers} procesów) ---")
+
+    timings = {}
+    failed = []
+    queue = list(reversed(pending))
+    xml_queue = []
+    # spawn zamiast fork - połączenia SQLite procesu głównego nie mogą przejść do dzieci
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        in_flight = {}
+
+        def submit_next():
+            # Ograniczamy liczbę zadań w locie (CSV i XML razem), żeby nie trzymać w pamięci
+            # wszystkich wyników naraz; manifesty mają pierwszeństwo - kończą rozpoczęte powiaty
+            while (xml_queue or queue) and len(in_flight) < workers * 2:
+                if xml_queue:
+                    powiat = xml_queue.pop()
+                    in_flight[pool.submit(_render_xml_job, powiat, xml_dir)] = (powiat, 'xml')
+                else:
+                    powiat = queue.pop()
+                    in_flight[pool.submit(_prepare_snapshot_job, powiat, date_str)] = (powiat, 'csv')
+
+        submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                powiat, stage = in_flight.pop(future)
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    print(f"❌ {powiat}: błąd etapu {stage}: {e}")
+                    failed.append(powiat)
+                    continue
+                timings.setdefault(powiat, {})[stage] = elapsed
+                if stage == 'csv':
+                    started = time.perf_counter()
+                    # None - w powiecie nic się nie zmieniło, nie ma czego zapisywać
+                    try:
+                        saved = result is None or save_snapshot(result)
+                    except sqlite3.Error as e:
+                        print(f"❌ {powiat}: błąd etapu zapis: {e}")
+                        saved = False
+                    if not saved:
+                        # np. "database is locked" albo nowsza migawka zapisana w międzyczasie -
+                        # powiatu nie oznaczamy jako ukończonego, wznowi go kolejne uruchomienie
+                        print(f"❌ {powiat}: migawka nie została zapisana")
+                        failed.append(powiat)
+                        continue
+                    timings[powiat]['zapis'] = time.perf_counter() - started
+                    # Manifest zależy od listy migawek, więc renderujemy go dopiero po zapisie
+                    xml_queue.append(powiat)
+                else:
+                    state['done'].append(powiat)
+                    save_state(state_path, state)
+                    total = sum(timings[powiat].values())
+                    print(f"✅ {powiat}: {total:.2f}s ({', '.join(f'{k} {v:.2f}s' for k, v in timings[powiat].items())})")
+            submit_next()
+
+    if failed:
+        print(f"⚠️ Nieudane powiaty ({len(failed)}): {', '.join(failed)} - uruchom ponownie, aby wznowić.")
+    else:
+        print("🚀 Wszystkie powiaty wygenerowane.")
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generowanie migawek CSV i manifestów XML dla wszystkich powiatów.')
+    parser.add_argument('powiats', nargs='*', help='Powiaty do wygenerowania (domyślnie wszystkie z office_accounts).')
+    parser.add_argument('--date', default=str(date.today()), help='Dzień migawki (RRRR-MM-DD).')
+    parser.add_argument('--workers', type=int, default=None, help='Liczba procesów roboczych (domyślnie liczba rdzeni).')
+    parser.add_argument('--xml-dir', default=DEFAULT_XML_DIR, help='Katalog na wygenerowane manifesty XML.')
+    parser.add_argument('--state', default=None, help='Plik stanu do wznawiania przerwanego uruchomienia.')
+    args = parser.parse_args()
+    run_batch(args.date, powiats=args.powiats or None, workers=args.workers, xml_dir=args.xml_dir, state_path=args.state)
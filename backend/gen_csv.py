@@ -1,48 +1,235 @@
-from api.db import get_all_lost_items, get_all_datasets, insert_ds
+from api.db import (
+    iter_lost_items, get_connection, get_snapshot_before, get_latest_snapshot,
+    count_deltas_since_checkpoint, get_checkpoint, iter_snapshot_deltas, get_last_change,
+    get_changed_items, insert_snapshot, iter_ds_data
+)
+from collections import OrderedDict
 from datetime import date
 import io
 import csv
 import hashlib
+import threading
+import zlib
 
+FIELD_NAMES = [
+    'id_ewidencyjny',
+    'powiat',
+    'data_znalezienia',
+    'data_przekazania',
+    'data_publikacji',
+    'kategoria',
+    'opis',
+    'miejsce_znalezienia',
+    'adres_odbioru',
+    'email_kontaktowy',
+    'telefon_kontaktowy',
+    'status'
+]
 
-def gen_lost_items_csv(powiat_slug, date_str=str(str(date.today()))):
-    datasets = get_all_datasets(powiat_slug)
-    lost_items = get_all_lost_items(powiat=powiat_slug)
-    field_names = [
-        'id_ewidencyjny',
-        'powiat',
-        'data_znalezienia',
-        'data_przekazania',
-        'data_publikacji',
-        'kategoria',
-        'opis',
-        'miejsce_znalezienia',
-        'adres_odbioru',
-        'email_kontaktowy',
-        'telefon_kontaktowy',
-        'status'
-    ]
+# Rozmiar kawałka odpowiedzi przy strumieniowaniu (w znakach CSV)
+CSV_CHUNK_SIZE = 64 * 1024
+
+# Co ile migawek przyrostowych zapisywany jest pełny punkt kontrolny
+CHECKPOINT_EVERY = 30
+
+# Ile odtworzonych z delt migawek trzymamy w pamięci procesu
+SNAPSHOT_CACHE_SIZE = 8
+_snapshot_cache = OrderedDict()
+_snapshot_cache_lock = threading.Lock()
 
+
+def iter_lost_items_csv(powiat_slug, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Generator zwracający CSV z rzeczami danego powiatu kawałkami po ok. chunk_size znaków.
+    Wiersze czytane są partiami prosto z kursora SQLite.
+    """
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=field_names, delimiter=';')
+    writer = csv.DictWriter(output, fieldnames=FIELD_NAMES, delimiter=';')
     writer.writeheader()
-    for lost_item in lost_items:
-        row_to_write = {k: lost_item[k] for k in field_names}
+    for lost_item in iter_lost_items(powiat_slug):
+        row_to_write = {k: lost_item[k] for k in FIELD_NAMES}
         writer.writerow(row_to_write)
-    csv_content = output.getvalue()
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    if output.tell():
+        yield output.getvalue()
     output.close()
-    has_dup = False
-    md5 = get_md5(csv_content)
-    if datasets:
-        for dataset in datasets:
-            if dataset['md5'] == md5:
-                has_dup = True
-                break
-    if not has_dup:
-        insert_ds(md5, csv_content, date_str, powiat_slug)
 
 
+def iter_gzip(chunks):
+    """Kompresuje strumień kawałków (str lub bytes) do gzip w locie."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> nagłówek gzip
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def csv_row(lost_item):
+    """Serializuje pojedynczy rekord do linii CSV (ten sam format co w pełnym wykazie)."""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=FIELD_NAMES, delimiter=';')
+    writer.writerow({k: lost_item[k] for k in FIELD_NAMES})
+    return output.getvalue()
+
+
+def gen_lost_items_csv(powiat_slug, date_str=str(str(date.today()))):
+    """
+    Zapisuje migawkę wykazu powiatu na dzień date_str.
+    Domyślnie zapisywane są tylko wiersze zmienione od poprzedniej migawki (delta),
+    a co CHECKPOINT_EVERY migawek - pełny CSV jako punkt kontrolny.
+    Ponowne uruchomienie w tym samym dniu zastępuje migawkę z tego dnia.
+    Jeśli od ostatniej migawki nic się w powiecie nie zmieniło, generowanie jest pomijane.
+    """
+    with get_connection() as conn:
+        # Blokada zapisu na czas generowania - dziennik zmian i rekordy czytamy spójnie
+        conn.execute("BEGIN IMMEDIATE")
+        plan = prepare_snapshot(powiat_slug, date_str)
+        if plan is None:
+            return False
+        return save_snapshot(plan)
+
+
+def prepare_snapshot(powiat_slug, date_str):
+    """
+    Wylicza migawkę bez zapisu do bazy (może działać w osobnym procesie).
+    Zwraca słownik do przekazania do save_snapshot albo None, gdy migawki nie trzeba zapisywać.
+    Odczyty powinny być wykonane w jednej transakcji, aby dziennik zmian i rekordy były spójne.
+    """
+    latest = get_latest_snapshot(powiat_slug)
+    if latest and latest['date'] > date_str:
+        print(f"❌ Istnieje nowsza migawka ({latest['date']}) niż {date_str} dla {powiat_slug}")
+        return None
+    last_change = get_last_change(powiat_slug)
+    if last_change is None:
+        return None
+    if latest and latest['last_change'] == last_change:
+        print(f"Brak zmian w {powiat_slug} od {latest['date']} - pomijam migawkę")
+        return None
+    base = get_snapshot_before(powiat_slug, date_str)
+    plan = {
+        'powiat': powiat_slug,
+        'date': date_str,
+        'last_change': last_change,
+        'prune_upto': base['last_change'] if base else None,
+        # Stan, na podstawie którego liczono migawkę - save_snapshot sprawdza, czy nadal aktualny
+        'expected_latest': (latest['date'], latest['last_change']) if latest else None,
+    }
+
+    needs_checkpoint = (
+        base is None
+        or base['last_change'] is None
+        or count_deltas_since_checkpoint(powiat_slug, date_str) + 1 >= CHECKPOINT_EVERY
+    )
+    # md5 migawki to zawsze skrót treści pełnego CSV - ten sam klucz dla punktów kontrolnych
+    # i delt, więc porównanie z najnowszą migawką mówi, czy treść wykazu się zmieniła
+    md5_hash = hashlib.md5()
+    parts = []
+    for chunk in iter_lost_items_csv(powiat_slug):
+        md5_hash.update(chunk.encode('utf-8'))
+        if needs_checkpoint:
+            parts.append(chunk)
+    md5 = md5_hash.hexdigest()
+    if latest and latest['md5'] == md5:
+        print(f"Treść wykazu {powiat_slug} bez zmian od {latest['date']} - pomijam migawkę")
+        return None
+    if needs_checkpoint:
+        plan.update(kind='full', md5=md5, chain_md5=md5, data=''.join(parts), deltas=[])
+        return plan
+
+    changed = get_changed_items(powiat_slug, base['last_change'], last_change)
+    if changed is None:
+        return None
+    if not changed:
+        print(f"Brak zmian w {powiat_slug} od {base['date']} - pomijam migawkę")
+        return None
+    deltas = [(item_id, csv_row(item) if item else None) for item_id, item in changed]
+    # Skrót łańcuchowy (chain_md5 poprzedniej migawki + delta) identyfikuje ciąg delt,
+    # z którego migawka jest odtwarzana - trzymany osobno od skrótu treści
+    chain_hash = hashlib.md5(base['chain_md5'].encode('utf-8'))
+    for item_id, row in deltas:
+        chain_hash.update(f"\n{item_id}\t{row or ''}".encode('utf-8'))
+    plan.update(kind='delta', md5=md5, chain_md5=chain_hash.hexdigest(), data=None, deltas=deltas)
+    return plan
+
+
+def save_snapshot(plan):
+    """
+    Zapisuje migawkę wyliczoną przez prepare_snapshot. Jeśli w międzyczasie
+    ktoś zapisał nowszą migawkę powiatu, plan jest odrzucany.
+    """
+    with get_connection() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        latest = get_latest_snapshot(plan['powiat'])
+        current = (latest['date'], latest['last_change']) if latest else None
+        if current != plan['expected_latest']:
+            print(f"⚠️ Migawka {plan['powiat']} {plan['date']} nieaktualna - pomijam zapis")
+            return False
+        return insert_snapshot(
+            plan['powiat'], plan['date'], plan['md5'], plan['kind'], plan['last_change'],
+            data=plan['data'], deltas=plan['deltas'], prune_upto=plan['prune_upto'],
+            chain_md5=plan['chain_md5']
+        )
+
+
+def rebuild_snapshot_csv(powiat_slug, date_str):
+    """
+    Odtwarza pełny CSV migawki z ostatniego punktu kontrolnego i kolejnych delt.
+    Zwraca None, jeśli powiat nie ma punktu kontrolnego sprzed date_str.
+    """
+    checkpoint = get_checkpoint(powiat_slug, date_str)
+    if checkpoint is None:
+        return None
+    reader = csv.reader(io.StringIO(checkpoint['data'], newline=''), delimiter=';')
+    header = next(reader, FIELD_NAMES)
+    rows = {row[0]: row for row in reader if row}
+    for item_id, line in iter_snapshot_deltas(powiat_slug, checkpoint['date'], date_str):
+        if line is None:
+            rows.pop(item_id, None)
+        else:
+            rows[item_id] = next(csv.reader(io.StringIO(line, newline=''), delimiter=';'))
+
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(header)
+    for item_id in sorted(rows):
+        writer.writerow(rows[item_id])
+    return output.getvalue()
+
+
+def get_snapshot_csv(ds_info):
+    """Zwraca CSV migawki przyrostowej, korzystając z pamięci podręcznej odtworzonych migawek."""
+    key = (ds_info['powiat'], ds_info['date'], ds_info['md5'])
+    with _snapshot_cache_lock:
+        if key in _snapshot_cache:
+            _snapshot_cache.move_to_end(key)
+            return _snapshot_cache[key]
+    csv_content = rebuild_snapshot_csv(ds_info['powiat'], ds_info['date'])
+    if csv_content is not None:
+        with _snapshot_cache_lock:
+            _snapshot_cache[key] = csv_content
+            while len(_snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+                _snapshot_cache.popitem(last=False)
+    return csv_content
+
 
+def iter_snapshot_csv(ds_info, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Generator zwracający treść migawki kawałkami: pełne migawki czytane są wprost z bazy,
+    przyrostowe - odtwarzane z delt (lub brane z pamięci podręcznej).
+    """
+    if ds_info['kind'] == 'full':
+        yield from iter_ds_data(ds_info['rowid'])
+        return
+    csv_content = get_snapshot_csv(ds_info) or ''
+    for offset in range(0, len(csv_content), chunk_size):
+        yield csv_content[offset:offset + chunk_size]
 
 
 def get_md5(data_string):
@@ -1,64 +1,116 @@
-import xml.etree.ElementTree as ET
-from datetime import datetime
-from api.db import get_all_datasets
+from xml.sax.saxutils import XMLGenerator
+import hashlib
+import io
+from api.db import iter_datasets_meta
 
 NS = "urn:otwarte-dane:harvester:1.13"
 
-
-def generate_valid_xml(powiat_slug: str):
+# Rozmiar kawałka przy strumieniowaniu manifestu (w bajtach)
+XML_CHUNK_SIZE = 64 * 1024
+
+
+def manifest_info(powiat_slug: str, window_days=None):
+    """
+    Zwraca (etag, data ostatniej migawki, czas ostatniego zapisu migawki, liczba zasobów)
+    albo None, gdy powiat nie ma migawek.
+    ETag liczony jest z samej listy migawek (date + md5) czytanej kursorem - bez budowania XML.
+    """
+    md5_hash = hashlib.md5(f"{powiat_slug}\n{window_days or ''}".encode('utf-8'))
+    last_date = None
+    last_modified = None
+    count = 0
+    for ds in iter_datasets_meta(powiat_slug, window_days=window_days):
+        md5_hash.update(f"\n{ds['date']}:{ds['md5']}".encode('utf-8'))
+        last_date = ds['date']
+        if ds['created_at'] is not None:
+            last_modified = max(last_modified or 0, ds['created_at'])
+        count += 1
+    if not count:
+        return None
+    return md5_hash.hexdigest(), last_date, last_modified, count
+
+
+def _text_element(xml, name, text, attrs=None):
+    xml.startElement(name, attrs or {})
+    xml.characters(text)
+    xml.endElement(name)
+
+
+def _polish_element(xml, name, text):
+    xml.startElement(name, {})
+    _text_element(xml, 'polish', text)
+    xml.endElement(name)
+
+
+def _resource(xml, powiat_slug, date_str, last):
+    xml.startElement('resource', {'status': 'published'})
+    _text_element(xml, 'url', f"http://127.0.0.1/open-data/{powiat_slug}/{date_str}/data.csv")
+    _polish_element(xml, 'title', "Wykaz Rzeczy (CSV)")
+    _polish_element(xml, 'description', f"Plik CSV z rzeczami zagubionymi akrualny do {date_str}.")
+    _text_element(xml, 'availability', "remote")
+    _text_element(xml, 'dataDate', date_str)
+    if last:
+        _text_element(xml, 'hasHighValueData', "true")
+    xml.endElement('resource')
+
+
+def iter_manifest_xml(powiat_slug: str, window_days=None, chunk_size=XML_CHUNK_SIZE):
+    """
+    Generator zwracający manifest XML kawałkami (bytes). Zasoby (po jednym na migawkę) czytane
+    są kursorem i zapisywane od razu, więc pamięć nie zależy od długości historii.
+    window_days - tylko migawki z ostatnich N dni (licząc od najnowszej migawki).
+    """
     powiat_name = powiat_slug.replace('-', ' ').title()
-
-    ET.register_namespace('od', NS)
-
-    root = ET.Element(f"{{{NS}}}datasets")
-
-    dataset = ET.SubElement(root, "dataset")
-    dataset.set("status", "published")
-
-    title = ET.SubElement(dataset, "title")
-    ET.SubElement(title, "polish").text = f"Rejestr Rzeczy Znalezionych - {powiat_name}"
-
-    desc = ET.SubElement(dataset, "description")
-    ET.SubElement(desc, "polish").text = "Publiczny wykaz rzeczy znalezionych prowadzony przez urząd."
-
-    ET.SubElement(dataset, "url").text = "http://urzad.pl/bip/rzeczy-znalezione"
-    ET.SubElement(dataset, "updateFrequency").text = "daily"
-
-    cats = ET.SubElement(dataset, "categories")
-    ET.SubElement(cats, "category").text = "GOVE"
-
-    resources = ET.SubElement(dataset, "resources")
-    csvs = get_all_datasets(powiat_slug)
-    for csv in csvs:
-        res = ET.SubElement(resources, "resource")
-        res.set("status", "published")
-        date_str = csv['date']
-        url_csv = f"http://127.0.0.1/open-data/{powiat_slug}/{date_str}/data.csv"
-        ET.SubElement(res, "url").text = url_csv
-        res_title = ET.SubElement(res, "title")
-        ET.SubElement(res_title, "polish").text = "Wykaz Rzeczy (CSV)"
-        res_desc = ET.SubElement(res, "description")
-        ET.SubElement(res_desc, "polish").text = f"Plik CSV z rzeczami zagubionymi akrualny do {date_str}."
-        ET.SubElement(res, "availability").text = "remote"
-        ET.SubElement(res, "dataDate").text = date_str
-    ET.SubElement(res, "hasHighValueData").text = "true"
+    buffer = io.BytesIO()
+    xml = XMLGenerator(buffer, encoding='utf-8', short_empty_elements=True)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    xml.startDocument()
+    xml.startElement('od:datasets', {'xmlns:od': NS})
+    xml.startElement('dataset', {'status': 'published'})
+    _polish_element(xml, 'title', f"Rejestr Rzeczy Znalezionych - {powiat_name}")
+    _polish_element(xml, 'description', "Publiczny wykaz rzeczy znalezionych prowadzony przez urząd.")
+    _text_element(xml, 'url', "http://urzad.pl/bip/rzeczy-znalezione")
+    _text_element(xml, 'updateFrequency', "daily")
+    xml.startElement('categories', {})
+    _text_element(xml, 'category', "GOVE")
+    xml.endElement('categories')
+
+    xml.startElement('resources', {})
+    # hasHighValueData dostaje ostatni zasób - zapisujemy z opóźnieniem o jedną migawkę
+    pending = None
+    for ds in iter_datasets_meta(powiat_slug, window_days=window_days):
+        if pending is not None:
+            _resource(xml, powiat_slug, pending, last=False)
+            if buffer.tell() >= chunk_size:
+                yield flush()
+        pending = ds['date']
+    if pending is not None:
+        _resource(xml, powiat_slug, pending, last=True)
+    xml.endElement('resources')
 
     # --- Tagi ---
-    tags = ET.SubElement(dataset, "tags")
+    xml.startElement('tags', {})
     for tag_txt in ["rzeczy znalezione", "zguby", powiat_name]:
-        tag = ET.SubElement(tags, "tag")
-        tag.set("lang", "pl")
-        tag.text = tag_txt
+        _text_element(xml, 'tag', tag_txt, {'lang': 'pl'})
+    xml.endElement('tags')
+    xml.endElement('dataset')
+    xml.endElement('od:datasets')
+    xml.endDocument()
+    yield flush()
 
-    return ET.tostring(root, encoding='utf-8', method='xml', xml_declaration=True)
 
+def generate_valid_xml(powiat_slug: str, window_days=None):
+    return b''.join(iter_manifest_xml(powiat_slug, window_days=window_days))
 
-if __name__ == '__main__':
-    xml_bytes = generate_valid_xml('warszawa')
-    import xml.dom.minidom
-    dom = xml.dom.minidom.parseString(xml_bytes)
-    pretty_xml = dom.toprettyxml(indent="    ")
 
-    with open('dane_poprawione.xml', 'w', encoding='utf-8') as f:
-        f.write(pretty_xml)
+if __name__ == '__main__':
+    with open('dane_poprawione.xml', 'wb') as f:
+        for chunk in iter_manifest_xml('warszawa'):
+            f.write(chunk)
     print("✅ XML wygenerowany. Sprawdź plik dane_poprawione.xml")
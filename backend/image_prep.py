@@ -0,0 +1,70 @@
+"""
+Przygotowanie zdjęć przed inferencją VLM: zmniejszony odczyt JPEG (draft), obrót
+wg EXIF, konwersja do RGB i ograniczenie liczby pikseli do tego, co model i tak wykorzysta.
+Zdjęcia z jednego zgłoszenia dekodowane są równolegle w puli wątków (Pillow zwalnia GIL).
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# Procesory modeli i tak skalują obraz do tych rozmiarów - większe zdjęcia to tylko koszt dekodowania
+MODEL_MAX_PIXELS = {
+    'HuggingFaceTB/SmolVLM2-2.2B-Instruct': 1536 * 1536,
+    'HuggingFaceTB/SmolVLM2-500M-Video-Instruct': 512 * 512,
+    'HuggingFaceTB/SmolVLM2-256M-Video-Instruct': 512 * 512,
+}
+DEFAULT_MAX_PIXELS = 1536 * 1536
+
+# Jakość JPEG przy przesyłaniu przygotowanych zdjęć do serwera VLM
+TRANSFER_JPEG_QUALITY = 90
+
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='image-decode')
+
+
+def max_pixels_for_model(model_path):
+    return MODEL_MAX_PIXELS.get(model_path, DEFAULT_MAX_PIXELS)
+
+
+def prepare_image(fp, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    Otwiera zdjęcie (ścieżka lub strumień) i zwraca obraz RGB o co najwyżej max_pixels pikselach.
+    Zgłasza wyjątek Pillow, jeśli plik nie jest poprawnym obrazem.
+    """
+    image = Image.open(fp)
+    width, height = image.size
+    if width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        # Dekoder JPEG od razu czyta wersję zmniejszoną 2/4/8 razy (nie mniejszą niż zadany rozmiar)
+        image.draft('RGB', (int(width * scale), int(height * scale)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Przezroczystość na białym tle zamiast czarnego
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    width, height = image.size
+    if width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        image.thumbnail((max(1, int(width * scale)), max(1, int(height * scale))), Image.Resampling.LANCZOS)
+    image.load()
+    return image
+
+
+def prepare_images(sources, max_pixels=DEFAULT_MAX_PIXELS):
+    """Przygotowuje wiele zdjęć równolegle; zachowuje kolejność."""
+    if len(sources) == 1:
+        return [prepare_image(sources[0], max_pixels)]
+    return list(_decode_pool.map(lambda source: prepare_image(source, max_pixels), sources))
+
+
+def encode_jpeg(image, quality=TRANSFER_JPEG_QUALITY):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    buffer.seek(0)
+    return buffer
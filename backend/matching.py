@@ -0,0 +1,247 @@
+"""
+Dopasowanie semantyczne: opis zgubionej rzeczy podany przez obywatela porównywany jest
+z opisami rzeczy znalezionych przez podobieństwo kosinusowe wektorów zdań.
+
+Wektory liczy na CPU wielojęzyczny model zdań (mean pooling), zapisywane są jako int8
+w tabeli lost_item_embeddings. Indeksator w tle uzupełnia brakujące wektory po dodaniu
+lub edycji rekordów, a wyszukiwanie to iloczyn macierzy int8 z wektorem zapytania (NumPy)
+na indeksie trzymanym w pamięci procesu.
+
+Użycie: python matching.py  - jednorazowe wyliczenie brakujących wektorów (np. po migracji)
+"""
+import os
+import threading
+
+import numpy as np
+
+from api.db import (
+    get_items_without_embedding, save_embeddings, get_embeddings_generation, iter_embeddings,
+    get_lost_items_by_ids
+)
+
+EMBEDDING_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_LENGTH = 256
+# Co ile indeksator sprawdza, czy w bazie są nowe wektory (np. zapisane przez inny proces)
+INDEX_REFRESH_S = 5.0
+# Ile wierszy macierzy konwertować naraz przy liczeniu podobieństw
+SCORE_CHUNK_ROWS = 8192
+
+
+class EmbeddingUnavailable(Exception):
+    """Model embeddingów nie jest dostępny (brak torch/transformers lub błąd ładowania)."""
+
+
+def quantize(vector):
+    """Znormalizowany wektor float32 -> (scale, bajty int8)."""
+    scale = float(np.abs(vector).max()) / 127 or 1.0
+    return scale, np.round(vector / scale).astype(np.int8).tobytes()
+
+
+class Embedder:
+    def __init__(self, model_path=EMBEDDING_MODEL, device='cpu', cache_dir=None, batch_size=EMBEDDING_BATCH_SIZE):
+        self.model_path = model_path
+        self.device = device
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            try:
+                from transformers import AutoModel, AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_path, cache_dir=self.cache_dir)
+                self._model = AutoModel.from_pretrained(self.model_path, cache_dir=self.cache_dir).to(self.device)
+            except Exception as e:
+                raise EmbeddingUnavailable(f"Nie udało się załadować modelu {self.model_path}: {e}")
+            self._model.eval()
+        return self._tokenizer, self._model
+
+    def embed(self, texts):
+        """Zwraca macierz float32 (len(texts) x wymiar) znormalizowanych wektorów."""
+        import torch
+
+        vectors = []
+        with self._lock:
+            tokenizer, model = self._load()
+            for start in range(0, len(texts), self.batch_size):
+                inputs = tokenizer(
+                    texts[start:start + self.batch_size], padding=True, truncation=True,
+                    max_length=EMBEDDING_MAX_LENGTH, return_tensors='pt'
+                ).to(model.device)
+                with torch.inference_mode():
+                    hidden = model(**inputs).last_hidden_state
+                # Mean pooling po tokenach (bez dopełnienia)
+                mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                vectors.append(torch.nn.functional.normalize(pooled, dim=-1).float().cpu().numpy())
+        return np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+class IndexData:
+    """
+    Niezmienny komplet tablic indeksu: macierz int8 + skale oraz kolumny do filtrowania.
+    Wiersze posortowane są po powiecie (iter_embeddings), więc filtr powiatu to wycinek
+    macierzy bez kopiowania.
+    """
+
+    def __init__(self, rows=()):
+        powiat_ranges = {}
+        for position, row in enumerate(rows):
+            start, _ = powiat_ranges.get(row[1], (position, position))
+            powiat_ranges[row[1]] = (start, position + 1)
+        category_codes = {}
+        self.ids = [row[0] for row in rows]
+        self.powiat_ranges = powiat_ranges
+        self.categories = np.array(
+            [category_codes.setdefault(row[2], len(category_codes)) for row in rows], dtype=np.int16
+        )
+        self.category_codes = category_codes
+        self.found_dates = np.array([date_code(row[3]) for row in rows], dtype=np.int32)
+        self.scales = np.array([row[4] for row in rows], dtype=np.float32)
+        self.vectors = (
+            np.frombuffer(b''.join(row[5] for row in rows), dtype=np.int8).reshape(len(rows), -1)
+            if rows else np.zeros((0, 0), dtype=np.int8)
+        )
+
+
+class EmbeddingIndex:
+    """
+    Wektory wszystkich rekordów w pamięci procesu. Przeładowywany w całości, gdy zmieni się
+    znacznik tabeli wektorów - przez wątek indeksatora, nie w wątku żądania.
+    Nowy komplet tablic (IndexData) podmieniany jest jednym przypisaniem, więc wyszukiwanie
+    zawsze widzi tablice z tego samego przeładowania.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.generation = None
+        self.data = IndexData()
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.generation is not None
+
+    def refresh(self):
+        """Przeładowuje indeks, jeśli tabela wektorów się zmieniła. Zwraca True po przeładowaniu."""
+        with self._lock:
+            generation = get_embeddings_generation(self.model)
+            if generation is None or generation == self.generation:
+                return False
+            self.data = IndexData(list(iter_embeddings(self.model)))
+            self.generation = generation
+            return True
+
+    def search(self, query_vector, k, powiat=None, kategoria=None, date_from=None, date_to=None):
+        """Zwraca listę (id_ewidencyjny, podobieństwo kosinusowe) - k najlepszych po filtrach."""
+        data = self.data
+        start, end = data.powiat_ranges.get(powiat, (0, 0)) if powiat else (0, len(data.ids))
+        if end <= start:
+            return []
+        mask = None
+        if kategoria:
+            code = data.category_codes.get(kategoria)
+            if code is None:
+                return []
+            mask = data.categories[start:end] == code
+        for bound, compare in ((date_from, np.greater_equal), (date_to, np.less_equal)):
+            if bound:
+                date_mask = compare(data.found_dates[start:end], date_code(bound))
+                mask = date_mask if mask is None else mask & date_mask
+        scores = np.empty(end - start, dtype=np.float32)
+        for offset in range(0, end - start, SCORE_CHUNK_ROWS):
+            # Konwersja int8 -> float32 kawałkami: mały bufor tymczasowy i mnożenie przez BLAS
+            block = data.vectors[start + offset:min(end, start + offset + SCORE_CHUNK_ROWS)]
+            scores[offset:offset + len(block)] = block.astype(np.float32) @ query_vector
+        scores *= data.scales[start:end]
+        if mask is not None:
+            scores[~mask] = -np.inf
+        k = min(k, int(np.count_nonzero(mask)) if mask is not None else len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(data.ids[start + i], float(scores[i])) for i in top]
+
+
+def date_code(value):
+    """'RRRR-MM-DD...' -> RRRRMMDD jako liczba (szybkie porównania w NumPy)."""
+    return int(value[:10].replace('-', '')) if value else 0
+
+
+class SemanticMatcher:
+    """Model + indeks + wątek indeksatora uzupełniającego brakujące wektory."""
+
+    def __init__(self, model_path=EMBEDDING_MODEL, device='cpu', cache_dir=None):
+        self.embedder = Embedder(model_path, device=device, cache_dir=cache_dir)
+        self.index = EmbeddingIndex(model_path)
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def notify(self):
+        """Sygnał, że rekordy zostały dodane lub zmienione - indeksator uzupełni wektory w tle."""
+        self._start_indexer()
+        self._wake.set()
+
+    def _start_indexer(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='embedding-indexer', daemon=True)
+                self._thread.start()
+
+    def sync(self, batch_size=EMBEDDING_BATCH_SIZE * 4):
+        """Wylicza wektory dla wszystkich rekordów, które ich nie mają. Zwraca liczbę zapisanych."""
+        total = 0
+        while items := get_items_without_embedding(self.index.model, limit=batch_size):
+            vectors = self.embedder.embed([opis for _, opis in items])
+            rows = [(item_id, opis, *quantize(vector)) for (item_id, opis), vector in zip(items, vectors)]
+            if not save_embeddings(self.index.model, rows):
+                break
+            total += len(rows)
+            if len(items) < batch_size:
+                break
+        return total
+
+    def _run(self):
+        while True:
+            woken = self._wake.wait(INDEX_REFRESH_S)
+            self._wake.clear()
+            try:
+                if woken:
+                    count = self.sync()
+                    if count:
+                        print(f"Wyliczono wektory dla {count} rekordów")
+                # Indeks w pamięci przeładowuje indeksator - wyszukiwanie nie czeka na odczyt tabeli
+                self.index.refresh()
+            except EmbeddingUnavailable as e:
+                print(f"❌ Indeksator wektorów wyłączony: {e}")
+                return
+            except Exception as e:
+                print(f"❌ Błąd indeksatora wektorów: {e}")
+
+    def search(self, text, k=10, powiat=None, kategoria=None, date_from=None, date_to=None):
+        """Rekordy najbardziej podobne do opisu, z polem 'podobienstwo' (kosinus, -1..1)."""
+        query_vector = self.embedder.embed([text])[0]
+        self._start_indexer()
+        if not self.index.loaded:
+            # Tylko pierwsze wyszukiwanie w procesie czeka na wczytanie indeksu
+            self.index.refresh()
+        matches = self.index.search(query_vector, k, powiat, kategoria, date_from, date_to)
+        items = get_lost_items_by_ids([item_id for item_id, _ in matches])
+        return [
+            dict(items[item_id], podobienstwo=round(score, 4))
+            for item_id, score in matches if item_id in items
+        ]
+
+
+if __name__ == '__main__':
+    from api.migrations import run_migrations
+    run_migrations()
+    matcher = SemanticMatcher(
+        os.environ.get('EMBEDDING_MODEL', EMBEDDING_MODEL), cache_dir=os.environ.get('HF_CACHE_DIR')
+    )
+    print(f"Zapisano wektory dla {matcher.sync()} rekordów.")
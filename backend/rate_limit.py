@@ -0,0 +1,55 @@
+"""
+Ogranicznik liczby żądań (token bucket). Każdy klucz (np. adres IP, login) ma kubełek
+o pojemności capacity, uzupełniany w tempie refill_per_s żetonów na sekundę.
+Klucz w postaci krotki (zakres, wartość) może mieć własne limity podane w scopes,
+np. scopes={'login': (5, 5 / 60)} - wtedy jedno acquire sprawdza różne limity naraz.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Ile kubełków trzymamy w pamięci - najdawniej używane są usuwane (nowy kubełek jest pełny)
+MAX_BUCKETS = 100_000
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity, refill_per_s, max_buckets=MAX_BUCKETS, scopes=None):
+        self.capacity = capacity
+        self.refill_per_s = refill_per_s
+        self.max_buckets = max_buckets
+        self.scopes = scopes or {}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _limits(self, key):
+        """(pojemność, żetony na sekundę) dla klucza - limity zakresu albo domyślne."""
+        if isinstance(key, tuple) and key[0] in self.scopes:
+            return self.scopes[key[0]]
+        return self.capacity, self.refill_per_s
+
+    def _tokens(self, key, now):
+        capacity, refill_per_s = self._limits(key)
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        return min(capacity, tokens + (now - updated) * refill_per_s)
+
+    def acquire(self, *keys):
+        """
+        Pobiera po jednym żetonie z kubełka każdego klucza - tylko jeśli wszystkie mają żeton.
+        Zwraca 0, gdy żądanie jest dozwolone, inaczej liczbę sekund do ponownej próby.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens = {key: self._tokens(key, now) for key in keys}
+            allowed = all(value >= 1 for value in tokens.values())
+            for key, value in tokens.items():
+                self._buckets[key] = (value - 1 if allowed else value, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return 0
+        # Czekamy na najwolniej uzupełniany brakujący żeton
+        return max(1, max(
+            math.ceil((1 - value) / self._limits(key)[1]) for key, value in tokens.items() if value < 1
+        ))
@@ -1,7 +1,8 @@
 import random
 import uuid
 from datetime import datetime, timedelta
-from api.db import create_lost_items_table, create_office_accounts_table, save_office_account_to_sqlite, insert_lost_item
+from api.db import create_lost_items_table, create_office_accounts_table, create_records_table, save_office_account_to_sqlite, insert_lost_item
+from api.migrations import run_migrations
 from api.office_account import hash_password
 
 class MockOffice:
@@ -44,6 +45,8 @@ def seed_database():
     # 1. Inicjalizacja tabel
     create_office_accounts_table()
     create_lost_items_table()
+    create_records_table()
+    run_migrations()
 
     # 2. Tworzenie 3 Urzędów
     offices_data = [
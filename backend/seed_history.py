@@ -1,9 +1,5 @@
 import random
 import uuid
-import io
-import csv
-import hashlib
-import sqlite3
 from datetime import datetime, timedelta, date
 
 # Import funkcji z Twojego modułu db
@@ -13,10 +9,10 @@ from api.db import (
     create_records_table,
     save_office_account_to_sqlite, 
     insert_lost_item, 
-    get_all_lost_items, 
-    insert_ds,
-    DATABASE_NAME
+    get_connection
 )
+from gen_csv import gen_lost_items_csv
+from api.migrations import run_migrations
 from api.office_account import hash_password
 
 # --- KLASY POMOCNICZE (DTO) ---
@@ -51,48 +47,21 @@ class MockItem:
         self.telefon_kontaktowy = telefon_kontaktowy
         self.status = status
 
-# --- GENERATOR CSV I MD5 ---
-def generate_csv_string(powiat_slug):
-    """
-    Generuje treść CSV na podstawie aktualnego stanu bazy dla danego powiatu.
-    """
-    lost_items = get_all_lost_items(powiat=powiat_slug)
-    
-    field_names = [
-        'id_ewidencyjny', 'powiat', 'data_znalezienia', 'data_przekazania',
-        'data_publikacji', 'kategoria', 'opis', 'miejsce_znalezienia',
-        'adres_odbioru', 'email_kontaktowy', 'telefon_kontaktowy', 'status'
-    ]
-
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=field_names, delimiter=';')
-    writer.writeheader()
-    
-    if lost_items:
-        for item in lost_items:
-            # Bezpieczne mapowanie pól (zabezpieczenie przed brakiem klucza)
-            row_to_write = {k: item.get(k, '') for k in field_names}
-            writer.writerow(row_to_write)
-
-    csv_content = output.getvalue()
-    output.close()
-    return csv_content
-
-def get_md5(data_string):
-    encoded_data = data_string.encode('utf-8')
-    return hashlib.md5(encoded_data).hexdigest()
-
 # --- CZYSZCZENIE BAZY ---
 def reset_database():
     """Usuwa tabele, aby zapewnić czysty start."""
     print("🧹 Czyszczenie starej bazy danych...")
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DROP TABLE IF EXISTS lost_items")
-    cursor.execute("DROP TABLE IF EXISTS office_accounts")
-    cursor.execute("DROP TABLE IF EXISTS records")
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS lost_items")
+        cursor.execute("DROP TABLE IF EXISTS office_accounts")
+        cursor.execute("DROP TABLE IF EXISTS records")
+        cursor.execute("DROP TABLE IF EXISTS record_deltas")
+        cursor.execute("DROP TABLE IF EXISTS lost_items_changes")
+        cursor.execute("DROP TABLE IF EXISTS powiat_changes")
+        cursor.execute("DROP TABLE IF EXISTS powiat_stats")
+        cursor.execute("DROP TABLE IF EXISTS lost_item_pickups")
+        cursor.execute("DROP TABLE IF EXISTS schema_version")
 
 # --- GŁÓWNA LOGIKA ---
 def seed_history():
@@ -105,6 +74,7 @@ def seed_history():
     create_office_accounts_table()
     create_lost_items_table()
     create_records_table()
+    run_migrations()
 
     # 3. Utwórz konto Warszawy (Bez sprawdzania authenticate_user, bo baza jest pusta)
     warsaw_data = {
@@ -173,16 +143,9 @@ def seed_history():
         print(f"   ✅ Dodano 10 nowych przedmiotów (Razem w bazie: {item_counter - 1})")
 
         # B. Wygeneruj migawkę (Snapshot) CSV
-        # Pobiera WSZYSTKIE przedmioty z bazy dla tego powiatu (czyli z tego dnia + dni poprzednich)
-        csv_content = generate_csv_string(warsaw_account.powiat)
-        
-        # C. Oblicz MD5
-        md5_sum = get_md5(csv_content)
-        
-        # D. Zapisz historię w tabeli records
-        # insert_ds(checksum, data, date_str, powiat)
-        if insert_ds(md5_sum, csv_content, date_str, warsaw_account.powiat):
-            print(f"   💾 Zapisano historyczny dataset dla {date_str} | MD5: {md5_sum[:8]}...")
+        # Pierwsza migawka to pełny punkt kontrolny, kolejne zapisują tylko nowe wiersze (delty)
+        if gen_lost_items_csv(warsaw_account.powiat, date_str):
+            print(f"   💾 Zapisano historyczny dataset dla {date_str}")
         else:
             print(f"   ⚠️ Błąd zapisu datasetu dla {date_str}")
 
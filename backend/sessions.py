@@ -0,0 +1,209 @@
+"""
+Sesje po stronie serwera. Ciasteczko zawiera tylko losowy identyfikator sesji, a dane
+(profil urzędu zapisany przy logowaniu) trzymane są w magazynie sesji: SQLite z LRU
+w pamięci procesu albo sama pamięć procesu (jeden proces, np. testy).
+
+Wybór magazynu: zmienna środowiskowa SESSION_STORE = sqlite (domyślnie) | memory.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from api.db import get_session, get_session_expiry, save_session, delete_session, purge_expired_sessions
+
+SESSION_CACHE_SIZE = 4096
+# Co ile zapisów sesji usuwać z bazy sesje wygasłe
+PURGE_EVERY_SAVES = 1000
+SESSION_ID_BYTES = 32
+
+
+class SessionStore(ABC):
+    """Interfejs magazynu sesji."""
+
+    @abstractmethod
+    def load(self, session_id):
+        """Zwraca (dane: dict, czas wygaśnięcia) albo None."""
+
+    @abstractmethod
+    def save(self, session_id, data, expires_at):
+        """Zapisuje dane sesji (dict) ważne do expires_at (czas uniksowy)."""
+
+    @abstractmethod
+    def delete(self, session_id):
+        """Usuwa sesję; brak sesji nie jest błędem."""
+
+    def get_expiry(self, session_id):
+        """Czas wygaśnięcia sesji albo None - magazyny mogą go odczytać taniej niż całe dane."""
+        loaded = self.load(session_id)
+        return loaded[1] if loaded else None
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, purge_every=PURGE_EVERY_SAVES):
+        self.purge_every = purge_every
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        row = get_session(session_id)
+        if row is None:
+            return None
+        data, expires_at = row
+        try:
+            return json.loads(data), expires_at
+        except ValueError:
+            return None
+
+    def save(self, session_id, data, expires_at):
+        save_session(session_id, json.dumps(data, ensure_ascii=False), expires_at)
+        with self._lock:
+            self._saves += 1
+            purge = self._saves % self.purge_every == 0
+        if purge:
+            purge_expired_sessions()
+
+    def delete(self, session_id):
+        delete_session(session_id)
+
+    def get_expiry(self, session_id):
+        return get_session_expiry(session_id)
+
+
+class CachedSessionStore(SessionStore):
+    """
+    LRU w pamięci procesu przed magazynem backend (None - tylko pamięć).
+    Trafienie w LRU potwierdzane jest w magazynie samym czasem wygaśnięcia (odczyt po kluczu,
+    bez danych i parsowania JSON). Sesja usunięta w innym procesie (wylogowanie, regenerate)
+    przestaje więc działać od razu, a zapisana na nowo (nowy czas wygaśnięcia) jest doczytywana.
+    """
+
+    def __init__(self, backend=None, max_entries=SESSION_CACHE_SIZE):
+        self.backend = backend
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, session_id, data, expires_at):
+        with self._lock:
+            self._entries[session_id] = (data, expires_at)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self, session_id):
+        with self._lock:
+            cached = self._entries.get(session_id)
+        if cached is not None:
+            data, expires_at = cached
+            if expires_at > time.time() and (
+                self.backend is None or self.backend.get_expiry(session_id) == expires_at
+            ):
+                with self._lock:
+                    if session_id in self._entries:
+                        self._entries.move_to_end(session_id)
+                return dict(data), expires_at
+            with self._lock:
+                if self._entries.get(session_id) is cached:
+                    del self._entries[session_id]
+        if self.backend is None:
+            return None
+        loaded = self.backend.load(session_id)
+        if loaded is not None:
+            self._remember(session_id, *loaded)
+        return loaded
+
+    def save(self, session_id, data, expires_at):
+        if self.backend is not None:
+            self.backend.save(session_id, data, expires_at)
+        self._remember(session_id, dict(data), expires_at)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+        if self.backend is not None:
+            self.backend.delete(session_id)
+
+
+def create_session_store(kind=None):
+    kind = (kind or os.environ.get('SESSION_STORE', 'sqlite')).lower()
+    if kind == 'sqlite':
+        return CachedSessionStore(SQLiteSessionStore())
+    if kind == 'memory':
+        return CachedSessionStore()
+    raise ValueError(f"Nieznany magazyn sesji: {kind}")
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, session_id=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.expires_at = expires_at
+        self.new = session_id is None
+        self.modified = False
+        self.previous_id = None
+
+    def regenerate(self):
+        """Nowy identyfikator sesji (np. po zalogowaniu) - chroni przed przejęciem znanego id."""
+        if self.session_id is not None and self.previous_id is None:
+            self.previous_id = self.session_id
+        self.session_id = None
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask SessionInterface zapisujący dane sesji w SessionStore zamiast w ciasteczku."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if session_id:
+            loaded = self.store.load(session_id)
+            if loaded is not None:
+                data, expires_at = loaded
+                return ServerSession(data, session_id, expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_id is not None:
+            self.store.delete(session.previous_id)
+            session.previous_id = None
+        if not session:
+            if session.session_id is not None:
+                self.store.delete(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        # Bez zmian zapisujemy tylko, gdy minęła połowa ważności (przedłużenie sesji)
+        stale = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not session.modified and not stale:
+            return
+        if session.session_id is None:
+            session.session_id = secrets.token_urlsafe(SESSION_ID_BYTES)
+        session.expires_at = now + lifetime
+        self.store.save(session.session_id, dict(session), session.expires_at)
+        response.set_cookie(
+            name, session.session_id,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
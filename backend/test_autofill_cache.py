@@ -0,0 +1,37 @@
+from api.connection import close_connections
+from cache.cache import AutofillCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return AutofillCache(db_path=str(tmp_path / 'autofill.db'), **kwargs)
+
+
+def test_similar_photo_hits_cached_result(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.put(['a'], {'opis': 'parasol'}, phashes=[0b1010])
+    assert cache.get_similar([0b1011]) == ({'opis': 'parasol'}, 1)
+    close_connections()
+
+
+def test_evicted_entries_leave_the_phash_tree(tmp_path):
+    cache = make_cache(tmp_path, max_entries=1)
+    assert cache.put(['a'], {'opis': 'parasol'}, phashes=[0])
+    assert cache.get_similar([0]) is not None
+    # Drugi wpis wypiera pierwszy (LRU) - jego hash nie może zostać w drzewie
+    assert cache.put(['b'], {'opis': 'rower'}, phashes=[(1 << 64) - 1])
+    assert cache.get_similar([0]) is None
+    assert cache._phash_tree.search(0, cache.phash_max_distance) == []
+    assert cache.get_similar([(1 << 64) - 1]) == ({'opis': 'rower'}, 0)
+    close_connections()
+
+
+def test_rows_written_after_eviction_are_loaded(tmp_path):
+    cache = make_cache(tmp_path, max_entries=1)
+    reader = make_cache(tmp_path, max_entries=1)
+    assert cache.put(['a'], {'opis': 'parasol'}, phashes=[0])
+    assert reader.get_similar([0]) is not None
+    assert cache.put(['b'], {'opis': 'rower'}, phashes=[(1 << 64) - 1])
+    assert cache.put(['c'], {'opis': 'klucze'}, phashes=[0x00FF00FF00FF00FF])
+    assert reader.get_similar([0x00FF00FF00FF00FF]) == ({'opis': 'klucze'}, 0)
+    assert reader.get_similar([0]) is None
+    close_connections()
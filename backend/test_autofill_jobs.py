@@ -0,0 +1,44 @@
+import itertools
+import time
+
+import app as app_module
+from autofill_jobs import AutofillJobQueue
+
+
+def finished_job(monkeypatch, fn):
+    jobs = AutofillJobQueue(workers=1)
+    monkeypatch.setattr(app_module, 'AUTOFILL_JOBS', jobs)
+    job = jobs.submit(fn)
+    deadline = time.monotonic() + 5
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+    return job
+
+
+def read_events(job_id, limit=10):
+    client = app_module.app.test_client()
+    response = client.get(f'/api/narzedzia/auto_uzupelnianie/{job_id}/zdarzenia', buffered=False)
+    # Ograniczamy liczbę kawałków - niekończący się strumień nie zawiesi testu
+    return list(itertools.islice(response.response, limit))
+
+
+def decode(chunks):
+    return ''.join(c.decode('utf-8') if isinstance(c, bytes) else c for c in chunks)
+
+
+def test_event_stream_ends_for_job_done_without_result(db_path, monkeypatch):
+    job = finished_job(monkeypatch, lambda job: None)
+    chunks = read_events(job.id)
+    assert len(chunks) < 10
+    assert 'event: wynik' in decode(chunks)
+
+
+def test_event_stream_ends_for_failed_job(db_path, monkeypatch):
+    def fail(job):
+        raise RuntimeError('model niedostępny')
+
+    job = finished_job(monkeypatch, fail)
+    chunks = read_events(job.id)
+    assert len(chunks) < 10
+    assert 'event: blad' in decode(chunks)
@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+from api.connection import get_connection
+
+
+def count_rows():
+    with get_connection() as conn:
+        return conn.execute("SELECT count(*) FROM t").fetchone()[0]
+
+
+@pytest.fixture
+def table(db_path):
+    with get_connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+
+
+def test_outer_failure_undoes_inner_writes(table):
+    with pytest.raises(RuntimeError):
+        with get_connection():
+            with get_connection() as conn:
+                conn.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError
+    assert count_rows() == 0
+
+
+def test_inner_failure_keeps_outer_writes(table):
+    with get_connection() as conn:
+        conn.execute("INSERT INTO t VALUES (1)")
+        with pytest.raises(RuntimeError):
+            with get_connection() as inner:
+                inner.execute("INSERT INTO t VALUES (2)")
+                raise RuntimeError
+    assert count_rows() == 1
+
+
+def test_nested_writes_commit_with_outer_block(table):
+    with get_connection():
+        with get_connection() as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+        with get_connection() as conn:
+            conn.execute("INSERT INTO t VALUES (2)")
+    assert count_rows() == 2
+
+
+def test_inner_rollback_after_transaction_is_gone_keeps_original_error(table):
+    with pytest.raises(sqlite3.OperationalError, match='boom'):
+        with get_connection():
+            with get_connection() as conn:
+                conn.execute("INSERT INTO t VALUES (1)")
+                # Tak jak przy SQLITE_FULL: SQLite wycofał całą transakcję przed wyjątkiem
+                conn.rollback()
+                raise sqlite3.OperationalError('boom')
+    assert count_rows() == 0
@@ -0,0 +1,66 @@
+import app as app_module
+from api.connection import get_connection
+from api.db import INSERT_LOST_ITEM_SQL, list_lost_items
+from app import encode_list_cursor, decode_list_cursor
+
+
+def add_item(number, found, powiat='testowo'):
+    with get_connection() as conn:
+        conn.execute(INSERT_LOST_ITEM_SQL, (
+            f'TE-2024-{number:04d}', powiat, found, found, f'{found}T10:00:00',
+            'inne', 'Parasol', 'Rynek', 'ul. Długa 1', 'biuro@testowo.pl', '+48 123456789', 'do_odbioru',
+        ))
+
+
+def walk(client, limit=3, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, limit=limit, **({'cursor': cursor} if cursor else {}))
+        response = client.get('/api/rzeczy_znalezione', query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        ids += [item['id_ewidencyjny'] for item in body['wyniki']]
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+def test_pages_cover_all_rows_once_with_ties(schema):
+    # Wiele rekordów z tą samą datą - kolejność rozstrzyga id_ewidencyjny
+    for number in range(1, 9):
+        add_item(number, f'2024-01-0{1 + number % 3}')
+    expected, _ = list_lost_items({}, limit=100)
+    ids, pages = walk(app_module.app.test_client())
+    assert ids == [item['id_ewidencyjny'] for item in expected]
+    assert len(set(ids)) == 8 and pages == 3
+
+
+def test_rows_added_between_pages_do_not_shift_pages(schema):
+    for number in range(1, 7):
+        add_item(number, '2024-01-01')
+    first, has_more = list_lost_items({}, sort='id_ewidencyjny', descending=False, limit=3)
+    assert has_more
+    # Nowy rekord przed kursorem nie przesuwa kolejnej strony (w przeciwieństwie do OFFSET)
+    add_item(0, '2024-01-01')
+    last = first[-1]
+    second, has_more = list_lost_items(
+        {}, sort='id_ewidencyjny', descending=False, after=(last['id_ewidencyjny'], last['id_ewidencyjny']), limit=3
+    )
+    assert [item['id_ewidencyjny'] for item in second] == ['TE-2024-0004', 'TE-2024-0005', 'TE-2024-0006']
+    assert not has_more
+
+
+def test_cursor_is_bound_to_sort_order():
+    cursor = encode_list_cursor('data_znalezienia', True, '2024-01-01', 'TE-2024-0001')
+    assert decode_list_cursor(cursor, 'data_znalezienia', True) == ('2024-01-01', 'TE-2024-0001')
+    assert decode_list_cursor(cursor, 'data_znalezienia', False) is None
+    assert decode_list_cursor(cursor, 'data_publikacji', True) is None
+    assert decode_list_cursor('nie-kursor', 'data_znalezienia', True) is None
+
+
+def test_invalid_cursor_is_rejected(schema):
+    client = app_module.app.test_client()
+    cursor = encode_list_cursor('id_ewidencyjny', False, 'TE-2024-0001', 'TE-2024-0001')
+    response = client.get('/api/rzeczy_znalezione', query_string={'cursor': cursor})
+    assert response.status_code == 400
@@ -0,0 +1,47 @@
+from api.connection import get_connection
+from api.db import insert_lost_item, insert_lost_items
+from api.lost_item import LostItem
+
+ITEM_DATA = {
+    'data_znalezienia': '2024-01-01',
+    'data_przekazania': '2024-01-02',
+    'kategoria': 'klucze',
+    'opis': 'Pęk kluczy z brelokiem',
+    'miejsce_znalezienia': 'Rynek',
+    'status': 'do_odbioru',
+}
+
+
+def make_item():
+    return LostItem(dict(ITEM_DATA), 'TE', 'testowo', 'ul. Długa 1', 'biuro@testowo.pl', '+48 123456789')
+
+
+def test_ids_come_from_consecutive_sequence_numbers(schema):
+    first, second = make_item(), make_item()
+    assert insert_lost_item(first)
+    assert insert_lost_item(second)
+    assert first.id_ewidencyjny == f'TE-{first.id_year}-0001'
+    assert second.id_ewidencyjny == f'TE-{second.id_year}-0002'
+
+
+def test_bulk_insert_reserves_one_block(schema):
+    items = [make_item() for _ in range(3)]
+    assert insert_lost_item(make_item())
+    assert insert_lost_items(items)
+    assert [item.id_ewidencyjny[-4:] for item in items] == ['0002', '0003', '0004']
+
+
+def test_ids_past_9999_pass_validation(schema):
+    item = make_item()
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT INTO id_sequences (prefix, year, last_value) VALUES (?, ?, ?)", ('TE', item.id_year, 9999)
+        )
+    assert insert_lost_item(item)
+    assert item.id_ewidencyjny == f'TE-{item.id_year}-10000'
+    assert item.validation_errors() == []
+
+
+def test_invalid_prefix_fails_validation_before_insert():
+    item = LostItem(dict(ITEM_DATA), 'te1', 'testowo', 'ul. Długa 1', 'biuro@testowo.pl', '+48 123456789')
+    assert [error['field'] for error in item.validation_errors()] == ['id_ewidencyjny']
@@ -0,0 +1,49 @@
+import numpy as np
+
+from api.connection import get_connection
+from api.db import INSERT_LOST_ITEM_SQL
+from matching import EmbeddingIndex, quantize
+
+MODEL = 'test-model'
+
+
+def add_item(item_id, powiat, kategoria, data_znalezienia, vector):
+    scale, blob = quantize(np.asarray(vector, dtype=np.float32))
+    with get_connection() as conn:
+        conn.execute(INSERT_LOST_ITEM_SQL, (
+            item_id, powiat, data_znalezienia, None, '2024-01-02T10:00:00', kategoria, 'opis',
+            None, 'ul. Długa 1', 'biuro@example.pl', '+48 123456789', 'do_odbioru',
+        ))
+        conn.execute(
+            "INSERT INTO lost_item_embeddings (id_ewidencyjny, model, scale, vector) VALUES (?, ?, ?, ?)",
+            (item_id, MODEL, scale, blob)
+        )
+
+
+def test_search_filters_by_powiat_category_and_date(schema):
+    # Powiaty przeplatane przy wstawianiu - indeks i tak musi je pogrupować
+    add_item('A-1', 'bbb', 'klucze', '2024-01-01', [1, 0])
+    add_item('B-1', 'aaa', 'klucze', '2024-01-05', [1, 0])
+    add_item('A-2', 'bbb', 'inne', '2024-01-03', [0.6, 0.8])
+    add_item('B-2', 'aaa', 'inne', '2024-01-02', [0, 1])
+    add_item('A-3', 'bbb', 'klucze', '2024-01-09', [0, 1])
+    index = EmbeddingIndex(MODEL)
+    assert index.refresh()
+    query = np.array([1, 0], dtype=np.float32)
+
+    assert [item_id for item_id, _ in index.search(query, 10, powiat='bbb')] == ['A-1', 'A-2', 'A-3']
+    assert [item_id for item_id, _ in index.search(query, 10, powiat='bbb', kategoria='klucze')] == ['A-1', 'A-3']
+    assert [item_id for item_id, _ in index.search(query, 10, powiat='bbb', date_from='2024-01-02',
+                                                   date_to='2024-01-05')] == ['A-2']
+    assert [item_id for item_id, _ in index.search(query, 1)] in (['A-1'], ['B-1'])
+    assert index.search(query, 10, powiat='ccc') == []
+
+
+def test_refresh_reloads_only_after_table_changes(schema):
+    add_item('A-1', 'aaa', 'klucze', '2024-01-01', [1, 0])
+    index = EmbeddingIndex(MODEL)
+    assert index.refresh()
+    assert not index.refresh()
+    add_item('A-2', 'aaa', 'klucze', '2024-01-01', [0, 1])
+    assert index.refresh()
+    assert len(index.data.ids) == 2
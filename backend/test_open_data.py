@@ -0,0 +1,44 @@
+import time
+
+import pytest
+from werkzeug.http import http_date
+
+import app as app_module
+from api.db import insert_snapshot, get_ds_info
+
+POWIAT = 'testowo'
+CSV_URL = f'/api/open-data/{POWIAT}/2024-01-01/data.csv'
+
+
+def save_full(md5, moment):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(time, 'time', lambda: moment)
+        assert insert_snapshot(POWIAT, '2024-01-01', md5, 'full', 1, data='id_ewidencyjny\n')
+
+
+def test_csv_last_modified_is_snapshot_write_time(schema):
+    save_full('a' * 32, 1704103200.0)
+    client = app_module.app.test_client()
+
+    response = client.get(CSV_URL)
+    assert response.status_code == 200
+    assert response.get_data() == b'id_ewidencyjny\n'
+    assert response.headers['Last-Modified'] == http_date(1704103200.0)
+
+    cached = client.get(CSV_URL, headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert cached.status_code == 304
+
+
+def test_csv_rewritten_same_day_is_modified(schema):
+    save_full('a' * 32, 1704103200.0)
+    client = app_module.app.test_client()
+    first = client.get(CSV_URL)
+    first.close()
+
+    # Ta sama data migawki, nowszy zapis - IMS z pierwszego pobrania nie może dać 304
+    save_full('b' * 32, 1704103200.0 + 3600)
+    assert get_ds_info(POWIAT, '2024-01-01')['created_at'] == 1704103200.0 + 3600
+    response = client.get(CSV_URL, headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert response.status_code == 200
+    assert response.get_data() == b'id_ewidencyjny\n'
+    assert response.headers['Last-Modified'] == http_date(1704103200.0 + 3600)
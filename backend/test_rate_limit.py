@@ -0,0 +1,64 @@
+import pytest
+
+import app as app_module
+import rate_limit
+from rate_limit import TokenBucketLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit, 'time', fake)
+    return fake
+
+
+def make_limiter():
+    return TokenBucketLimiter(capacity=3, refill_per_s=1.0, scopes={'login': (1, 0.1)})
+
+
+def test_rejected_request_spends_no_tokens(clock):
+    limiter = make_limiter()
+    assert limiter.acquire(('ip', 'a'), ('login', 'x')) == 0
+    # Login wyczerpany - odrzucone próby nie mogą zużywać żetonów adresu IP
+    for _ in range(5):
+        assert limiter.acquire(('ip', 'a'), ('login', 'x')) == 10
+    assert limiter.acquire(('ip', 'a'), ('login', 'y')) == 0
+    assert limiter.acquire(('ip', 'a'), ('login', 'z')) == 0
+    assert limiter.acquire(('ip', 'a'), ('login', 'w')) > 0
+
+
+def test_scopes_have_own_limits(clock):
+    limiter = make_limiter()
+    for _ in range(3):
+        assert limiter.acquire(('ip', 'a')) == 0
+    assert limiter.acquire(('ip', 'a')) == 1
+    clock.now += 1
+    assert limiter.acquire(('ip', 'a')) == 0
+
+    assert limiter.acquire(('login', 'x')) == 0
+    clock.now += 5
+    assert limiter.acquire(('login', 'x')) == 5
+
+
+def test_login_limit_ignores_case_and_whitespace(db_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'LOGIN_LIMITER', TokenBucketLimiter(
+        capacity=100, refill_per_s=0.001, scopes={'login': (2, 0.001)}
+    ))
+    monkeypatch.setattr(app_module, 'authenticate_user', lambda *args, **kwargs: None)
+    looked_up = []
+    monkeypatch.setattr(app_module.ACCOUNT_CACHE, 'get', looked_up.append)
+    client = app_module.app.test_client()
+    statuses = [
+        client.post('/api/konta/logowanie', json={'email': email, 'password': 'zle'}).status_code
+        for email in ('Admin@um.pl', ' admin@um.pl', 'ADMIN@UM.PL ')
+    ]
+    assert statuses == [401, 401, 429]
+    assert looked_up == ['admin@um.pl', 'admin@um.pl']
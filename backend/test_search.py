@@ -0,0 +1,40 @@
+from api.connection import get_connection
+from api.db import INSERT_LOST_ITEM_SQL, search_lost_items
+from api.search import build_fts_query, MAX_QUERY_TERMS
+
+
+def add_item(number, opis, kategoria='inne', powiat='testowo'):
+    with get_connection() as conn:
+        conn.execute(INSERT_LOST_ITEM_SQL, (
+            f'TE-2024-{number:04d}', powiat, '2024-01-01', '2024-01-02', '2024-01-02T10:00:00',
+            kategoria, opis, 'Rynek', 'ul. Długa 1', 'biuro@testowo.pl', '+48 123456789', 'do_odbioru',
+        ))
+
+
+def test_build_fts_query_stems_and_quotes_terms():
+    assert build_fts_query('Portfel skórzany') == '("portf"*) AND ("skórza"*)'
+    assert build_fts_query('klucz') == '("klucz"* OR "kłucz"*)'
+
+
+def test_build_fts_query_ignores_operators_and_punctuation():
+    # Składnia FTS5 z wejścia użytkownika nie przechodzi do wyrażenia MATCH
+    assert build_fts_query('"kot" OR NEAR(pies)*') == build_fts_query('kot or near pies')
+    assert build_fts_query('  ?!  ') is None
+    assert build_fts_query(None) is None
+
+
+def test_build_fts_query_limits_terms():
+    query = build_fts_query(' '.join(f'slowo{i}' for i in range(MAX_QUERY_TERMS + 4)))
+    assert query.count(' AND ') == MAX_QUERY_TERMS - 1
+
+
+def test_search_matches_inflected_forms_and_l_variants(schema):
+    add_item(1, 'Czarny portfel ze skóry')
+    add_item(2, 'Złoty łańcuszek', kategoria='bizuteria_i_zegarki')
+    add_item(3, 'Parasol')
+
+    assert [item['id_ewidencyjny'] for item in search_lost_items('portfela')] == ['TE-2024-0001']
+    # Bez polskich znaków: "ń" składa tokenizer, "ł" - wariant z build_fts_query
+    assert search_lost_items('zloty lancuszek')[0]['id_ewidencyjny'] == 'TE-2024-0002'
+    assert search_lost_items('portfel', powiat='inny') == []
+    assert search_lost_items('"') == []
@@ -0,0 +1,42 @@
+import time
+
+from sessions import CachedSessionStore, SQLiteSessionStore
+
+
+def worker_store():
+    return CachedSessionStore(SQLiteSessionStore())
+
+
+def test_session_deleted_in_one_worker_stops_working_in_another(schema):
+    first, second = worker_store(), worker_store()
+    expires_at = time.time() + 3600
+    first.save('sid', {'powiat': 'testowo'}, expires_at)
+    assert second.load('sid') == ({'powiat': 'testowo'}, expires_at)
+
+    first.delete('sid')
+    assert second.load('sid') is None
+
+
+def test_session_saved_in_one_worker_is_reloaded_in_another(schema):
+    first, second = worker_store(), worker_store()
+    first.save('sid', {'powiat': 'testowo'}, time.time() + 3600)
+    assert second.load('sid')[0] == {'powiat': 'testowo'}
+
+    expires_at = time.time() + 7200
+    first.save('sid', {'powiat': 'inny'}, expires_at)
+    assert second.load('sid') == ({'powiat': 'inny'}, expires_at)
+
+
+def test_expired_session_is_not_returned(schema):
+    store = worker_store()
+    store.save('sid', {'powiat': 'testowo'}, time.time() - 1)
+    assert store.load('sid') is None
+
+
+def test_memory_store_keeps_sessions_without_backend():
+    store = CachedSessionStore()
+    expires_at = time.time() + 3600
+    store.save('sid', {'powiat': 'testowo'}, expires_at)
+    assert store.load('sid') == ({'powiat': 'testowo'}, expires_at)
+    store.delete('sid')
+    assert store.load('sid') is None
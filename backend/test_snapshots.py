@@ -0,0 +1,71 @@
+import hashlib
+
+from api.connection import get_connection
+from api.db import INSERT_LOST_ITEM_SQL, get_ds_info
+from gen_csv import gen_lost_items_csv, iter_lost_items_csv, rebuild_snapshot_csv
+
+POWIAT = 'testowo'
+
+
+def add_item(number, opis='Parasol', powiat=POWIAT):
+    with get_connection() as conn:
+        conn.execute(INSERT_LOST_ITEM_SQL, (
+            f'TE-2024-{number:04d}', powiat, '2024-01-01', '2024-01-02', '2024-01-02T10:00:00',
+            'inne', opis, 'Rynek; przy fontannie', 'ul. Długa 1', 'biuro@testowo.pl', '+48 123456789',
+            'do_odbioru',
+        ))
+
+
+def set_opis(number, opis):
+    with get_connection() as conn:
+        conn.execute("UPDATE lost_items SET opis = ? WHERE id_ewidencyjny = ?", (opis, f'TE-2024-{number:04d}'))
+
+
+def current_csv():
+    return ''.join(iter_lost_items_csv(POWIAT))
+
+
+def test_delta_rebuild_matches_full_csv(schema):
+    for number in range(1, 6):
+        add_item(number)
+    assert gen_lost_items_csv(POWIAT, '2024-01-01')
+
+    set_opis(2, 'Parasol "czarny", złamany')
+    with get_connection() as conn:
+        conn.execute("DELETE FROM lost_items WHERE id_ewidencyjny = 'TE-2024-0003'")
+    add_item(6, opis='Klucze\nz brelokiem')
+    assert gen_lost_items_csv(POWIAT, '2024-01-02')
+
+    info = get_ds_info(POWIAT, '2024-01-02')
+    assert info['kind'] == 'delta'
+    assert rebuild_snapshot_csv(POWIAT, '2024-01-02') == current_csv()
+
+
+def test_md5_is_content_hash_for_checkpoints_and_deltas(schema):
+    add_item(1)
+    assert gen_lost_items_csv(POWIAT, '2024-01-01')
+    set_opis(1, 'Rower')
+    assert gen_lost_items_csv(POWIAT, '2024-01-02')
+
+    expected = hashlib.md5(current_csv().encode('utf-8')).hexdigest()
+    assert get_ds_info(POWIAT, '2024-01-02')['md5'] == expected
+
+
+def test_state_equal_to_older_snapshot_is_published(schema):
+    add_item(1)
+    assert gen_lost_items_csv(POWIAT, '2024-01-01')
+    set_opis(1, 'Rower')
+    assert gen_lost_items_csv(POWIAT, '2024-01-02')
+    set_opis(1, 'Parasol')
+    assert gen_lost_items_csv(POWIAT, '2024-01-03')
+
+    assert rebuild_snapshot_csv(POWIAT, '2024-01-03') == current_csv()
+    assert get_ds_info(POWIAT, '2024-01-03')['md5'] == get_ds_info(POWIAT, '2024-01-01')['md5']
+
+
+def test_unchanged_content_is_not_snapshotted(schema):
+    add_item(1)
+    assert gen_lost_items_csv(POWIAT, '2024-01-01')
+    set_opis(1, 'Parasol')
+    assert not gen_lost_items_csv(POWIAT, '2024-01-02')
+    assert get_ds_info(POWIAT, '2024-01-02') is None
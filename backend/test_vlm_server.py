@@ -0,0 +1,22 @@
+from vlm_server import BatchingWorker, iter_job_events
+
+
+def make_worker(max_batch=4):
+    return BatchingWorker(None, None, max_batch=max_batch, max_wait_s=0.01, queue_size=8)
+
+
+def test_cancelled_jobs_are_not_batched():
+    worker = make_worker()
+    first, abandoned, last = (worker.submit([name]) for name in ('a', 'b', 'c'))
+    abandoned.cancel()
+
+    assert worker._collect_batch() == [first, last]
+    assert abandoned.done.is_set()
+
+
+def test_stream_timeout_cancels_the_job():
+    worker = make_worker()
+    job = worker.submit(['a'])
+    events = list(iter_job_events(job, timeout_s=0))
+    assert 'error' in events[-1]
+    assert job.cancelled
@@ -0,0 +1,323 @@
+"""
+Tłumaczenie opisów generowanych przez VLM (angielski -> polski).
+
+Backend wybierany zmienną TRANSLATOR (lub --translator w vlm_server.py):
+  nllb   - lokalny model facebook/nllb-200-distilled-600M na CPU/GPU, bez dostępu do sieci
+  google - publiczny endpoint Google Translate (z limitem czasu i ponowieniami)
+  none   - bez tłumaczenia
+Wyniki zapamiętywane są w pamięci tłumaczeń: LRU w procesie + tabela SQLite.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import requests
+
+from api.connection import get_connection
+
+DEFAULT_BACKEND = 'nllb'
+NLLB_MODEL = 'facebook/nllb-200-distilled-600M'
+# Kody języków NLLB (FLORES-200)
+NLLB_LANG_CODES = {'pl': 'pol_Latn', 'en': 'eng_Latn', 'de': 'deu_Latn', 'uk': 'ukr_Cyrl'}
+NLLB_BATCH_SIZE = 16
+NLLB_MAX_LENGTH = 256
+
+GOOGLE_URL = "https://translate.googleapis.com/translate_a/single"
+GOOGLE_TIMEOUT_S = 10
+GOOGLE_RETRIES = 3
+
+DEFAULT_MEMORY_DB = 'translation_memory.db'
+MEMORY_LRU_SIZE = 2048
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+class TranslationError(Exception):
+    """Backend nie zdołał przetłumaczyć tekstu."""
+
+
+def split_sentences(text):
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+
+class Translator(ABC):
+    """Interfejs backendu tłumaczeń."""
+    name = 'base'
+
+    @property
+    def memory_id(self):
+        """Identyfikator wyników w pamięci tłumaczeń - inny model musi dawać inne klucze."""
+        return self.name
+
+    @abstractmethod
+    def translate_batch(self, texts, target_lang='pl', source_lang='en'):
+        """Tłumaczy listę tekstów; zgłasza TranslationError, gdy się nie uda."""
+
+    def translate(self, text, target_lang='pl', source_lang='en'):
+        return self.translate_batch([text], target_lang, source_lang)[0]
+
+    def warm_up(self):
+        """Ładuje zasoby backendu z góry (np. model), żeby nie robić tego przy pierwszym zgłoszeniu."""
+
+
+class NoopTranslator(Translator):
+    name = 'none'
+
+    def translate_batch(self, texts, target_lang='pl', source_lang='en'):
+        return list(texts)
+
+
+class GoogleTranslator(Translator):
+    name = 'google'
+
+    def __init__(self, timeout_s=GOOGLE_TIMEOUT_S, retries=GOOGLE_RETRIES):
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.session = requests.Session()
+
+    def _translate_one(self, text, target_lang):
+        params = {
+            "client": "gtx",      # <--- To jest klucz! 'gtx' to klient publiczny
+            "sl": "auto",         # Source Language: auto-wykrywanie
+            "tl": target_lang,    # Target Language: na jaki język (np. 'pl')
+            "dt": "t",            # Data Type: 't' oznacza translation
+            "q": text             # Tekst do przetłumaczenia
+        }
+        last_error = None
+        for attempt in range(self.retries):
+            try:
+                response = self.session.get(GOOGLE_URL, params=params, timeout=self.timeout_s)
+                response.raise_for_status()
+                data = response.json()
+                return "".join([sentence[0] for sentence in data[0] if sentence[0]])
+            except (requests.RequestException, ValueError, IndexError, TypeError) as e:
+                last_error = e
+                if attempt + 1 < self.retries:
+                    time.sleep(0.5 * 2 ** attempt)
+        raise TranslationError(f"Google Translate: {last_error}")
+
+    def translate_batch(self, texts, target_lang='pl', source_lang='en'):
+        return [self._translate_one(text, target_lang) for text in texts]
+
+
+class NLLBTranslator(Translator):
+    """
+    Lokalny model NLLB. Teksty dzielone są na zdania, a zdania wszystkich tekstów
+    tłumaczone partiami po batch_size - krótkie sekwencje to mniej dopełnienia i krótsze generowanie.
+    """
+    name = 'nllb'
+
+    def __init__(self, model_path=NLLB_MODEL, device='cpu', cache_dir=None,
+                 batch_size=NLLB_BATCH_SIZE, max_length=NLLB_MAX_LENGTH):
+        self.model_path = model_path
+        self.device = device
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def memory_id(self):
+        return f"{self.name}:{self.model_path}"
+
+    def warm_up(self):
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        if self._model is None:
+            # Brak transformers/torch, modelu w cache (host bez sieci) albo zła ścieżka
+            # to błąd tłumaczenia - wywołujący zwróci wtedy tekst bez tłumaczenia
+            try:
+                from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+                print(f"--- Ładowanie modelu tłumaczeń {self.model_path} ({self.device}) ---")
+                tokenizer = AutoTokenizer.from_pretrained(self.model_path, cache_dir=self.cache_dir)
+                model = AutoModelForSeq2SeqLM.from_pretrained(self.model_path, cache_dir=self.cache_dir).to(self.device)
+            except (OSError, ValueError, ImportError) as e:
+                raise TranslationError(f"NLLB: nie udało się załadować modelu {self.model_path}: {e}")
+            model.eval()
+            self._tokenizer, self._model = tokenizer, model
+        return self._tokenizer, self._model
+
+    def translate_batch(self, texts, target_lang='pl', source_lang='en'):
+        try:
+            import torch
+        except ImportError as e:
+            raise TranslationError(f"NLLB: {e}")
+
+        if target_lang not in NLLB_LANG_CODES or source_lang not in NLLB_LANG_CODES:
+            raise TranslationError(f"NLLB: nieobsługiwany język {source_lang} -> {target_lang}")
+        sentences = []
+        spans = []
+        for text in texts:
+            parts = split_sentences(text)
+            spans.append((len(sentences), len(sentences) + len(parts)))
+            sentences.extend(parts)
+
+        translated = []
+        with self._lock:
+            tokenizer, model = self._load()
+            tokenizer.src_lang = NLLB_LANG_CODES[source_lang]
+            target_token = tokenizer.convert_tokens_to_ids(NLLB_LANG_CODES[target_lang])
+            try:
+                for start in range(0, len(sentences), self.batch_size):
+                    inputs = tokenizer(
+                        sentences[start:start + self.batch_size], return_tensors='pt', padding=True,
+                        truncation=True, max_length=self.max_length
+                    ).to(model.device)
+                    with torch.inference_mode():
+                        generated = model.generate(
+                            **inputs, forced_bos_token_id=target_token, max_new_tokens=self.max_length
+                        )
+                    translated.extend(tokenizer.batch_decode(generated, skip_special_tokens=True))
+            except RuntimeError as e:
+                raise TranslationError(f"NLLB: {e}")
+        return [' '.join(translated[start:end]) for start, end in spans]
+
+
+class TranslationMemory:
+    """Pamięć tłumaczeń: LRU w procesie przed tabelą SQLite (klucz - tekst źródłowy, języki i model)."""
+
+    def __init__(self, db_path=DEFAULT_MEMORY_DB, lru_size=MEMORY_LRU_SIZE):
+        self.db_path = db_path
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    @staticmethod
+    def key(text, target_lang, source_lang, backend_id):
+        return hashlib.sha256(f"{backend_id}\0{source_lang}\0{target_lang}\0{text}".encode('utf-8')).hexdigest()
+
+    def _ensure_table(self, conn):
+        if self._ready:
+            return
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS translation_memory (
+                key TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._ready = True
+
+    def _remember(self, key, translation):
+        with self._lock:
+            self._lru[key] = translation
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def get_many(self, keys):
+        """Zwraca słownik klucz -> tłumaczenie dla znalezionych kluczy."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+        missing = [key for key in keys if key not in found]
+        if not missing:
+            return found
+        try:
+            with get_connection(self.db_path) as conn:
+                self._ensure_table(conn)
+                placeholders = ', '.join('?' * len(missing))
+                rows = conn.execute(
+                    f"SELECT key, translation FROM translation_memory WHERE key IN ({placeholders})", missing
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"❌ Błąd SQLite pamięci tłumaczeń: {e}")
+            return found
+        for row in rows:
+            found[row['key']] = row['translation']
+            self._remember(row['key'], row['translation'])
+        return found
+
+    def put_many(self, entries):
+        """entries: lista (klucz, tekst źródłowy, tłumaczenie)."""
+        for key, _, translation in entries:
+            self._remember(key, translation)
+        try:
+            with get_connection(self.db_path) as conn:
+                self._ensure_table(conn)
+                now = time.time()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO translation_memory (key, source, translation, created_at) VALUES (?, ?, ?, ?)",
+                    [(key, source, translation, now) for key, source, translation in entries]
+                )
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Błąd SQLite pamięci tłumaczeń: {e}")
+            return False
+
+
+class CachedTranslator(Translator):
+    """Backend z pamięcią tłumaczeń - model wołany tylko dla tekstów, których jeszcze nie tłumaczono."""
+
+    def __init__(self, backend, memory):
+        self.backend = backend
+        self.memory = memory
+        self.name = backend.name
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def translate_batch(self, texts, target_lang='pl', source_lang='en'):
+        keys = [self.memory.key(text, target_lang, source_lang, self.backend.memory_id) for text in texts]
+        found = self.memory.get_many(list(dict.fromkeys(keys)))
+        todo = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        if todo:
+            translated = self.backend.translate_batch(todo, target_lang, source_lang)
+            entries = []
+            for text, translation in zip(todo, translated):
+                key = self.memory.key(text, target_lang, source_lang, self.backend.memory_id)
+                found[key] = translation
+                entries.append((key, text, translation))
+            self.memory.put_many(entries)
+        return [found[key] for key in keys]
+
+
+_translator = None
+_translator_lock = threading.Lock()
+
+
+def create_translator(backend=None, memory_db=None, device=None, cache_dir=None):
+    backend = backend or os.environ.get('TRANSLATOR', DEFAULT_BACKEND)
+    if backend == 'none':
+        return NoopTranslator()
+    if backend == 'google':
+        translator = GoogleTranslator()
+    elif backend == 'nllb':
+        translator = NLLBTranslator(
+            model_path=os.environ.get('TRANSLATOR_PATH', NLLB_MODEL),
+            device=device or os.environ.get('TRANSLATOR_DEVICE', 'cpu'),
+            cache_dir=cache_dir or os.environ.get('HF_CACHE_DIR'),
+        )
+    else:
+        raise ValueError(f"Nieznany backend tłumaczeń: {backend}")
+    memory = TranslationMemory(memory_db or os.environ.get('TRANSLATION_MEMORY_DB', DEFAULT_MEMORY_DB))
+    return CachedTranslator(translator, memory)
+
+
+def get_translator():
+    """Wspólny dla procesu translator (tworzony przy pierwszym użyciu)."""
+    global _translator
+    with _translator_lock:
+        if _translator is None:
+            _translator = create_translator()
+        return _translator
+
+
+def set_translator(translator):
+    global _translator
+    with _translator_lock:
+        _translator = translator
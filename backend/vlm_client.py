@@ -0,0 +1,51 @@
+import json
+import requests
+from image_prep import encode_jpeg
+
+
+class VLMServerError(Exception):
+    """Serwer VLM jest niedostępny, przeciążony lub zwrócił błąd."""
+
+
+def request_autofill(server_url, images, timeout=120, on_partial=None):
+    """
+    Wysyła przygotowane zdjęcia (obrazy PIL, zob. image_prep) do serwera VLM (vlm_server.py)
+    i zwraca {'kategoria', 'opis'}. Zdjęcia przesyłane są jako zmniejszone JPEG-i.
+    Z on_partial odpowiedź jest strumieniowana, a on_partial(opis) dostaje częściowy opis.
+    """
+    files = [('photos', (f'{i}.jpg', encode_jpeg(image), 'image/jpeg')) for i, image in enumerate(images)]
+    try:
+        response = requests.post(
+            f"{server_url.rstrip('/')}/autofill", files=files, timeout=timeout,
+            params={'stream': 1} if on_partial else None, stream=bool(on_partial)
+        )
+    except requests.RequestException as e:
+        raise VLMServerError(f"Brak połączenia z serwerem VLM: {e}")
+    if response.status_code != 200:
+        try:
+            message = response.json().get('error')
+        except ValueError:
+            message = response.text
+        raise VLMServerError(f"Serwer VLM zwrócił {response.status_code}: {message}")
+    if on_partial is None:
+        return response.json()
+    return _read_event_stream(response, on_partial)
+
+
+def _read_event_stream(response, on_partial):
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if 'partial' in event:
+                on_partial(event['partial'])
+            elif 'result' in event:
+                return event['result']
+            elif 'error' in event:
+                raise VLMServerError(f"Serwer VLM zwrócił błąd: {event['error']}")
+    except (requests.RequestException, ValueError) as e:
+        raise VLMServerError(f"Przerwany strumień z serwera VLM: {e}")
+    finally:
+        response.close()
+    raise VLMServerError("Serwer VLM zakończył strumień bez wyniku")
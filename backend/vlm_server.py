@@ -0,0 +1,225 @@
+"""
+Długo działający serwer inferencji VLM dla auto-uzupełniania formularza.
+
+Model i procesor ładowane są raz przy starcie. Zgłoszenia z wielu wątków HTTP trafiają
+do ograniczonej kolejki, a jeden wątek roboczy łączy je w partie (do --max-batch
+zgłoszeń lub --max-wait-ms oczekiwania) i uruchamia jedno wsadowe generowanie.
+Serwer Flask (app.py) łączy się z nim przez VLM_SERVER_URL.
+
+Użycie: python vlm_server.py [--model ...] [--port 5001] [--threads 8] [--max-batch 4]
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+from flask import Flask, Response, request, jsonify
+from image_prep import prepare_images, max_pixels_for_model
+
+DEFAULT_MODEL = "HuggingFaceTB/SmolVLM2-2.2B-Instruct"
+
+server = Flask(__name__)
+
+
+class AutofillJob:
+    def __init__(self, images):
+        self.images = images
+        self.result = None
+        self.error = None
+        self.partial = ''
+        # Klient już nie czeka na wynik (przekroczony czas, zerwane połączenie)
+        self.cancelled = False
+        self.done = threading.Event()
+        self.updated = threading.Condition()
+
+    def set_partial(self, text):
+        with self.updated:
+            self.partial = text
+            self.updated.notify_all()
+
+    def finish(self):
+        with self.updated:
+            self.done.set()
+            self.updated.notify_all()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class BatchingWorker:
+    """Wątek zbierający zgłoszenia w partie i uruchamiający dla nich model."""
+
+    def __init__(self, processor, vlm, max_batch, max_wait_s, queue_size, single_pass=True):
+        self.processor = processor
+        self.vlm = vlm
+        self.single_pass = single_pass
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, name='vlm-batching', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, images):
+        """Dodaje zgłoszenie do kolejki. Zgłasza queue.Full, gdy kolejka jest pełna."""
+        job = AutofillJob(images)
+        self.jobs.put_nowait(job)
+        return job
+
+    def _collect_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            if deadline is None:
+                job = self.jobs.get()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if job.cancelled:
+                # Nikt nie odbierze wyniku - nie zajmujemy zgłoszeniem miejsca w partii
+                job.finish()
+                continue
+            batch.append(job)
+            if deadline is None:
+                deadline = time.monotonic() + self.max_wait_s
+        return batch
+
+    def _run(self):
+        # Import ciężkich zależności dopiero w wątku roboczym serwera
+        from ai import process_images_batch
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            try:
+                results = process_images_batch(
+                    self.processor, self.vlm, [job.images for job in batch], single_pass=self.single_pass,
+                    on_partial=lambda i, text: batch[i].set_partial(text)
+                )
+                for job, result in zip(batch, results):
+                    job.result = result
+            except Exception as e:
+                print(f"❌ Błąd inferencji VLM: {e}")
+                for job in batch:
+                    job.error = str(e)
+            finally:
+                for job in batch:
+                    job.finish()
+            print(f"Partia {len(batch)} zgłoszeń w {time.perf_counter() - started:.2f}s")
+
+
+@server.route('/zdrowie')
+def health():
+    return jsonify({'message': 'ok', 'queued': server.config['WORKER'].jobs.qsize()}), 200
+
+
+@server.route('/autofill', methods=['POST'])
+def autofill():
+    files_list = request.files.getlist('photos')
+    if not files_list:
+        return jsonify({'error': 'Nie znaleziono plików wejściowych'}), 400
+    try:
+        images = prepare_images([io.BytesIO(file.read()) for file in files_list], server.config['MAX_PIXELS'])
+    except Exception as e:
+        return jsonify({'error': f'Niepoprawny plik obrazu: {e}'}), 400
+    try:
+        job = server.config['WORKER'].submit(images)
+    except queue.Full:
+        return jsonify({'error': 'Serwer VLM przeciążony'}), 503
+    if request.args.get('stream'):
+        return Response(iter_job_events(job, server.config['REQUEST_TIMEOUT_S']), mimetype='application/x-ndjson')
+    if not job.done.wait(server.config['REQUEST_TIMEOUT_S']):
+        job.cancel()
+        return jsonify({'error': 'Przekroczono czas oczekiwania na model'}), 504
+    if job.error:
+        return jsonify({'error': job.error}), 500
+    return jsonify(job.result), 200
+
+
+def iter_job_events(job, timeout_s):
+    """
+    Strumień NDJSON: {"partial": opis} przy każdej zmianie częściowego opisu,
+    na końcu {"result": {...}} albo {"error": "..."}.
+    """
+    deadline = time.monotonic() + timeout_s
+    sent = ''
+    try:
+        while True:
+            with job.updated:
+                if not job.done.is_set() and job.partial == sent:
+                    job.updated.wait(max(0.0, min(1.0, deadline - time.monotonic())))
+                partial = job.partial
+            if job.done.is_set():
+                break
+            if partial != sent:
+                sent = partial
+                yield json.dumps({'partial': partial}, ensure_ascii=False) + '\n'
+            if time.monotonic() >= deadline:
+                yield json.dumps({'error': 'Przekroczono czas oczekiwania na model'}, ensure_ascii=False) + '\n'
+                return
+    finally:
+        # Przekroczony czas albo rozłączony klient (GeneratorExit) - zgłoszenie nie trafi do partii
+        if not job.done.is_set():
+            job.cancel()
+    if job.error:
+        yield json.dumps({'error': job.error}, ensure_ascii=False) + '\n'
+    else:
+        yield json.dumps({'result': job.result}, ensure_ascii=False) + '\n'
+
+
+def run_server(model_path, host, port, device, threads, max_batch, max_wait_ms, queue_size, timeout_s, cache_dir,
+               single_pass=True, max_pixels=None, translator=None):
+    import torch
+    from ai import get_vlm
+    from translation import create_translator, get_translator, set_translator, TranslationError
+
+    torch.set_num_threads(threads)
+    print(f"--- Ładowanie modelu {model_path} ({device}, {threads} wątków) ---")
+    processor, vlm = get_vlm(model_path, device=device, cache_path=cache_dir)
+    # Model tłumaczeń ładujemy od razu, a nie przy pierwszym zgłoszeniu
+    set_translator(create_translator(translator, device=device, cache_dir=cache_dir))
+    try:
+        get_translator().warm_up()
+    except TranslationError as e:
+        print(f"❌ {e} - opisy nie będą tłumaczone, dopóki model nie będzie dostępny")
+
+    worker = BatchingWorker(processor, vlm, max_batch, max_wait_ms / 1000, queue_size, single_pass=single_pass)
+    worker.start()
+    server.config['WORKER'] = worker
+    server.config['REQUEST_TIMEOUT_S'] = timeout_s
+    server.config['MAX_PIXELS'] = max_pixels or max_pixels_for_model(model_path)
+    print(f"--- Serwer VLM nasłuchuje na http://{host}:{port} ---")
+    server.run(host=host, port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serwer inferencji VLM z łączeniem zgłoszeń w partie.')
+    parser.add_argument('--model', default=os.environ.get('VLM_PATH', DEFAULT_MODEL))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='Liczba wątków torch na CPU.')
+    parser.add_argument('--max-batch', type=int, default=4, help='Maksymalna liczba zgłoszeń w jednej partii.')
+    parser.add_argument('--max-wait-ms', type=int, default=50, help='Jak długo czekać na dopełnienie partii.')
+    parser.add_argument('--queue-size', type=int, default=32, help='Maksymalna liczba zgłoszeń w kolejce.')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Limit czasu odpowiedzi na zgłoszenie (s).')
+    parser.add_argument('--cache-dir', default=os.environ.get('HF_CACHE_DIR'))
+    parser.add_argument('--two-pass', action='store_true',
+                        help='Osobne generowanie opisu i kategorii (domyślnie jeden przebieg).')
+    parser.add_argument('--translator', choices=['nllb', 'google', 'none'], default=None,
+                        help='Backend tłumaczenia opisów (domyślnie zmienna TRANSLATOR lub nllb).')
+    parser.add_argument('--max-pixels', type=int, default=None,
+                        help='Limit pikseli zdjęcia przed inferencją (domyślnie wg modelu, zob. image_prep.py).')
+    args = parser.parse_args()
+    run_server(args.model, args.host, args.port, args.device, args.threads, args.max_batch,
+               args.max_wait_ms, args.queue_size, args.timeout, args.cache_dir,
+               single_pass=not args.two_pass, max_pixels=args.max_pixels,
+               translator=args.translator)